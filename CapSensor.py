@@ -1,59 +1,50 @@
 
 import serial
 import time
-import sys
 import os
-from PIL import Image
-import re
-import datetime
 import threading
 import sqlite3
-import torch
-import torch.nn as nn
-from torchvision import models, transforms
-from collections import OrderedDict
+from collections import deque
+from capture import decode_capacitive_image, CAPACITIVE_WIDTH, CAPACITIVE_HEIGHT
+from capture_log import CaptureLog, LOG_QUEUE_SIZE
+from spoof_model import (SpoofDetector, MODEL_PATH, BURST_FRAMES, BURST_RECHECK,
+                         run_spoof_check, VERDICT_LIVE)
+from archive_writer import ImageArchiveWriter, POLICY_BLOCK
+from capture_quality import assess_quality, QUALITY_RETRIES
+from capture_store import capture_path, save_capture, CAPACITIVE_FORMAT
+from minutiae import extract_minutiae
+from minutiae_index import CandidateIndex
+from parallel_matcher import ParallelMatcher
+from embedding_gallery import EmbeddingGallery
+from template_store import deletion_ranges, delete_users, invalidate_synced, claimed_templates
+from dedup_scan import DUPLICATE_POLICY
+from sensor_protocol import (Command, Response, Command_SID, Command_DID, Command_Data, Response_Data,
+                             CMD_FINGER_DETECT, CMD_GET_IMAGE, CMD_GENERATE, CMD_MERGE, CMD_STORE_CHAR, CMD_LOAD_CHAR,
+                             CMD_UP_CHAR, CMD_DOWN_CHAR, CMD_GET_EMPTY_ID, CMD_SEARCH, CMD_UP_IMAGE_CODE, CMD_DEL_CHAR,
+                             CMD_GET_ENROLL_COUNT, CMD_GET_ENROLLED_ID_LIST, ERR_SUCCESS, ERR_FAIL, ERR_INVALID_PARAM,
+                             ERR_TMPL_EMPTY, DATA_0, DATA_1, DATA_2, DATA_3, DATA_4, DATA_6,
+                             MAX_TEMPLATE_ID)
 
 
 DATABASE_PATH = "/home/live_finger/newtry27jan/fingerprints_capacitive.db"
 save_dir = os.path.expanduser("/home/live_finger/newtry27jan/Fingerprints")
 
-MODEL_PATH = "/home/live_finger/newtry27jan/model/may2_4.pth"
-
-# Command codes
-Command = 0xAA55
-Response = 0x55AA
-Command_SID = 0x00
-Response_SID = 0x01
-Command_DID = 0x00
-Response_DID = 0x00
-
-# Command and Response codes
-CMD_FINGER_DETECT = 0x21
-CMD_GET_IMAGE = 0x20
-CMD_GENERATE = 0x60
-CMD_MERGE = 0x61
-CMD_STORE_CHAR = 0x40
-CMD_GET_EMPTY_ID = 0x45
-CMD_SEARCH = 0x63
-CMD_UP_IMAGE_CODE = 0x22
-CMD_DEL_CHAR = 0x44
-CMD_GET_ENROLL_COUNT = 0x48
-CMD_GET_ENROLLED_ID_LIST = 0x49
-
-# Result codes
-ERR_SUCCESS = 0x00
-ERR_FAIL = 0x01
-ERR_FP_NOT_DETECTED = 0x28
-ERR_INVALID_PARAM = 0x22
-ERR_TMPL_EMPTY = 0x12
-
-# Data lengths
-DATA_0 = 0x0000
-DATA_1 = 0x0001
-DATA_2 = 0x0002
-DATA_3 = 0x0003
-DATA_4 = 0x0004
-DATA_6 = 0x0006
+# Capture archive (see capture_store.py for the on-disk format)
+ARCHIVE_ROOT = "fingerprint_images"
+SAVE_HEX_DUMP = False  # The legacy 0x.. text dump is ~5x the size of the image itself
+
+# Template slots and occupancy-aware search
+SEARCH_RANGE_GAP = 16   # Empty slots tolerated inside one CMD_SEARCH range, fewer commands vs. fewer slots
+RECENT_MATCHES = 8      # Slots of recently matched users, searched before everything else
+INDEX_CANDIDATES = 5    # Host index candidates searched one slot at a time ahead of the occupied ranges
+OCCUPANCY_TTL = 30      # Seconds the enrolled-ID bitmap is trusted, other processes may write sensor flash
+
+# Burst re-checks of uncertain touches: a frame upload moves 66,218 bytes at 460800 baud and waits 0.1 s, ~1.5 s
+BURST_LATENCY_BUDGET = 3.5   # Seconds the extra frames may add to a search, room for two
+
+# Template transfer
+TEMPLATE_BUFFER = 0       # RAM buffer used to move templates between flash and host
+DATA_PACKET_TIMEOUT = 2.0
 
 # Image dimensions
 WIDTH = 242
@@ -80,9 +71,28 @@ class Rps_Packet:
         self.DATA = [0x00] * 14
         self.CKS = 0x0000
 
+def slot_ranges(slots, max_gap=SEARCH_RANGE_GAP):
+    """Merge template slots into the fewest (start, end) ranges leaving at most max_gap empty slots between them."""
+    ranges = []
+    for slot in sorted(slots):
+        if ranges and slot - ranges[-1][1] <= max_gap + 1:
+            ranges[-1][1] = slot
+        else:
+            ranges.append([slot, slot])
+    return [tuple(r) for r in ranges]
+
+
 class AnotherSensor:
-    def __init__(self, port='/dev/ttyUSB0', baudrate=460800):
+    def __init__(self, port='/dev/ttyUSB0', baudrate=460800, archive_writer=None, capture_log_dir=None,
+                 spoof_detector=None):
         try:
+            # Captures are persisted by a background writer, shared with the UI when provided
+            self.owns_archive_writer = archive_writer is None
+            self.archive_writer = archive_writer or ImageArchiveWriter()
+            # Optional append-only log of every search capture for dataset collection
+            self.capture_log = CaptureLog(capture_log_dir, "Capacitive", CAPACITIVE_WIDTH, CAPACITIVE_HEIGHT) if capture_log_dir else None
+            # Records get their own blocking queue: the archive writer drops its oldest jobs under back-pressure
+            self.log_writer = ImageArchiveWriter(LOG_QUEUE_SIZE, POLICY_BLOCK) if self.capture_log else None
             self.ser = serial.Serial(port, baudrate)
             self.cmd = [0x55, 0xAA, 0x00, 0x00, 0x01, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x01]
             self.rps = [0x00] * 26
@@ -101,17 +111,24 @@ class AnotherSensor:
             conn.close()
             
             self.initialize_database()
+            # Host-side minutiae index over enrolled slots, kept in the same database; its full matches
+            # (duplicate scans) run on a process pool over the spare cores
+            self.candidate_index = CandidateIndex(DATABASE_PATH, matcher=ParallelMatcher())
             self.last_match_position = None
+            self.enrolled_ids = None  # Occupied template slots, read from the sensor on the next search
+            self.enrolled_ids_read = 0.0  # When enrolled_ids was read from the sensor
+            self.recent_matches = deque(maxlen=RECENT_MATCHES)
             self.is_anti_spoof_enabled = False
+            self.is_burst_enabled = BURST_RECHECK  # Re-check UNCERTAIN touches with a burst of frames
+            self.burst_budget = BURST_LATENCY_BUDGET  # Seconds a burst may add, measured frame times decide the count
+            self.is_embedding_search_enabled = False  # Reuse the spoof pass's backbone features for retrieval
+            self.duplicate_policy = DUPLICATE_POLICY  # What enrolling an already enrolled finger does, see dedup_scan.py
+            self.embedding_gallery = None
             
-            # Initialize spoof detection model
-            self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-            self.model = self.load_model()
-            self.transform = transforms.Compose([
-                transforms.Resize((224, 224)),
-                transforms.ToTensor(),
-                transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-            ])
+            # Spoof detection model, shared when several sensors run in one station
+            self.spoof_detector = spoof_detector or SpoofDetector(MODEL_PATH)
+            self.frame_size = (CAPACITIVE_WIDTH, CAPACITIVE_HEIGHT)  # Native frame size, used to warm up the spoof model
+            self.sensor_type = "Capacitive"
             
             print("Capacitive sensor initialized successfully.")
         except Exception as e:
@@ -216,8 +233,53 @@ class AnotherSensor:
             return self.RpsGetEnrollCount(back)
         elif self.RPS.CMD == CMD_GET_ENROLLED_ID_LIST:
             return self.RpsGetEnrolledIdList(back)
+        elif self.RPS.CMD in (CMD_LOAD_CHAR, CMD_UP_CHAR, CMD_DOWN_CHAR):
+            return self.RpsTemplateTransfer(back)
         return 1
 
+    def read_bytes(self, count, deadline):
+        """Read exactly count bytes, None if they did not arrive before the deadline."""
+        data = bytearray()
+        while len(data) < count:
+            waiting = self.ser.inWaiting()
+            if waiting:
+                data.extend(self.ser.read(min(waiting, count - len(data))))
+            elif time.time() > deadline:
+                return None
+            else:
+                time.sleep(0.001)
+        return data
+
+    def Tx_data_packet(self, cmd, payload):
+        """Send a variable-length command data packet (prefix 0xA55A)."""
+        packet = [Command_Data & 0xff, (Command_Data & 0xff00) >> 8, self.CMD.SID, self.CMD.DID, cmd, 0x00,
+                  len(payload) & 0xff, (len(payload) & 0xff00) >> 8] + list(payload)
+        CKS = sum(packet) & 0xffff
+        self.ser.write(bytes(packet + [CKS & 0xff, (CKS & 0xff00) >> 8]))
+
+    def Rx_packet(self, timeout=DATA_PACKET_TIMEOUT):
+        """Read a response or response data packet; returns (RET, data after RET), or (1, None) on error."""
+        deadline = time.time() + timeout
+        header = self.read_bytes(8, deadline)
+        if header is None:
+            return 1, None
+        prefix = header[0] + header[1] * 0x100
+        length = header[6] + header[7] * 0x100
+        if prefix == Response_Data:
+            body = self.read_bytes(length + 2, deadline)
+        elif prefix == Response:
+            body = self.read_bytes(18, deadline)  # Fixed 26-byte packet, LEN only counts the used bytes
+        else:
+            print(f"Unexpected packet prefix 0x{prefix:04X}\r\n")
+            self.ser.reset_input_buffer()
+            return 1, None
+        if body is None:
+            return 1, None
+        if (sum(header) + sum(body[:-2])) & 0xffff != body[-2] + body[-1] * 0x100:
+            print("Packet checksum mismatch\r\n")
+            return 1, None
+        return body[0] + body[1] * 0x100, bytes(body[2:length])
+
     def enroll_finger(self, name, update_ui_callback=None, enroll_complete_callback=None):
         try:
             if update_ui_callback:
@@ -233,6 +295,8 @@ class AnotherSensor:
             self.Tx_cmd()
             self.Rx_cmd(1)
             k = self.RPS.DATA[0] + self.RPS.DATA[1] * 0x0100
+            enroll_frames = []
+            merge_into = None
 
             # Fingerprint enrollment process
             for a in range(3):
@@ -255,13 +319,33 @@ class AnotherSensor:
                                 # Save fingerprint image
                                 image_data = self.CmdUpImageCode(1)
                                 if image_data:
-                                    image_path = self.save_fingerprint_image(image_data, "enroll", k)
+                                    frame = decode_capacitive_image(image_data, operation="enroll", template_id=k)
+                                    enroll_frames.append(frame)
                                     if enroll_complete_callback:
-                                        enroll_complete_callback(image_path)
+                                        enroll_complete_callback(frame)
+                                    self.save_fingerprint_image(image_data, "enroll", k, frame)
                                     if update_ui_callback:
                                         update_ui_callback(f"✅ Step {a+1}/3: Fingerprint captured successfully")
                                 break
 
+                # The first capture is still in buffer 0, identify it before asking for two more
+                if a == 0 and enroll_frames and self.duplicate_policy != "allow":
+                    duplicate = self.find_duplicate(enroll_frames[0])
+                    if duplicate is not None:
+                        slot, existing_name = duplicate
+                        if self.duplicate_policy == "reject":
+                            if update_ui_callback:
+                                update_ui_callback(f"❌ This finger is already enrolled as {existing_name} "
+                                                   f"(template {slot})")
+                            return 1
+                        if update_ui_callback:
+                            update_ui_callback(f"ℹ️ This finger is already enrolled as {existing_name}, "
+                                               f"its template will be refreshed")
+                            if name and name != existing_name:
+                                update_ui_callback(f"ℹ️ The name {name} is not used, the finger stays enrolled "
+                                                   f"as {existing_name}")
+                        k, merge_into = slot, existing_name
+
             if i == 2:
                 if update_ui_callback:
                     update_ui_callback("❌ Enrollment failed. Please try again.")
@@ -280,6 +364,12 @@ class AnotherSensor:
                 time.sleep(0.5)
                 
                 store_result = self.CmdStoreChar(k, 0, 1)
+                if store_result == ERR_SUCCESS and merge_into is not None:
+                    # Same user, same slot: only the templates change
+                    self.update_host_indexes(k, enroll_frames)
+                    if update_ui_callback:
+                        update_ui_callback(f"✅ Template refreshed for {merge_into}")
+                    return 0
                 if store_result == ERR_SUCCESS:
                     # Save to database first
                     try:
@@ -288,6 +378,9 @@ class AnotherSensor:
                         cursor.execute('INSERT INTO fingerprints (name, template_position) VALUES (?, ?)', (name, k))
                         db.commit()
                         db.close()
+                        if self.enrolled_ids is not None:
+                            self.enrolled_ids.add(k)
+                        self.update_host_indexes(k, enroll_frames)
                         
                         if update_ui_callback:
                             update_ui_callback(f"✅ Enrollment successful for {name}")
@@ -296,7 +389,7 @@ class AnotherSensor:
                         if update_ui_callback:
                             update_ui_callback(f"❌ Database error: {db_error}")
                         # Try to delete the template from sensor since database save failed
-                        self.CmdDelChar(k, 0, 0)
+                        self.CmdDelChar(k, k, 0)
                         raise db_error
                 else:
                     if update_ui_callback:
@@ -312,152 +405,350 @@ class AnotherSensor:
                 update_ui_callback(f"❌ Enrollment Failed: {e}")
             raise e
 
-    def search_finger(self, update_ui_callback=None, search_complete_callback=None):
-        def run_search():
-            search_start_time = time.time()
+    def capture_template(self, update_ui_callback=None, frame_callback=None, operation="search", stop=None):
+        """Wait for a press, upload and quality-check the image and generate a template in buffer 0.
+
+        Returns (frame, capture time in seconds), or None when all attempts failed or stop was set.
+        """
+        for attempt in range(QUALITY_RETRIES + 1):
             try:
-                # Check if port is open and working
-                if not self.ser.is_open:
+                if not self.CmdFingerDetect(1):
                     if update_ui_callback:
-                        update_ui_callback("❌ Sensor port is not open. Attempting to reconnect...")
-                    try:
-                        self.ser.open()
-                    except Exception as e:
-                        if update_ui_callback:
-                            update_ui_callback(f"❌ Failed to reconnect to sensor: {e}")
-                        return
-
+                        update_ui_callback("⚠️ Please move your finger away")
+                self.wait_for_lift(stop)
+                if update_ui_callback:
+                    update_ui_callback("🔄 Please press your finger")
+                while self.CmdFingerDetect(1):
+                    if stop is not None and stop.is_set():
+                        return None
+                    time.sleep(0.01)
+                if stop is not None and stop.is_set():
+                    return None
+                if not self.CmdFingerDetect(1):
+                    # Upload first so poor captures are rejected before template generation
+                    capture_start = time.time()
+                    image_data = self.CmdUpImage(1)
+                    if image_data:
+                        frame = decode_capacitive_image(image_data, operation=operation)
+                        if frame_callback:
+                            frame_callback(frame)  # Hand the preview over before touching the disk
+                        self.save_fingerprint_image(image_data, operation, frame=frame)
+                        quality = assess_quality(frame.pixels)
+                        if not quality.ok:
+                            if update_ui_callback:
+                                update_ui_callback(f"⚠️ {quality.reason}. Please lift your finger and press again")
+                            continue
+                        if not self.CmdGenerate(0, 1):
+                            return frame, time.time() - capture_start
+            except serial.SerialException as e:
                 if update_ui_callback:
-                    update_ui_callback("🔄 Waiting for finger...")
+                    update_ui_callback(f"❌ Serial communication error: {e}")
+                # Try to recover the connection
+                try:
+                    self.ser.close()
+                    time.sleep(1)  # Wait before reconnecting
+                    self.ser.open()
+                    if update_ui_callback:
+                        update_ui_callback("✅ Sensor reconnected successfully")
+                except Exception as e:
+                    if update_ui_callback:
+                        update_ui_callback(f"❌ Failed to recover sensor connection: {e}")
+                    return None
+        return None
 
-                # Hardcoded start and end addresses
-                data_start = 1
-                data_end = 3000
-                data = data_start * 0x10000 + data_end
-                k = (data & 0xffff0000) >> 16
-                n = data & 0xffff
+    def run_spoof_check(self, frame, capture_time, update_ui_callback=None):
+        return run_spoof_check(self, frame, capture_time, update_ui_callback)
 
-                # Capture fingerprint
-                for i in range(3):
-                    try:
-                        if not self.CmdFingerDetect(1):
-                            if update_ui_callback:
-                                update_ui_callback("⚠️ Please move your finger away")
-                        while not self.CmdFingerDetect(1):
-                            time.sleep(0.01)
-                        if update_ui_callback:
-                            update_ui_callback("🔄 Please press your finger")
-                        while self.CmdFingerDetect(1):
-                            time.sleep(0.01)
-                        if not self.CmdFingerDetect(1):
-                            if not self.CmdGetImage(1):
-                                if not self.CmdGenerate(0, 1):
-                                    # Save fingerprint image
-                                    image_data = self.CmdUpImageCode(1)
-                                    if image_data:
-                                        image_path = self.save_fingerprint_image(image_data, "search")
-                                        
-                                        # Perform spoof detection if enabled
-                                        spoof_status = "Disabled"
-                                        spoof_detection_time = 0
-                                        if self.is_anti_spoof_enabled:
-                                            if update_ui_callback:
-                                                update_ui_callback("🔄 Performing spoof detection...")
-                                            spoof_detection_start = time.time()
-                                            spoof_status = self.spoof_detection_algorithm(image_path)
-                                            spoof_detection_time = time.time() - spoof_detection_start
-                                            if update_ui_callback:
-                                                update_ui_callback(f"✅ Spoof detection completed in {spoof_detection_time:.2f} seconds")
-                                        
-                                        if search_complete_callback:
-                                            search_complete_callback(True, image_path, spoof_status)
-                                    break
-                    except serial.SerialException as e:
-                        if update_ui_callback:
-                            update_ui_callback(f"❌ Serial communication error: {e}")
-                        # Try to recover the connection
-                        try:
-                            self.ser.close()
-                            time.sleep(1)  # Wait before reconnecting
-                            self.ser.open()
-                            if update_ui_callback:
-                                update_ui_callback("✅ Sensor reconnected successfully")
-                        except Exception as e:
-                            if update_ui_callback:
-                                update_ui_callback(f"❌ Failed to recover sensor connection: {e}")
-                            return
+    def occupied_slots(self, max_age=OCCUPANCY_TTL):
+        """Set of occupied template slots from the sensor's enrolled-ID bitmap, None if it cannot be read.
 
-                if i == 2:
-                    if update_ui_callback:
-                        update_ui_callback("❌ Fingerprint capture failed")
-                    return 1
+        The bitmap is read again once it is older than max_age seconds.
+        """
+        if self.enrolled_ids is None or time.time() - self.enrolled_ids_read > max_age:
+            self.enrolled_ids = None
+            self.GetEnrolledIdList(1)  # Fills enrolled_ids on success
+        return self.enrolled_ids
+
+    def update_host_indexes(self, slot, frames=None):
+        """Index the enrollment frames of a slot, or drop the slot when frames is None; never fails the caller."""
+        try:
+            if frames is None:
+                self.drop_host_indexes([slot])
+                return
+            invalidate_synced([slot])  # The template store must compare this slot again
+            self.candidate_index.add_frames(slot, frames)
+            if self.is_embedding_search_enabled and self.spoof_detector.model is not None:
+                self.current_embedding_gallery().add(slot, self.spoof_detector.embed(frames).mean(axis=0))
+        except Exception as e:
+            print(f"Failed to update the host indexes for slot {slot}: {e}")
 
-                # Search for match
+    def drop_host_indexes(self, slots):
+        """Forget deleted slots in the host indexes, with one commit per index."""
+        invalidate_synced(slots)
+        try:
+            self.candidate_index.remove_many(slots)
+            self.current_embedding_gallery().remove_many(slots)
+        except Exception as e:
+            print(f"Failed to drop {len(slots)} slots from the host indexes: {e}")
+
+    def current_embedding_gallery(self):
+        """Embedding gallery of the spoof model in use, reopened when the model manager swapped it."""
+        model_name = os.path.basename(self.spoof_detector.model_path)
+        if self.embedding_gallery is None or self.embedding_gallery.model_name != model_name:
+            self.embedding_gallery = EmbeddingGallery(DATABASE_PATH, model_name)
+        return self.embedding_gallery
+
+    def remember_embedding(self, slot, spoof_status):
+        """Store the embedding of a LIVE match for a slot the current model has none for yet.
+
+        Users enrolled before embedding search was enabled, or before a model swap, are filled in on
+        their first match instead of needing to re-enroll.
+        """
+        embedding = getattr(spoof_status, 'embedding', None)
+        if embedding is None or spoof_status.verdict != VERDICT_LIVE:
+            return
+        try:
+            gallery = self.current_embedding_gallery()
+            if slot not in gallery:
+                gallery.add(slot, embedding)
+        except Exception as e:
+            print(f"Failed to store the embedding of template {slot}: {e}")
+
+    def embedding_candidates(self, spoof_status):
+        """Enrolled slots closest to the embedding of the spoof pass, empty when there is none."""
+        embedding = getattr(spoof_status, 'embedding', None)
+        if embedding is None:
+            return []
+        try:
+            return [slot for slot, _ in self.current_embedding_gallery().search(embedding)]
+        except Exception as e:
+            print(f"Embedding search failed: {e}")
+            return []
+
+    def index_candidates(self, frame):
+        """Slots the host minutiae index ranks most likely for a capture, empty when nothing is indexed."""
+        if not len(self.candidate_index):
+            return []
+        try:
+            return self.candidate_index.candidates(extract_minutiae(frame.pixels), INDEX_CANDIDATES)
+        except Exception as e:
+            print(f"Candidate lookup failed: {e}")
+            return []
+
+    def search_enrolled(self, start=1, end=MAX_TEMPLATE_ID, candidates=()):
+        """Search only occupied slots, index candidates and recently matched users first.
+
+        Returns the matched slot or None.
+        """
+        position = self.search_occupied(start, end, list(candidates) + list(self.recent_matches))
+        if position is not None:
+            if position in self.recent_matches:
+                self.recent_matches.remove(position)
+            self.recent_matches.appendleft(position)
+        return position
+
+    def search_occupied(self, start=1, end=MAX_TEMPLATE_ID, priority=()):
+        """First occupied slot in [start, end] matching buffer 0, priority slots first; None when none does."""
+        priority = list(dict.fromkeys(priority))
+        read_before = self.enrolled_ids_read
+        slots = self.occupied_slots()
+        if slots is None:
+            # No bitmap, fall back to the full range
+            ranges = [(slot, slot) for slot in priority if start <= slot <= end] + [(start, end)]
+        else:
+            slots = {slot for slot in slots if start <= slot <= end}
+            first = [slot for slot in priority if slot in slots]
+            ranges = [(slot, slot) for slot in first] + slot_ranges(slots.difference(first))
+
+        position = self.search_ranges(ranges)
+        if position is None and slots is not None and self.enrolled_ids_read == read_before:
+            # A miss on a cached bitmap: slots written by another process since then are searched too
+            self.enrolled_ids = None
+            fresh = self.occupied_slots()
+            if fresh is not None:
+                position = self.search_ranges(slot_ranges(slot for slot in fresh.difference(slots)
+                                                          if start <= slot <= end))
+        return position
+
+    def search_ranges(self, ranges):
+        """First slot matching the template in buffer 0 over (start, end) ranges, None when none does."""
+        for range_start, range_end in ranges:
+            if self.CmdSearch(range_start, range_end, 1) == ERR_SUCCESS:
+                return self.RPS.DATA[0] + self.RPS.DATA[1] * 0x0100
+        return None
+
+    def find_duplicate(self, frame):
+        """(slot, name) of an enrolled finger matching the template in buffer 0, None when the finger is new."""
+        # Not a search: recent_matches, which orders identification, is left alone
+        slot = self.search_occupied(priority=self.index_candidates(frame))
+        if slot is None:
+            return None
+        db = sqlite3.connect(DATABASE_PATH)
+        try:
+            row = db.execute('SELECT name FROM fingerprints WHERE template_position = ?', (slot,)).fetchone()
+        finally:
+            db.close()
+        return slot, row[0] if row else f"User {slot}"
+
+    def claimed_templates(self, claim):
+        return claimed_templates(DATABASE_PATH, claim)
+
+    def identify(self, update_ui_callback=None, search_complete_callback=None, frame_callback=None, stop=None):
+        """Capture one press and search the gallery on the calling thread.
+
+        Returns True on a match, False when there was none, None when nothing was identified
+        (capture failed, or stop was set while waiting for a finger).
+        """
+        search_start_time = time.time()
+        try:
+            # Check if port is open and working
+            if not self.ser.is_open:
                 if update_ui_callback:
-                    update_ui_callback("🔄 Searching database...")
-                    
-                search_start = time.time()
-                self.CMD.CMD = CMD_SEARCH
-                self.CMD.LEN = DATA_6
-                self.CMD.DATA[0] = 0x00
-                self.CMD.DATA[1] = 0x00
-                self.CMD.DATA[2] = k & 0xff
-                self.CMD.DATA[3] = (k & 0xff00) >> 8
-                self.CMD.DATA[4] = n & 0xff
-                self.CMD.DATA[5] = (n & 0xff00) >> 8
-                self.Tx_cmd()
-                result = self.Rx_cmd(0)
-                search_time = time.time() - search_start
+                    update_ui_callback("❌ Sensor port is not open. Attempting to reconnect...")
+                try:
+                    self.ser.open()
+                except Exception as e:
+                    if update_ui_callback:
+                        update_ui_callback(f"❌ Failed to reconnect to sensor: {e}")
+                    return None
+
+            if update_ui_callback:
+                update_ui_callback("🔄 Waiting for finger...")
+
+            # Capture fingerprint
+            capture = self.capture_template(update_ui_callback, frame_callback, stop=stop)
+            if capture is None:
+                if update_ui_callback and not (stop is not None and stop.is_set()):
+                    update_ui_callback("❌ Fingerprint capture failed")
+                return None
+            frame, capture_time = capture
+            spoof_status = self.run_spoof_check(frame, capture_time, update_ui_callback)
+
+            # Search for match; the preview already went out through frame_callback, the result is reported once
+            if update_ui_callback:
+                update_ui_callback("🔄 Searching database...")
                 
-                if result == ERR_SUCCESS:
-                    self.last_match_position = self.RPS.DATA[0] + self.RPS.DATA[1] * 0x0100
-                    
-                    # Get the name of the matched fingerprint
-                    matched_name = None
-                    try:
-                        db = sqlite3.connect(DATABASE_PATH)
-                        cursor = db.cursor()
-                        cursor.execute('SELECT name FROM fingerprints WHERE template_position = ?', (self.last_match_position,))
-                        result = cursor.fetchone()
-                        if result:
-                            matched_name = result[0]
-                            if update_ui_callback:
-                                update_ui_callback(f"✅ Match found! (Search time: {search_time:.2f} seconds)")
-                                update_ui_callback(f"✅ Fingerprint matched with: {matched_name}")
-                        db.close()
-                    except Exception as e:
+            search_start = time.time()
+            candidates = self.embedding_candidates(spoof_status) + self.index_candidates(frame)
+            position = self.search_enrolled(candidates=candidates)
+            search_time = time.time() - search_start
+            
+            if position is not None:
+                self.last_match_position = position
+                self.remember_embedding(position, spoof_status)
+                
+                # Get the name of the matched fingerprint
+                matched_name = None
+                try:
+                    db = sqlite3.connect(DATABASE_PATH)
+                    cursor = db.cursor()
+                    cursor.execute('SELECT name FROM fingerprints WHERE template_position = ?', (self.last_match_position,))
+                    result = cursor.fetchone()
+                    if result:
+                        matched_name = result[0]
                         if update_ui_callback:
-                            update_ui_callback(f"❌ Database error: {str(e)}")
-                            
-                    if search_complete_callback:
-                        search_complete_callback(True, image_path, spoof_status, matched_name)
-                else:
+                            update_ui_callback(f"✅ Match found! (Search time: {search_time:.2f} seconds)")
+                            update_ui_callback(f"✅ Fingerprint matched with: {matched_name}")
+                    db.close()
+                except Exception as e:
                     if update_ui_callback:
-                        update_ui_callback(f"❌ No match found (Search time: {search_time:.2f} seconds)")
-                    if search_complete_callback:
-                        search_complete_callback(False, image_path, spoof_status, None)
-
-                # Calculate total time
-                total_search_time = time.time() - search_start_time
+                        update_ui_callback(f"❌ Database error: {str(e)}")
+                        
+                self.log_capture(frame, self.last_match_position, spoof_status)
+                if search_complete_callback:
+                    search_complete_callback(True, frame, spoof_status, matched_name)
+            else:
                 if update_ui_callback:
-                    update_ui_callback(f"⏱️ Total operation time: {total_search_time:.2f} seconds")
+                    update_ui_callback(f"❌ No match found (Search time: {search_time:.2f} seconds)")
+                self.log_capture(frame, -1, spoof_status)
+                if search_complete_callback:
+                    search_complete_callback(False, frame, spoof_status, None)
 
+            # Calculate total time
+            total_search_time = time.time() - search_start_time
+            if update_ui_callback:
+                update_ui_callback(f"⏱️ Total operation time: {total_search_time:.2f} seconds")
+            return position is not None
+
+        except Exception as e:
+            if update_ui_callback:
+                update_ui_callback(f"❌ Search Failed: {e}")
+            # Try to recover the connection
+            try:
+                if self.ser.is_open:
+                    self.ser.close()
+                time.sleep(1)  # Wait before reconnecting
+                self.ser.open()
+                if update_ui_callback:
+                    update_ui_callback("✅ Sensor reconnected successfully")
             except Exception as e:
                 if update_ui_callback:
-                    update_ui_callback(f"❌ Search Failed: {e}")
-                # Try to recover the connection
-                try:
-                    if self.ser.is_open:
-                        self.ser.close()
-                    time.sleep(1)  # Wait before reconnecting
-                    self.ser.open()
+                    update_ui_callback(f"❌ Failed to recover sensor connection: {e}")
+            return None
+
+    def search_finger(self, update_ui_callback=None, search_complete_callback=None, frame_callback=None):
+        threading.Thread(target=self.identify,
+                         args=(update_ui_callback, search_complete_callback, frame_callback)).start()
+
+    def wait_for_lift(self, stop=None):
+        """Block until the finger is off the sensor (or stop is set)."""
+        while not self.CmdFingerDetect(1):
+            if stop is not None and stop.is_set():
+                return
+            time.sleep(0.01)
+
+    def verify_finger(self, claim, update_ui_callback=None, verify_complete_callback=None, frame_callback=None):
+        """1:1 verification: search only the template slot(s) of the claimed user."""
+        def run_verify():
+            verify_start_time = time.time()
+            try:
+                candidates = self.claimed_templates(claim)
+                if not candidates:
                     if update_ui_callback:
-                        update_ui_callback("✅ Sensor reconnected successfully")
-                except Exception as e:
+                        update_ui_callback(f"❌ No enrolled fingerprint for {claim}")
+                    return
+
+                if update_ui_callback:
+                    update_ui_callback(f"🔄 Verifying {candidates[0][0]}, place your finger...")
+                capture = self.capture_template(update_ui_callback, frame_callback, "verify")
+                if capture is None:
                     if update_ui_callback:
-                        update_ui_callback(f"❌ Failed to recover sensor connection: {e}")
+                        update_ui_callback("❌ Fingerprint capture failed")
+                    return
+                frame, capture_time = capture
+                # Checked while the finger is still down, so an uncertain verdict can take a burst
+                spoof_status = self.run_spoof_check(frame, capture_time, update_ui_callback)
+
+                # A search over a single-slot range costs the same whatever the database size
+                compare_start = time.time()
+                matched = None
+                for name, template_position in candidates:
+                    if self.CmdSearch(template_position, template_position, 1) == ERR_SUCCESS:
+                        matched = (name, template_position)
+                        break
+                compare_time = time.time() - compare_start
+
+                if update_ui_callback:
+                    if matched:
+                        update_ui_callback(f"✅ Verified as {matched[0]} (compare time: {compare_time:.2f} seconds)")
+                    else:
+                        update_ui_callback(f"❌ Fingerprint does not match {candidates[0][0]} "
+                                           f"(compare time: {compare_time:.2f} seconds)")
 
-        threading.Thread(target=run_search).start()
+                self.log_capture(frame, matched[1] if matched else -1, spoof_status)
+                if verify_complete_callback:
+                    verify_complete_callback(matched is not None, frame, spoof_status,
+                                             matched[0] if matched else None)
+
+            except Exception as e:
+                if update_ui_callback:
+                    update_ui_callback(f"❌ Verification Failed: {e}")
+
+            finally:
+                if update_ui_callback:
+                    update_ui_callback(f"⏱️ Total operation time: {time.time() - verify_start_time:.2f} seconds")
+
+        threading.Thread(target=run_verify).start()
 
     def delete_finger(self, position, update_ui_callback=None):
         try:
@@ -483,18 +774,15 @@ class AnotherSensor:
             self.CMD.PREFIX = Command
             self.CMD.SID = Command_SID
             self.CMD.DID = Command_DID
-            self.CMD.CMD = CMD_DEL_CHAR
-            self.CMD.LEN = DATA_4
             # Set the start and end ID to the same value (delete only one ID)
-            self.CMD.DATA[0] = template_position & 0xff
-            self.CMD.DATA[1] = (template_position & 0xff00) >> 8
-            self.CMD.DATA[2] = template_position & 0xff
-            self.CMD.DATA[3] = (template_position & 0xff00) >> 8
-            self.Tx_cmd()
-            
-            if self.Rx_cmd(1) == ERR_SUCCESS:
+            if self.CmdDelChar(template_position, template_position, 1) == ERR_SUCCESS:
                 cursor.execute('DELETE FROM fingerprints WHERE id = ?', (position,))
                 db.commit()
+                if self.enrolled_ids is not None:
+                    self.enrolled_ids.discard(template_position)
+                if template_position in self.recent_matches:
+                    self.recent_matches.remove(template_position)
+                self.update_host_indexes(template_position)
                 if update_ui_callback:
                     update_ui_callback(f"✅ Fingerprint for {name} deleted successfully.")
                 return True
@@ -510,6 +798,32 @@ class AnotherSensor:
         finally:
             db.close()
 
+    def delete_slots(self, slots):
+        """Delete templates with one CMD_DEL_CHAR per range of slots; returns the slots now empty.
+
+        Ranges only absorb slots a fresh bitmap shows empty: another process may have written slots since
+        it was cached. Without a bitmap only adjacent slots are merged.
+        """
+        slots = set(slots)
+        self.CMD.PREFIX = Command
+        self.CMD.SID = Command_SID
+        self.CMD.DID = Command_DID
+        self.enrolled_ids = None
+        deleted = set()
+        for start, end in deletion_ranges(slots, self.occupied_slots()):
+            # An empty range is already in the state we want
+            if self.CmdDelChar(start, end, 1) in (ERR_SUCCESS, ERR_TMPL_EMPTY):
+                deleted.update(slot for slot in slots if start <= slot <= end)
+        if self.enrolled_ids is not None:
+            self.enrolled_ids -= deleted
+        for slot in deleted.intersection(self.recent_matches):
+            self.recent_matches.remove(slot)
+        return deleted
+
+    def delete_fingers(self, positions, update_ui_callback=None):
+        """Delete many fingerprints by database ID, see template_store.delete_users; returns the number deleted."""
+        return delete_users(self, DATABASE_PATH, positions, update_ui_callback)
+
     def list_enrolled_fingers(self):
         try:
             db = sqlite3.connect(DATABASE_PATH)
@@ -523,76 +837,54 @@ class AnotherSensor:
         finally:
             db.close()
 
-    def save_fingerprint_image(self, image_data, operation_type, id=None):
+    def save_fingerprint_image(self, image_data, operation_type, id=None, frame=None):
         if image_data is None:
             return None
+        if frame is None:
+            frame = decode_capacitive_image(image_data, operation=operation_type, template_id=id)
         
-        # Generate timestamp for unique filename
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        
-        # Create filename based on operation type and ID
+        # Create filename based on operation type and ID, grouped in day directories
         if operation_type == "enroll" and id is not None:
-            filename = f"fingerprint_images/enroll/fp_id_{id}_{timestamp}.txt"
-            image_filename = f"fingerprint_images/enroll/fp_id_{id}_{timestamp}.bmp"
-        elif operation_type == "search":
-            filename = f"fingerprint_images/search/search_{timestamp}.txt"
-            image_filename = f"fingerprint_images/search/search_{timestamp}.bmp"
+            prefix = f"fp_id_{id}"
         else:
-            filename = f"fingerprint_images/{operation_type}/{operation_type}_{timestamp}.txt"
-            image_filename = f"fingerprint_images/{operation_type}/{operation_type}_{timestamp}.bmp"
-        
-        # Save raw data to text file
-        self.Data_Txt(image_data, filename)
+            prefix = operation_type
+        image_filename = capture_path(ARCHIVE_ROOT, operation_type, CAPACITIVE_FORMAT, prefix, frame.timestamp)
+        filename = os.path.splitext(image_filename)[0] + ".txt" if SAVE_HEX_DUMP else None
         
-        # Convert and save as image
-        pixel_data = self.read_data_txt(filename)
-        self.data_to_image(pixel_data, WIDTH, HEIGHT, image_filename)
+        # Persist in the background, the caller only needs the (future) path
+        self.archive_writer.submit(self.write_fingerprint_image, image_data, frame, filename, image_filename)
         
         return image_filename
 
+    def write_fingerprint_image(self, image_data, frame, filename, image_filename):
+        """Write the capture (and optional raw dump) to disk (runs on the archive writer thread)."""
+        if filename:
+            self.Data_Txt(image_data, filename)
+        
+        # Save the already decoded frame losslessly (no need to re-parse the text dump)
+        save_capture(frame, image_filename)
+        print(f"Image saved as {image_filename}")
+
     def Data_Txt(self, Rx_data, filename):
-        output = open(filename, 'w', encoding='gbk')
-        i = 38
-        for j in range(129):
-            for o in range(8):
+        with open(filename, 'w', encoding='gbk') as output:
+            i = 38
+            for j in range(129):
+                for o in range(8):
+                    for p in range(62):
+                        output.write("0x%x," % Rx_data[i])
+                        i = i + 1
+                    output.write('\n')
+                i = i + 14
+            for j in range(6):
                 for p in range(62):
                     output.write("0x%x," % Rx_data[i])
                     i = i + 1
                 output.write('\n')
-            i = i + 14
-        for j in range(6):
-            for p in range(62):
+            for p in range(8):
                 output.write("0x%x," % Rx_data[i])
                 i = i + 1
-            output.write('\n')
-        for p in range(8):
-            output.write("0x%x," % Rx_data[i])
-            i = i + 1
         print(f"Data written to {filename}")
 
-    def read_data_txt(self, filename):
-        pixel_data = []
-        with open(filename, 'r', encoding='gbk') as file:
-            for line in file:
-                hex_values = re.findall(r'0x[0-9a-fA-F]+', line)
-                for hex_val in hex_values:
-                    pixel_data.append(int(hex_val, 16))
-        return pixel_data
-
-    def data_to_image(self, pixel_data, width, height, output_filename):
-        img = Image.new('L', (width, height))
-        pixels = img.load()
-        data_index = 0
-        for y in range(height):
-            for x in range(width):
-                if data_index < len(pixel_data):
-                    pixels[x, y] = pixel_data[data_index]
-                    data_index += 1
-                else:
-                    pixels[x, y] = 0
-        img.save(output_filename)
-        print(f"Image saved as {output_filename}")
-
     def toggle_anti_spoof(self):
         """Toggle anti-spoof detection"""
         self.is_anti_spoof_enabled = not self.is_anti_spoof_enabled
@@ -601,10 +893,15 @@ class AnotherSensor:
     def __del__(self):
         """Cleanup when object is destroyed."""
         try:
+            # Never wait on the writer here: its queued jobs hold the sensor, so this may run on the writer thread
+            if getattr(self, 'owns_archive_writer', False):
+                self.archive_writer.stop()
+            if getattr(self, 'log_writer', None):
+                self.log_writer.stop()
             if hasattr(self, 'ser') and self.ser.is_open:
                 self.ser.close()
-            if hasattr(self, 'model'):
-                del self.model
+            if hasattr(self, 'spoof_detector'):
+                del self.spoof_detector
         except Exception as e:
             print(f"Error during cleanup: {e}")
 
@@ -666,6 +963,11 @@ class AnotherSensor:
                 print("Unknown error occurred\r\n")
             return self.RPS.RET
 
+    def RpsTemplateTransfer(self, back):
+        if not back and self.RPS.RET:
+            print("Template transfer failed, error code: %d \r\n" % self.RPS.RET)
+        return self.RPS.RET
+
     def RpsGetEnrollCount(self, back):
         if back:
             return self.RPS.RET
@@ -678,45 +980,48 @@ class AnotherSensor:
             return self.RPS.RET
 
     def RpsGetEnrolledIdList(self, back):
-        if back:
-            return self.RPS.RET
-        else:
-            if self.RPS.RET:
+        if self.RPS.RET:
+            if not back:
                 print("Instruction processing failure\r\n")
-            else:
-                # The actual ID list comes in a separate data packet
-                # We need to read the data packet after the response packet
-                data_packet = []
-                time.sleep(0.1)  # Give some time for the data packet to arrive
-                
-                # Read all available data
-                while self.ser.inWaiting() > 0:
-                    data_packet.append(ord(self.ser.read()))
-                
-                if len(data_packet) < 10:
-                    print("Data packet too short\r\n")
-                    return self.RPS.RET
-                    
-                # Extract the ID list data (all bytes after the header)
-                id_list = data_packet[10:]
-                
-                enrolled_ids = []
-                # Only iterate through the actual length of the data
-                for byte_idx in range(len(id_list)):
-                    byte = id_list[byte_idx]
-                    for bit_idx in range(8):
-                        if byte & (1 << bit_idx):
-                            id = byte_idx * 8 + bit_idx
-                            if id <= 3000:
-                                enrolled_ids.append(id)
-                
-                if enrolled_ids:
-                    print("Enrolled Fingerprint IDs:", enrolled_ids)
-                    print(f"Total enrolled fingerprints: {len(enrolled_ids)}")
-                else:
-                    print("No enrolled fingerprints found")
             return self.RPS.RET
 
+        # The actual ID list comes in a separate data packet
+        # We need to read the data packet after the response packet
+        data_packet = []
+        time.sleep(0.1)  # Give some time for the data packet to arrive
+        
+        # Read all available data
+        while self.ser.inWaiting() > 0:
+            data_packet.append(ord(self.ser.read()))
+        
+        if len(data_packet) < 10:
+            print("Data packet too short\r\n")
+            return 1
+            
+        # Extract the ID list data (all bytes after the header), one bit per template slot
+        id_list = data_packet[10:]
+        
+        enrolled_ids = []
+        # Only iterate through the actual length of the data
+        for byte_idx in range(len(id_list)):
+            byte = id_list[byte_idx]
+            for bit_idx in range(8):
+                if byte & (1 << bit_idx):
+                    id = byte_idx * 8 + bit_idx
+                    if id <= MAX_TEMPLATE_ID:
+                        enrolled_ids.append(id)
+        # Kept for occupancy-aware search
+        self.enrolled_ids = set(enrolled_ids)
+        self.enrolled_ids_read = time.time()
+        
+        if not back:
+            if enrolled_ids:
+                print("Enrolled Fingerprint IDs:", enrolled_ids)
+                print(f"Total enrolled fingerprints: {len(enrolled_ids)}")
+            else:
+                print("No enrolled fingerprints found")
+        return self.RPS.RET
+
     def CmdFingerDetect(self, back):
         self.CMD.CMD = CMD_FINGER_DETECT
         self.CMD.LEN = DATA_0
@@ -749,15 +1054,98 @@ class AnotherSensor:
     def CmdStoreChar(self, k, n, back):
         self.CMD.CMD = CMD_STORE_CHAR
         self.CMD.LEN = DATA_4
-        self.CMD.DATA[0] = k 
-        self.CMD.DATA[1] = 0x00 
+        self.CMD.DATA[0] = k & 0xff
+        self.CMD.DATA[1] = (k & 0xff00) >> 8
         self.CMD.DATA[2] = n 
         self.CMD.DATA[3] = 0x00 
         self.Tx_cmd()
         return self.Rx_cmd(back)
 
+    def CmdDelChar(self, start, end, back):
+        """Delete the templates stored in slots start..end."""
+        self.CMD.CMD = CMD_DEL_CHAR
+        self.CMD.LEN = DATA_4
+        self.CMD.DATA[0] = start & 0xff
+        self.CMD.DATA[1] = (start & 0xff00) >> 8
+        self.CMD.DATA[2] = end & 0xff
+        self.CMD.DATA[3] = (end & 0xff00) >> 8
+        self.Tx_cmd()
+        return self.Rx_cmd(back)
+
+    def CmdLoadChar(self, k, n, back):
+        """Load the template stored at slot k into RAM buffer n."""
+        self.CMD.CMD = CMD_LOAD_CHAR
+        self.CMD.LEN = DATA_4
+        self.CMD.DATA[0] = k & 0xff
+        self.CMD.DATA[1] = (k & 0xff00) >> 8
+        self.CMD.DATA[2] = n
+        self.CMD.DATA[3] = 0x00
+        self.Tx_cmd()
+        return self.Rx_cmd(back)
+
+    def CmdUpChar(self, n):
+        """Upload the template in RAM buffer n to the host; returns its bytes or None."""
+        self.CMD.CMD = CMD_UP_CHAR
+        self.CMD.LEN = DATA_2
+        self.CMD.DATA[0] = n
+        self.CMD.DATA[1] = 0x00
+        self.Tx_cmd()
+        if self.Rx_cmd(1) != ERR_SUCCESS:
+            return None
+        # The template follows in a response data packet
+        ret, data = self.Rx_packet()
+        return data if ret == ERR_SUCCESS else None
+
+    def CmdDownChar(self, n, template):
+        """Download a template from the host into RAM buffer n; returns the result code."""
+        self.CMD.CMD = CMD_DOWN_CHAR
+        self.CMD.LEN = DATA_2
+        size = len(template) + 2  # Buffer number + template
+        self.CMD.DATA[0] = size & 0xff
+        self.CMD.DATA[1] = (size & 0xff00) >> 8
+        self.Tx_cmd()
+        ret = self.Rx_cmd(1)
+        if ret != ERR_SUCCESS:
+            return ret
+        self.Tx_data_packet(CMD_DOWN_CHAR, [n & 0xff, (n & 0xff00) >> 8] + list(template))
+        return self.Rx_packet()[0]
+
+    def template_slots(self):
+        """Occupied template slots, read fresh from the sensor (empty set if the bitmap cannot be read)."""
+        self.enrolled_ids = None
+        return set(self.occupied_slots() or ())
+
+    def read_template(self, slot):
+        """Bytes of the template stored at a slot, None if it is empty or the transfer failed."""
+        if self.CmdLoadChar(slot, TEMPLATE_BUFFER, 1) != ERR_SUCCESS:
+            return None
+        return self.CmdUpChar(TEMPLATE_BUFFER)
+
+    def write_template(self, slot, template):
+        """Store template bytes at a slot, overwriting it; returns True on success."""
+        if self.CmdDownChar(TEMPLATE_BUFFER, template) != ERR_SUCCESS:
+            return False
+        if self.CmdStoreChar(slot, TEMPLATE_BUFFER, 1) != ERR_SUCCESS:
+            return False
+        if self.enrolled_ids is not None:
+            self.enrolled_ids.add(slot)
+        invalidate_synced([slot])
+        return True
+
+    def CmdSearch(self, start, end, back):
+        """Search the template slots start..end for the template in buffer 0."""
+        self.CMD.CMD = CMD_SEARCH
+        self.CMD.LEN = DATA_6
+        self.CMD.DATA[0] = 0x00
+        self.CMD.DATA[1] = 0x00
+        self.CMD.DATA[2] = start & 0xff
+        self.CMD.DATA[3] = (start & 0xff00) >> 8
+        self.CMD.DATA[4] = end & 0xff
+        self.CMD.DATA[5] = (end & 0xff00) >> 8
+        self.Tx_cmd()
+        return self.Rx_cmd(back)
+
     def CmdUpImageCode(self, back):
-        Rx_data = []
         if not self.CmdFingerDetect(back):
             print("Please move your finger away")
         while not self.CmdFingerDetect(back):
@@ -766,19 +1154,44 @@ class AnotherSensor:
         while self.CmdFingerDetect(back):
             time.sleep(0.01)
         if not self.CmdFingerDetect(back):
-            if not self.CmdGetImage(back):
-                print("Please wait while data is being received")
-                self.CMD.CMD = CMD_UP_IMAGE_CODE
-                self.CMD.LEN = DATA_1
-                self.CMD.DATA[0] = 0x00 
-                self.Tx_cmd()
-                time.sleep(0.1)
-                while self.ser.inWaiting() > 0:
-                    for i in range(66218):
-                        Rx_data.append(ord(self.ser.read()))
-                return Rx_data
+            return self.CmdUpImage(back)
+        return None
+
+    def CmdUpImage(self, back):
+        """Capture and upload an image of the finger currently on the sensor, without waiting for a new touch."""
+        Rx_data = []
+        if not self.CmdGetImage(back):
+            print("Please wait while data is being received")
+            self.CMD.CMD = CMD_UP_IMAGE_CODE
+            self.CMD.LEN = DATA_1
+            self.CMD.DATA[0] = 0x00 
+            self.Tx_cmd()
+            time.sleep(0.1)
+            while self.ser.inWaiting() > 0:
+                for i in range(66218):
+                    Rx_data.append(ord(self.ser.read()))
+            return Rx_data
         return None
 
+    def capture_burst(self, first_frame, frame_time, max_frames=BURST_FRAMES, budget=None):
+        """Capture further frames of the same touch while the finger stays down and the budget allows.
+
+        frame_time is the measured time of the last capture, each new frame updates it.
+        """
+        budget = self.burst_budget if budget is None else budget
+        frames = [first_frame]
+        burst_start = time.time()
+        while len(frames) < max_frames and time.time() - burst_start + frame_time <= budget:
+            if self.CmdFingerDetect(1):
+                break  # Finger lifted
+            capture_start = time.time()
+            image_data = self.CmdUpImage(1)
+            if not image_data:
+                break
+            frames.append(decode_capacitive_image(image_data))
+            frame_time = time.time() - capture_start
+        return frames
+
     def GetEnrolledIdList(self, back):
         self.CMD.CMD = CMD_GET_ENROLLED_ID_LIST
         self.CMD.LEN = DATA_0
@@ -795,47 +1208,12 @@ class AnotherSensor:
         self.Tx_cmd()
         return self.Rx_cmd(not back)
 
-    def load_model(self):
-        """Load the pre-trained spoof detection model."""
-        try:
-            model = models.resnet50(pretrained=False)
-            model.fc = torch.nn.Linear(model.fc.in_features, 2)
-            model = model.to(self.device)
-
-            state_dict = torch.load(MODEL_PATH, map_location=self.device)
-            if any(k.startswith('module.') for k in state_dict.keys()):
-                new_state_dict = OrderedDict()
-                for k, v in state_dict.items():
-                    name = k[7:] if k.startswith('module.') else k
-                    new_state_dict[name] = v
-                state_dict = new_state_dict
-            model.load_state_dict(state_dict)
-            model.eval()
-            return model
-        except Exception as e:
-            print(f"Failed to load spoof detection model: {e}")
-            return None
-
-    def spoof_detection_algorithm(self, image_path):
-        """Check if the fingerprint is LIVE or FAKE."""
-        try:
-            if not self.model:
-                return "Model not loaded"
-
-            # Load and preprocess image
-            image = Image.open(image_path).convert("RGB")
-            image_tensor = self.transform(image).unsqueeze(0).to(self.device)
-
-            # Make prediction
-            with torch.no_grad():
-                outputs = self.model(image_tensor)
-                _, preds = torch.max(outputs, 1)
-                result = "FAKE" if preds[0] == 1 else "LIVE"
-
-            return result
-        except Exception as e:
-            print(f"Error in spoof detection: {e}")
-            return "Error"
+    def spoof_detection_algorithm(self, image):
+        """Check the fingerprint (in-memory frame, image path or list of burst frames), returning a SpoofResult."""
+        embed = self.is_embedding_search_enabled
+        if isinstance(image, list):
+            return self.spoof_detector.detect_burst(image, embed=embed)
+        return self.spoof_detector.detect(image, embed)
 
     def read_data(self):
         """Read data from the sensor"""
@@ -847,16 +1225,42 @@ class AnotherSensor:
             print(f"Error reading data: {e}")
             return None
 
-    def cleanup(self):
-        """Clean up resources"""
+    def cleanup(self, wait=True):
+        """Clean up resources; with wait=False the writers finish in the background (GUI thread)."""
         try:
+            self.close_archive_writer(wait)
+            if hasattr(self, 'candidate_index'):
+                self.candidate_index.close()
             if hasattr(self, 'ser') and self.ser.is_open:
                 self.ser.close()
-            if hasattr(self, 'model'):
-                del self.model
+            if hasattr(self, 'spoof_detector'):
+                del self.spoof_detector
         except Exception as e:
             print(f"Error during cleanup: {e}")
 
+    def close_archive_writer(self, wait=True):
+        """Stop the writers this sensor created, waiting for them to drain unless wait is False.
+
+        A shared archive writer is left running for the other sensors.
+        """
+        if not hasattr(self, 'archive_writer'):
+            return
+        writers = [self.archive_writer] if self.owns_archive_writer else []
+        if getattr(self, 'log_writer', None):
+            # Closed on the log thread once the records queued before it are written
+            self.log_writer.submit(self.capture_log.close)
+            writers.append(self.log_writer)
+        for writer in writers:
+            if wait:
+                writer.close()
+            else:
+                writer.stop()
+
+    def log_capture(self, frame, template_position, spoof_status):
+        """Queue a capture record for the dataset log, if one is configured."""
+        if self.capture_log and frame is not None:
+            self.log_writer.submit(self.capture_log.append, frame, template_position, spoof_status)
+
 # Example usage
 if __name__ == "__main__":
     sensor = AnotherSensor()
@@ -1,36 +1,62 @@
 import time
 import sqlite3
 from pyfingerprint.pyfingerprint import PyFingerprint
-import torch
-import torch.nn as nn
-from torchvision import models, transforms
-from PIL import Image
-from collections import OrderedDict
 import os
 import threading
 import serial
-import struct
+import asyncio
+from capture import decode_optical_image, OPTICAL_WIDTH, OPTICAL_HEIGHT
+from capture_log import CaptureLog, LOG_QUEUE_SIZE
+from async_transport import R307Protocol, BlockingLink
+from spoof_model import (SpoofDetector, MODEL_PATH, BURST_FRAMES, BURST_RECHECK,
+                         run_spoof_check, VERDICT_LIVE)
+from archive_writer import ImageArchiveWriter, POLICY_BLOCK
+from capture_store import capture_path, save_capture, OPTICAL_FORMAT
+from capture_quality import assess_quality, QUALITY_RETRIES
+from minutiae import extract_minutiae, MATCH_THRESHOLD
+from minutiae_index import CandidateIndex
+from parallel_matcher import ParallelMatcher
+from embedding_gallery import EmbeddingGallery
+from template_store import deletion_ranges, delete_users, invalidate_synced, claimed_templates
+from dedup_scan import DUPLICATE_POLICY
 
 # Constants for fingerprint sensor
 FINGERPRINT_CHARBUFFER1 = 0x01
 FINGERPRINT_CHARBUFFER2 = 0x02
-MODEL_PATH = "/home/live_finger/newtry27jan/model/may2_4.pth"
 DATABASE_PATH = "/home/live_finger/newtry27jan/fingerprints_optical.db"
 save_dir = os.path.expanduser("/home/live_finger/newtry27jan/Fingerprints")
 
 # Serial communication constants
 BAUD_RATE = 115200
-CMD_GENIMG = b'\xEF\x01\xFF\xFF\xFF\xFF\x01\x00\x03\x01\x00\x05'  # Capture Fingerprint
-CMD_UPIMAGE = b'\xEF\x01\xFF\xFF\xFF\xFF\x01\x00\x03\x0A\x00\x0E'  # Download Image
+
+INDEX_CANDIDATES = 5    # Host index candidates full-matched on the host, only those above MATCH_THRESHOLD are kept
+SENSOR_CANDIDATES = 2   # Slots searched one at a time ahead of the library search, each costs an R307 exchange
+
+# Burst re-checks of uncertain touches: UP_IMAGE moves 36,864 bytes at 115200 baud, ~3.5 s a frame
+BURST_LATENCY_BUDGET = 4.0   # Seconds the extra frames may add to a search, room for one
 
 class FingerprintSensor:
-    def __init__(self, port='/dev/ttyUSB1', baudrate=115200):
+    def __init__(self, port='/dev/ttyUSB1', baudrate=115200, archive_writer=None, capture_log_dir=None,
+                 spoof_detector=None):
         try:
+            # Captures are persisted by a background writer, shared with the UI when provided
+            self.owns_archive_writer = archive_writer is None
+            self.archive_writer = archive_writer or ImageArchiveWriter()
+            # Optional append-only log of every search capture for dataset collection
+            self.capture_log = CaptureLog(capture_log_dir, "Optical", OPTICAL_WIDTH, OPTICAL_HEIGHT) if capture_log_dir else None
+            # Records get their own blocking queue: the archive writer drops its oldest jobs under back-pressure
+            self.log_writer = ImageArchiveWriter(LOG_QUEUE_SIZE, POLICY_BLOCK) if self.capture_log else None
             self.fingerprint = PyFingerprint(port, baudrate, 0xFFFFFFFF, 0x00000000)
             if not self.fingerprint.verifyPassword():
                 raise ValueError("The given fingerprint sensor password is wrong!")
             print("Fingerprint sensor initialized successfully.")
             self.is_anti_spoof_enabled = False
+            self.is_burst_enabled = BURST_RECHECK  # Re-check UNCERTAIN touches with a burst of frames
+            self.burst_budget = BURST_LATENCY_BUDGET  # Seconds a burst may add, measured frame times decide the count
+            self.is_embedding_search_enabled = False  # Reuse the spoof pass's backbone features for retrieval
+            self.duplicate_policy = DUPLICATE_POLICY  # What enrolling an already enrolled finger does, see dedup_scan.py
+            self.storage_capacity = None  # Template positions of the library, read on the first split search
+            self.embedding_gallery = None
             self.last_match_position = None
             
             # Force database schema update
@@ -40,19 +66,20 @@ class FingerprintSensor:
             conn.close()
             
             self.initialize_database()
+            # Host-side minutiae index over enrolled slots, kept in the same database; its full matches
+            # (duplicate scans) run on a process pool over the spare cores
+            self.candidate_index = CandidateIndex(DATABASE_PATH, matcher=ParallelMatcher())
             # Initialize serial connection
             self.ser = serial.Serial(port, baudrate=BAUD_RATE, timeout=1)
             self.ser.reset_input_buffer()
             self.ser.reset_output_buffer()
+            # Image capture and upload run on the R307 transport, one event loop kept for the sensor's lifetime
+            self.r307 = BlockingLink(self.ser, R307Protocol)
 
-            # Initialize spoof detection model
-            self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-            self.model = self.load_model()
-            self.transform = transforms.Compose([
-                transforms.Resize((224, 224)),
-                transforms.ToTensor(),
-                transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-            ])
+            # Spoof detection model, shared when several sensors run in one station
+            self.spoof_detector = spoof_detector or SpoofDetector(MODEL_PATH)
+            self.frame_size = (OPTICAL_WIDTH, OPTICAL_HEIGHT)  # Native frame size, used to warm up the spoof model
+            self.sensor_type = "Optical"
         except Exception as e:
             print(f"Failed to initialize fingerprint sensor: {e}")
             raise e
@@ -60,6 +87,11 @@ class FingerprintSensor:
     def __del__(self):
         """Cleanup when object is destroyed."""
         try:
+            # Never wait on the writer here: its queued jobs hold the sensor, so this may run on the writer thread
+            if getattr(self, 'owns_archive_writer', False):
+                self.archive_writer.stop()
+            if getattr(self, 'log_writer', None):
+                self.log_writer.stop()
             if hasattr(self, 'ser') and self.ser.is_open:
                 self.ser.close()
             if hasattr(self, 'fingerprint'):
@@ -77,16 +109,44 @@ class FingerprintSensor:
             print(f"Error reading data: {e}")
             return None
 
-    def cleanup(self):
-        """Clean up resources"""
+    def cleanup(self, wait=True):
+        """Clean up resources; with wait=False the writers finish in the background (GUI thread)."""
         try:
+            self.close_archive_writer(wait)
+            if hasattr(self, 'candidate_index'):
+                self.candidate_index.close()
             if hasattr(self, 'ser') and self.ser.is_open:
                 self.ser.close()
+            if hasattr(self, 'r307'):
+                self.r307.close()
             if hasattr(self, 'fingerprint'):
                 del self.fingerprint
         except Exception as e:
             print(f"Error during cleanup: {e}")
 
+    def close_archive_writer(self, wait=True):
+        """Stop the writers this sensor created, waiting for them to drain unless wait is False.
+
+        A shared archive writer is left running for the other sensors.
+        """
+        if not hasattr(self, 'archive_writer'):
+            return
+        writers = [self.archive_writer] if self.owns_archive_writer else []
+        if getattr(self, 'log_writer', None):
+            # Closed on the log thread once the records queued before it are written
+            self.log_writer.submit(self.capture_log.close)
+            writers.append(self.log_writer)
+        for writer in writers:
+            if wait:
+                writer.close()
+            else:
+                writer.stop()
+
+    def log_capture(self, frame, template_position, spoof_status):
+        """Queue a capture record for the dataset log, if one is configured."""
+        if self.capture_log and frame is not None:
+            self.log_writer.submit(self.capture_log.append, frame, template_position, spoof_status)
+
     def initialize_database(self):
         try:
             # Create database directory if it doesn't exist
@@ -118,112 +178,78 @@ class FingerprintSensor:
             print(f"Database Initialization Failed: {e}")
             raise e
 
-    def send_command(self, cmd):
-        """Send a command to the R307 sensor and read the response."""
+    def gen_img(self):
+        """Image the finger on the sensor; False when there is none or the sensor did not answer."""
         try:
-            self.ser.write(cmd)
-            response = self.ser.read(12)  # Read standard response
-            return response if response else None
-        except serial.SerialException as e:
+            return self.r307.call(lambda link: link.gen_img())
+        except (serial.SerialException, OSError, asyncio.TimeoutError) as e:
             print(f"Serial communication error: {e}")
-            return None
+            return False
 
     def read_image_data(self):
-        """Optimized image transfer at 115200 baud."""
-        image_data = bytearray()
-        total_bytes = 36864  # 256 × 288 / 2
-        bytes_received = 0
-
-        response = self.send_command(CMD_UPIMAGE)
-        if not response or response[9] != 0x00:
-            print("⚠️ Failed to request image upload.")
-            return None
-
+        """Upload the image of the last gen_img as the packed 4-bit stream, None on failure."""
         start_time = time.time()
-
         try:
-            while bytes_received < total_bytes:
-                header = self.ser.read(9)  # Read packet header
-                if len(header) != 9:
-                    continue  # Skip if incomplete header
-
-                packet_type = header[6]  # Data packet identifier
-                data_length = struct.unpack(">H", header[7:9])[0] - 2  # Extract data length
-                data = self.ser.read(data_length)  # Read actual fingerprint image data
-                self.ser.read(2)  # Read checksum (not needed)
-
-                if len(data) != data_length:
-                    continue  # Skip if incomplete
-
-                image_data.extend(data)
-                bytes_received += len(data)
-
-                if packet_type == 0x08:  # End of Data Packet
-                    break
-
-            elapsed_time = time.time() - start_time
-            print(f"⏳ Image read in {elapsed_time:.4f} seconds (Optimized at 115200 baud)")
-            return image_data
-        except serial.SerialException as e:
+            image_data = self.r307.call(lambda link: link.up_image())
+        except (serial.SerialException, OSError, asyncio.TimeoutError) as e:
             print(f"Error reading image data: {e}")
             return None
+        if image_data is None:
+            print("⚠️ Failed to request image upload.")
+            return None
+        elapsed_time = time.time() - start_time
+        print(f"⏳ Image read in {elapsed_time:.4f} seconds (Optimized at 115200 baud)")
+        return image_data
+
+    def capture_frame(self):
+        """Capture an image and upload it from the sensor, returning the decoded frame or None."""
+        if not self.gen_img():
+            print("❌ Fingerprint capture failed.")
+            return None
 
-    def save_bmp(self, image_data, image_path):
-        """Save fingerprint image as BMP."""
-        try:
-            width, height = 256, 288
-            decoded_image = bytearray()
-
-            for byte in image_data:
-                high_pixel = (byte & 0xF0)
-                low_pixel = (byte & 0x0F) << 4
-                decoded_image.extend([high_pixel, low_pixel])
-
-            file_size = 54 + 1024 + len(decoded_image)
-
-            bmp_header = b'BM' + struct.pack('<I', file_size) + b'\x00\x00\x00\x00' + struct.pack('<I', 54 + 1024)
-            dib_header = struct.pack('<I', 40) + struct.pack('<i', width) + struct.pack('<i', -height)
-            dib_header += struct.pack('<H', 1) + struct.pack('<H', 8) + struct.pack('<I', 0)
-            dib_header += struct.pack('<I', len(decoded_image)) + struct.pack('<i', 0) + struct.pack('<i', 0)
-            dib_header += struct.pack('<I', 256) + struct.pack('<I', 0)
-
-            palette = b''.join(struct.pack('BBBB', i, i, i, 0) for i in range(256))
-
-            with open(image_path, "wb") as f:
-                f.write(bmp_header + dib_header + palette + decoded_image)
-
-            print(f"📸 Image saved as '{image_path}'.")
-            return True
-        except Exception as e:
-            print(f"Error saving BMP: {e}")
-            return False
-
-    def capture_and_download(self, image_path):
-        """Capture and download fingerprint image using serial communication."""
+        print("✅ Fingerprint captured!")
+        image_data = self.read_image_data()
+        if not image_data:
+            print("⚠️ Image download failed.")
+            return None
+        return decode_optical_image(image_data)
+
+    def capture_burst(self, first_frame, frame_time, max_frames=BURST_FRAMES, budget=None):
+        """Capture further frames of the same touch while the finger stays down and the budget allows.
+
+        frame_time is the measured time of the last capture, each new frame updates it.
+        """
+        budget = self.burst_budget if budget is None else budget
+        frames = [first_frame]
+        burst_start = time.time()
+        while len(frames) < max_frames and time.time() - burst_start + frame_time <= budget:
+            capture_start = time.time()
+            frame = self.capture_frame()
+            if frame is None:
+                break  # Finger lifted
+            frames.append(frame)
+            frame_time = time.time() - capture_start
+        return frames
+
+    def capture_and_download(self, image_path, frame_callback=None):
+        """Capture and download fingerprint image, returning the decoded frame."""
         try:
             total_start = time.time()
 
             print("👉 Place your finger on the sensor...")
-            response = self.send_command(CMD_GENIMG)
-            if not response or response[9] != 0x00:
-                print("❌ Fingerprint capture failed.")
-                return False
-
-            print("✅ Fingerprint captured!")
-            image_data = self.read_image_data()
-            if not image_data:
-                print("⚠️ Image download failed.")
-                return False
-
-            if not self.save_bmp(image_data, image_path):
-                return False
+            frame = self.capture_frame()
+            if frame is None:
+                return None
+            if frame_callback:
+                frame_callback(frame)  # Hand the preview over before touching the disk
+            self.archive_writer.submit(save_capture, frame, image_path)
 
             total_elapsed = time.time() - total_start
             print(f"⏳ Total execution time: {total_elapsed:.4f} seconds")
-            return True
+            return frame
         except Exception as e:
             print(f"Error in capture_and_download: {e}")
-            return False
+            return None
 
     def enroll_finger(self, name, update_ui_callback=None, enroll_complete_callback=None):
         """Enroll a new fingerprint."""
@@ -232,9 +258,6 @@ class FingerprintSensor:
                 update_ui_callback("🔄 Starting fingerprint enrollment...")
 
             enroll_id = time.strftime("%Y%m%d_%H%M%S")
-            enroll_folder = os.path.join(save_dir, f"enroll_{enroll_id}")
-            if not os.path.exists(enroll_folder):
-                os.makedirs(enroll_folder)
 
             # Step 1: Capture first image (GenImg)
             if update_ui_callback:
@@ -242,21 +265,18 @@ class FingerprintSensor:
 
             first_scan_complete = False
             while not first_scan_complete:
-                response = self.send_command(CMD_GENIMG)
-                if response and response[9] == 0x00:
+                if self.gen_img():
                     # Get and save first scan image
                     image_data = self.read_image_data()
                     if image_data:
-                        image_path1 = os.path.join(enroll_folder, f"scan_1_{enroll_id}.bmp")
-                        if self.save_bmp(image_data, image_path1):
-                            if enroll_complete_callback:
-                                enroll_complete_callback(image_path1)  # Show first scan immediately
-                            first_scan_complete = True
-                            if update_ui_callback:
-                                update_ui_callback("✅ First scan completed successfully.")
-                        else:
-                            if update_ui_callback:
-                                update_ui_callback("❌ Failed to save image, please try again...")
+                        frame1 = decode_optical_image(image_data, operation="enroll")
+                        if enroll_complete_callback:
+                            enroll_complete_callback(frame1)  # Show first scan immediately
+                        image_path1 = capture_path(save_dir, "enroll", OPTICAL_FORMAT, f"scan_1_{enroll_id}")
+                        self.archive_writer.submit(save_capture, frame1, image_path1)
+                        first_scan_complete = True
+                        if update_ui_callback:
+                            update_ui_callback("✅ First scan completed successfully.")
                     else:
                         if update_ui_callback:
                             update_ui_callback("❌ Failed to read image data, please try again...")
@@ -268,6 +288,22 @@ class FingerprintSensor:
             # Convert to template
             self.fingerprint.convertImage(FINGERPRINT_CHARBUFFER1)
 
+            # Identify the first scan before asking for the second one
+            merge_into = None
+            if self.duplicate_policy != "allow":
+                duplicate = self.find_duplicate()
+                if duplicate is not None:
+                    slot, existing_name = duplicate
+                    if self.duplicate_policy == "reject":
+                        raise Exception(f"This finger is already enrolled as {existing_name} (template {slot})")
+                    if update_ui_callback:
+                        update_ui_callback(f"ℹ️ This finger is already enrolled as {existing_name}, "
+                                           f"its template will be refreshed")
+                        if name and name != existing_name:
+                            update_ui_callback(f"ℹ️ The name {name} is not used, the finger stays enrolled "
+                                               f"as {existing_name}")
+                    merge_into = duplicate
+
             if update_ui_callback:
                 update_ui_callback("🔄 Step 2/3: Remove finger, then place it again for second scan...")
             time.sleep(1)  # Give time to remove finger
@@ -275,21 +311,18 @@ class FingerprintSensor:
             # Step 2: Capture second image
             second_scan_complete = False
             while not second_scan_complete:
-                response = self.send_command(CMD_GENIMG)
-                if response and response[9] == 0x00:
+                if self.gen_img():
                     # Get and save second scan image
                     image_data = self.read_image_data()
                     if image_data:
-                        image_path2 = os.path.join(enroll_folder, f"scan_2_{enroll_id}.bmp")
-                        if self.save_bmp(image_data, image_path2):
-                            if enroll_complete_callback:
-                                enroll_complete_callback(image_path2)  # Show second scan immediately
-                            second_scan_complete = True
-                            if update_ui_callback:
-                                update_ui_callback("✅ Second scan completed successfully.")
-                        else:
-                            if update_ui_callback:
-                                update_ui_callback("❌ Failed to save image, please try again...")
+                        frame2 = decode_optical_image(image_data, operation="enroll")
+                        if enroll_complete_callback:
+                            enroll_complete_callback(frame2)  # Show second scan immediately
+                        image_path2 = capture_path(save_dir, "enroll", OPTICAL_FORMAT, f"scan_2_{enroll_id}")
+                        self.archive_writer.submit(save_capture, frame2, image_path2)
+                        second_scan_complete = True
+                        if update_ui_callback:
+                            update_ui_callback("✅ Second scan completed successfully.")
                     else:
                         if update_ui_callback:
                             update_ui_callback("❌ Failed to read image data, please try again...")
@@ -311,21 +344,29 @@ class FingerprintSensor:
 
             # Create and store template
             self.fingerprint.createTemplate()
-            position_number = self.fingerprint.storeTemplate()
+            if merge_into is not None:
+                # Same user, same position: only the templates change
+                position_number = self.fingerprint.storeTemplate(merge_into[0])
+                self.update_host_indexes(position_number, [frame1, frame2])
+                if update_ui_callback:
+                    update_ui_callback(f"✅ Template refreshed for {merge_into[1]}.")
+            else:
+                position_number = self.fingerprint.storeTemplate()
 
-            # Save to database
-            db = sqlite3.connect(DATABASE_PATH)
-            cursor = db.cursor()
-            cursor.execute('INSERT INTO fingerprints (name, template_position) VALUES (?, ?)', (name, position_number))
-            db.commit()
-            db.close()
+                # Save to database
+                db = sqlite3.connect(DATABASE_PATH)
+                cursor = db.cursor()
+                cursor.execute('INSERT INTO fingerprints (name, template_position) VALUES (?, ?)', (name, position_number))
+                db.commit()
+                db.close()
+                self.update_host_indexes(position_number, [frame1, frame2])
 
-            if update_ui_callback:
-                update_ui_callback(f"✅ Fingerprint enrolled successfully as {name}.")
+                if update_ui_callback:
+                    update_ui_callback(f"✅ Fingerprint enrolled successfully as {name}.")
 
-            # Return both image paths for final display
+            # Return both frames for final display
             if enroll_complete_callback:
-                enroll_complete_callback([image_path1, image_path2])
+                enroll_complete_callback([frame1, frame2])
 
         except Exception as e:
             if update_ui_callback:
@@ -355,6 +396,7 @@ class FingerprintSensor:
             if self.fingerprint.deleteTemplate(template_position):
                 cursor.execute('DELETE FROM fingerprints WHERE id = ?', (position,))
                 db.commit()
+                self.update_host_indexes(template_position)
                 if update_ui_callback:
                     update_ui_callback(f"✅ Fingerprint for {name} deleted successfully.")
                 return True
@@ -370,6 +412,115 @@ class FingerprintSensor:
         finally:
             db.close()
 
+    def delete_slots(self, slots):
+        """Delete templates with one deleteTemplate(position, count) per range; returns the positions now empty.
+
+        Ranges only absorb positions the index pages read just now show empty; without them only adjacent
+        positions are merged.
+        """
+        slots = set(slots)
+        deleted = set()
+        try:
+            occupied = self.template_slots()
+        except Exception as e:
+            print(f"Failed to read the template index: {e}")
+            occupied = None
+        for start, end in deletion_ranges(slots, occupied):
+            try:
+                if self.fingerprint.deleteTemplate(start, end - start + 1):
+                    deleted.update(slot for slot in slots if start <= slot <= end)
+            except Exception as e:
+                print(f"Failed to delete templates {start}-{end}: {e}")
+        return deleted
+
+    def delete_fingers(self, positions, update_ui_callback=None):
+        """Delete many fingerprints by database ID, see template_store.delete_users; returns the number deleted."""
+        return delete_users(self, DATABASE_PATH, positions, update_ui_callback)
+
+    def template_slots(self):
+        """Occupied template positions from the sensor's template index pages."""
+        slots = set()
+        for page in range((self.fingerprint.getStorageCapacity() + 255) // 256):
+            slots.update(page * 256 + i for i, used in enumerate(self.fingerprint.getTemplateIndex(page)) if used)
+        return slots
+
+    def read_template(self, slot):
+        """Bytes of the template stored at a position, None if the transfer failed."""
+        try:
+            self.fingerprint.loadTemplate(slot, FINGERPRINT_CHARBUFFER1)
+            return bytes(self.fingerprint.downloadCharacteristics(FINGERPRINT_CHARBUFFER1))
+        except Exception as e:
+            print(f"Failed to read template {slot}: {e}")
+            return None
+
+    def write_template(self, slot, template):
+        """Store template bytes at a position, overwriting it; returns True on success."""
+        try:
+            self.fingerprint.uploadCharacteristics(FINGERPRINT_CHARBUFFER1, list(template))
+            if self.fingerprint.storeTemplate(slot, FINGERPRINT_CHARBUFFER1) != slot:
+                return False
+            invalidate_synced([slot])
+            return True
+        except Exception as e:
+            print(f"Failed to write template {slot}: {e}")
+            return False
+
+    def update_host_indexes(self, slot, frames=None):
+        """Index the enrollment frames of a slot, or drop the slot when frames is None; never fails the caller."""
+        try:
+            if frames is None:
+                self.drop_host_indexes([slot])
+                return
+            invalidate_synced([slot])  # The template store must compare this slot again
+            self.candidate_index.add_frames(slot, frames)
+            if self.is_embedding_search_enabled and self.spoof_detector.model is not None:
+                self.current_embedding_gallery().add(slot, self.spoof_detector.embed(frames).mean(axis=0))
+        except Exception as e:
+            print(f"Failed to update the host indexes for slot {slot}: {e}")
+
+    def drop_host_indexes(self, slots):
+        """Forget deleted slots in the host indexes, with one commit per index."""
+        invalidate_synced(slots)
+        try:
+            self.candidate_index.remove_many(slots)
+            self.current_embedding_gallery().remove_many(slots)
+        except Exception as e:
+            print(f"Failed to drop {len(slots)} slots from the host indexes: {e}")
+
+    def current_embedding_gallery(self):
+        """Embedding gallery of the spoof model in use, reopened when the model manager swapped it."""
+        model_name = os.path.basename(self.spoof_detector.model_path)
+        if self.embedding_gallery is None or self.embedding_gallery.model_name != model_name:
+            self.embedding_gallery = EmbeddingGallery(DATABASE_PATH, model_name)
+        return self.embedding_gallery
+
+    def remember_embedding(self, slot, spoof_status):
+        """Store the embedding of a LIVE match for a slot the current model has none for yet.
+
+        Users enrolled before embedding search was enabled, or before a model swap, are filled in on
+        their first match instead of needing to re-enroll.
+        """
+        embedding = getattr(spoof_status, 'embedding', None)
+        if embedding is None or spoof_status.verdict != VERDICT_LIVE:
+            return
+        try:
+            gallery = self.current_embedding_gallery()
+            if slot not in gallery:
+                gallery.add(slot, embedding)
+        except Exception as e:
+            print(f"Failed to store the embedding of template {slot}: {e}")
+
+    def embedding_candidates(self, spoof_status):
+        """Enrolled slots closest to the embedding of the spoof pass, empty when there is none."""
+        embedding = getattr(spoof_status, 'embedding', None)
+        if embedding is None:
+            return []
+        try:
+            return [slot for slot, _ in self.current_embedding_gallery().search(embedding)]
+        except Exception as e:
+            print(f"Embedding search failed: {e}")
+            return []
+
     def list_enrolled_fingers(self):
         try:
             db = sqlite3.connect(DATABASE_PATH)
@@ -383,100 +534,166 @@ class FingerprintSensor:
         finally:
             db.close()
 
-    def search_finger(self, update_ui_callback=None, search_complete_callback=None):
-        def run_search():
-            search_start_time = time.time()
-            try:
-                # Check if port is open and working
-                if not self.ser.is_open:
+    def index_candidates(self, frame):
+        """Index candidates whose host full match clears MATCH_THRESHOLD, best first; empty when none is confident."""
+        if not len(self.candidate_index):
+            return []
+        try:
+            matches = self.candidate_index.identify(extract_minutiae(frame.pixels), INDEX_CANDIDATES, MATCH_THRESHOLD)
+            return [slot for slot, _ in matches]
+        except Exception as e:
+            print(f"Candidate lookup failed: {e}")
+            return []
+
+    def search_enrolled(self, candidates=()):
+        """Position matching char buffer 1, -1 when there is none.
+
+        The first SENSOR_CANDIDATES candidates are searched one position at a time, then the rest of the library
+        in the ranges between them, so no position is searched twice.
+        """
+        tried = list(dict.fromkeys(candidates))[:SENSOR_CANDIDATES]
+        for slot in tried:
+            position_number = self.fingerprint.searchTemplate(FINGERPRINT_CHARBUFFER1, slot, 1)[0]
+            if position_number >= 0:
+                return position_number
+        if not tried:
+            return self.fingerprint.searchTemplate(FINGERPRINT_CHARBUFFER1)[0]
+        if self.storage_capacity is None:
+            self.storage_capacity = self.fingerprint.getStorageCapacity()
+        start = 0
+        for end in sorted(tried) + [self.storage_capacity]:
+            if end > start:
+                position_number = self.fingerprint.searchTemplate(FINGERPRINT_CHARBUFFER1, start, end - start)[0]
+                if position_number >= 0:
+                    return position_number
+            start = end + 1
+        return -1
+
+    def find_duplicate(self):
+        """(position, name) of an enrolled finger matching char buffer 1, None when the finger is new."""
+        position_number = self.fingerprint.searchTemplate(FINGERPRINT_CHARBUFFER1)[0]
+        if position_number < 0:
+            return None
+        db = sqlite3.connect(DATABASE_PATH)
+        try:
+            row = db.execute('SELECT name FROM fingerprints WHERE template_position = ?',
+                             (position_number,)).fetchone()
+        finally:
+            db.close()
+        return position_number, row[0] if row else f"User {position_number}"
+
+    def claimed_templates(self, claim):
+        return claimed_templates(DATABASE_PATH, claim)
+
+    def capture_search_frame(self, update_ui_callback=None, frame_callback=None, operation="search", stop=None):
+        """Wait for a finger and capture a frame that passes the quality gate.
+
+        Returns (frame, capture time in seconds), or None on timeout or when every attempt was rejected.
+        With a stop event there is no timeout: it waits until a finger is placed or stop is set.
+        """
+        # Poor captures are rejected before template generation, the user presses again
+        for attempt in range(QUALITY_RETRIES + 1):
+            timeout = time.time() + 10
+            while not self.fingerprint.readImage():
+                if stop is not None:
+                    if stop.is_set():
+                        return None
+                elif time.time() > timeout:
                     if update_ui_callback:
-                        update_ui_callback("❌ Sensor port is not open. Attempting to reconnect...")
-                    try:
-                        self.ser.open()
-                    except Exception as e:
-                        if update_ui_callback:
-                            update_ui_callback(f"❌ Failed to reconnect to sensor: {e}")
-                        return
+                        update_ui_callback("❌ Timeout: No finger detected.")
+                    return None
+                time.sleep(0.1)
 
-                if update_ui_callback:
-                    update_ui_callback("🔄 Waiting for finger...")
+            if update_ui_callback:
+                update_ui_callback("✅ Finger detected, processing...")
+
+            image_path = capture_path(save_dir, operation, OPTICAL_FORMAT, "fingerprint")
+            capture_start = time.time()
+            frame = self.capture_and_download(image_path, frame_callback)
+            if frame is None:
+                raise Exception("Failed to capture and download fingerprint image.")
+            quality = assess_quality(frame.pixels)
+            if quality.ok:
+                return frame, time.time() - capture_start
+            if update_ui_callback:
+                update_ui_callback(f"⚠️ {quality.reason}. Please lift your finger and press again")
+            self.wait_for_lift(stop)
 
-                try:
-                    timeout = time.time() + 10
-                    while not self.fingerprint.readImage():
-                        if time.time() > timeout:
-                            update_ui_callback("❌ Timeout: No finger detected.")
-                            return
-                        time.sleep(0.1)
+        if update_ui_callback:
+            update_ui_callback("❌ Capture quality too low, please try again")
+        return None
 
-                    if update_ui_callback:
-                        update_ui_callback("✅ Finger detected, processing...")
-
-                    timestamp = time.strftime("%Y%m%d%H%M%S")
-                    image_path = os.path.join(save_dir, f"fingerprint_{timestamp}.bmp")
-                    if not self.capture_and_download(image_path):
-                        raise Exception("Failed to capture and download fingerprint image.")
-
-                    self.fingerprint.convertImage(FINGERPRINT_CHARBUFFER1)
-                    result = self.fingerprint.searchTemplate()
-                    position_number = result[0]
-                    self.last_match_position = position_number
-                    is_match = position_number >= 0
-
-                    # Get the name of the matched fingerprint
-                    matched_name = None
-                    if is_match:
-                        try:
-                            db = sqlite3.connect(DATABASE_PATH)
-                            cursor = db.cursor()
-                            cursor.execute('SELECT name FROM fingerprints WHERE template_position = ?', (position_number,))
-                            result = cursor.fetchone()
-                            if result:
-                                matched_name = result[0]
-                                if update_ui_callback:
-                                    update_ui_callback(f"✅ Fingerprint matched with: {matched_name}")
-                            db.close()
-                        except Exception as e:
-                            if update_ui_callback:
-                                update_ui_callback(f"❌ Database error: {str(e)}")
+    def run_spoof_check(self, frame, capture_time, update_ui_callback=None):
+        return run_spoof_check(self, frame, capture_time, update_ui_callback)
 
-                    spoof_status = "Disabled"
-                    spoof_detection_time = 0
+    def identify(self, update_ui_callback=None, search_complete_callback=None, frame_callback=None, stop=None):
+        """Capture one press and search the gallery on the calling thread.
 
-                    if self.is_anti_spoof_enabled:
-                        if update_ui_callback:
-                            update_ui_callback("🔄 Performing spoof detection...")
-                        spoof_detection_start = time.time()
-                        spoof_status = self.spoof_detection_algorithm(image_path)
-                        spoof_detection_time = time.time() - spoof_detection_start
-                        if update_ui_callback:
-                            update_ui_callback(f"✅ Spoof detection completed in {spoof_detection_time:.2f} seconds")
+        Returns True on a match, False when there was none, None when nothing was identified
+        (capture failed, or stop was set while waiting for a finger).
+        """
+        search_start_time = time.time()
+        try:
+            # Check if port is open and working
+            if not self.ser.is_open:
+                if update_ui_callback:
+                    update_ui_callback("❌ Sensor port is not open. Attempting to reconnect...")
+                try:
+                    self.ser.open()
+                except Exception as e:
+                    if update_ui_callback:
+                        update_ui_callback(f"❌ Failed to reconnect to sensor: {e}")
+                    return None
 
-                    if search_complete_callback:
-                        search_complete_callback(is_match, image_path, spoof_status, matched_name)
+            if update_ui_callback:
+                update_ui_callback("🔄 Waiting for finger...")
 
-                except serial.SerialException as e:
-                    if update_ui_callback:
-                        update_ui_callback(f"❌ Serial communication error: {e}")
-                    # Try to recover the connection
+            try:
+                capture = self.capture_search_frame(update_ui_callback, frame_callback, stop=stop)
+                if capture is None:
+                    return None
+                frame, capture_time = capture
+                # The template comes from the displayed, quality-gated frame: a burst overwrites the image buffer
+                self.fingerprint.convertImage(FINGERPRINT_CHARBUFFER1)
+                spoof_status = self.run_spoof_check(frame, capture_time, update_ui_callback)
+
+                # Confident index candidates (host full match) and embedding candidates are tried first
+                candidates = self.index_candidates(frame) + self.embedding_candidates(spoof_status)
+                position_number = self.search_enrolled(candidates)
+                self.last_match_position = position_number
+                is_match = position_number >= 0
+
+                # Get the name of the matched fingerprint
+                matched_name = None
+                if is_match:
                     try:
-                        self.ser.close()
-                        time.sleep(1)  # Wait before reconnecting
-                        self.ser.open()
-                        if update_ui_callback:
-                            update_ui_callback("✅ Sensor reconnected successfully")
+                        db = sqlite3.connect(DATABASE_PATH)
+                        cursor = db.cursor()
+                        cursor.execute('SELECT name FROM fingerprints WHERE template_position = ?', (position_number,))
+                        result = cursor.fetchone()
+                        if result:
+                            matched_name = result[0]
+                            if update_ui_callback:
+                                update_ui_callback(f"✅ Fingerprint matched with: {matched_name}")
+                        db.close()
                     except Exception as e:
                         if update_ui_callback:
-                            update_ui_callback(f"❌ Failed to recover sensor connection: {e}")
-                        return
+                            update_ui_callback(f"❌ Database error: {str(e)}")
 
-            except Exception as e:
+                if is_match:
+                    self.remember_embedding(position_number, spoof_status)
+
+                self.log_capture(frame, position_number, spoof_status)
+                if search_complete_callback:
+                    search_complete_callback(is_match, frame, spoof_status, matched_name)
+                return is_match
+
+            except serial.SerialException as e:
                 if update_ui_callback:
-                    update_ui_callback(f"❌ Search Failed: {e}")
+                    update_ui_callback(f"❌ Serial communication error: {e}")
                 # Try to recover the connection
                 try:
-                    if self.ser.is_open:
-                        self.ser.close()
+                    self.ser.close()
                     time.sleep(1)  # Wait before reconnecting
                     self.ser.open()
                     if update_ui_callback:
@@ -485,54 +702,101 @@ class FingerprintSensor:
                     if update_ui_callback:
                         update_ui_callback(f"❌ Failed to recover sensor connection: {e}")
 
-            finally:
-                total_search_time = time.time() - search_start_time
+        except Exception as e:
+            if update_ui_callback:
+                update_ui_callback(f"❌ Search Failed: {e}")
+            # Try to recover the connection
+            try:
+                if self.ser.is_open:
+                    self.ser.close()
+                time.sleep(1)  # Wait before reconnecting
+                self.ser.open()
+                if update_ui_callback:
+                    update_ui_callback("✅ Sensor reconnected successfully")
+            except Exception as e:
+                if update_ui_callback:
+                    update_ui_callback(f"❌ Failed to recover sensor connection: {e}")
+
+        finally:
+            total_search_time = time.time() - search_start_time
+            if update_ui_callback:
+                update_ui_callback(f"⏱️ Total operation time: {total_search_time:.2f} seconds")
+        return None
+
+    def search_finger(self, update_ui_callback=None, search_complete_callback=None, frame_callback=None):
+        threading.Thread(target=self.identify,
+                         args=(update_ui_callback, search_complete_callback, frame_callback)).start()
+
+    def wait_for_lift(self, stop=None):
+        """Block until the finger is off the sensor (or stop is set)."""
+        while self.fingerprint.readImage():
+            if stop is not None and stop.is_set():
+                return
+            time.sleep(0.1)
+
+    def verify_finger(self, claim, update_ui_callback=None, verify_complete_callback=None, frame_callback=None):
+        """1:1 verification: compare the capture only with the templates of the claimed user."""
+        def run_verify():
+            verify_start_time = time.time()
+            try:
+                candidates = self.claimed_templates(claim)
+                if not candidates:
+                    if update_ui_callback:
+                        update_ui_callback(f"❌ No enrolled fingerprint for {claim}")
+                    return
+
                 if update_ui_callback:
-                    update_ui_callback(f"⏱️ Total operation time: {total_search_time:.2f} seconds")
+                    update_ui_callback(f"🔄 Verifying {candidates[0][0]}, place your finger...")
+                capture = self.capture_search_frame(update_ui_callback, frame_callback, "verify")
+                if capture is None:
+                    return
+                frame, capture_time = capture
+                convert_start = time.time()
+                self.fingerprint.convertImage(FINGERPRINT_CHARBUFFER1)  # Before a burst overwrites the image buffer
+                convert_time = time.time() - convert_start
+                # Checked while the finger is still down, so an uncertain verdict can take a burst
+                spoof_status = self.run_spoof_check(frame, capture_time, update_ui_callback)
+
+                compare_start = time.time()
+                matched = None
+                for name, template_position in candidates:
+                    self.fingerprint.loadTemplate(template_position, FINGERPRINT_CHARBUFFER2)
+                    score = self.fingerprint.compareCharacteristics()
+                    if score > 0:
+                        matched = (name, template_position, score)
+                        break
+                compare_time = time.time() - compare_start + convert_time
 
-        threading.Thread(target=run_search).start()
+                if update_ui_callback:
+                    if matched:
+                        update_ui_callback(f"✅ Verified as {matched[0]} (score {matched[2]}, "
+                                           f"compare time: {compare_time:.2f} seconds)")
+                    else:
+                        update_ui_callback(f"❌ Fingerprint does not match {candidates[0][0]} "
+                                           f"(compare time: {compare_time:.2f} seconds)")
 
-    def load_model(self):
-        """Load the pre-trained spoof detection model."""
-        try:
-            model = models.resnet50(pretrained=False)
-            model.fc = torch.nn.Linear(model.fc.in_features, 2)
-            model = model.to(self.device)
-
-            state_dict = torch.load(MODEL_PATH, map_location=self.device)
-            if any(k.startswith('module.') for k in state_dict.keys()):
-                new_state_dict = OrderedDict()
-                for k, v in state_dict.items():
-                    name = k[7:] if k.startswith('module.') else k
-                    new_state_dict[name] = v
-                state_dict = new_state_dict
-            model.load_state_dict(state_dict)
-            model.eval()
-            return model
-        except Exception as e:
-            print(f"Failed to load spoof detection model: {e}")
-            return None
+                position_number = matched[1] if matched else -1
+                self.log_capture(frame, position_number, spoof_status)
+                if verify_complete_callback:
+                    verify_complete_callback(matched is not None, frame, spoof_status,
+                                             matched[0] if matched else None)
 
-    def spoof_detection_algorithm(self, image_path):
-        """Check if the fingerprint is LIVE or FAKE."""
-        try:
-            if not self.model:
-                return "Model not loaded"
+            except Exception as e:
+                if update_ui_callback:
+                    update_ui_callback(f"❌ Verification Failed: {e}")
 
-            # Load and preprocess image
-            image = Image.open(image_path).convert("RGB")
-            image_tensor = self.transform(image).unsqueeze(0).to(self.device)
+            finally:
+                if update_ui_callback:
+                    update_ui_callback(f"⏱️ Total operation time: {time.time() - verify_start_time:.2f} seconds")
 
-            # Make prediction
-            with torch.no_grad():
-                outputs = self.model(image_tensor)
-                _, preds = torch.max(outputs, 1)
-                result = "FAKE" if preds[0] == 1 else "LIVE"
+        threading.Thread(target=run_verify).start()
 
-            return result
-        except Exception as e:
-            print(f"Error in spoof detection: {e}")
-            return "Error"
+    def spoof_detection_algorithm(self, image):
+        """Check the fingerprint (in-memory frame, image path or list of burst frames), returning a SpoofResult."""
+        embed = self.is_embedding_search_enabled
+        if isinstance(image, list):
+            return self.spoof_detector.detect_burst(image, embed=embed)
+        return self.spoof_detector.detect(image, embed)
 
     def toggle_anti_spoof(self):
         """Toggle spoof detection on/off."""
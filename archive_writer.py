@@ -0,0 +1,99 @@
+import threading
+import time
+from collections import deque
+
+# Back-pressure policies when the queue is full
+POLICY_BLOCK = "block"              # Caller waits until the writer catches up
+POLICY_DROP_OLDEST = "drop_oldest"  # Oldest pending capture is discarded
+
+# Defaults used by the station
+ARCHIVE_QUEUE_SIZE = 32
+ARCHIVE_POLICY = POLICY_DROP_OLDEST
+
+
+class ImageArchiveWriter:
+    """Background thread that persists captures after the identification path is done with them."""
+    def __init__(self, max_pending=ARCHIVE_QUEUE_SIZE, policy=ARCHIVE_POLICY):
+        if policy not in (POLICY_BLOCK, POLICY_DROP_OLDEST):
+            raise ValueError(f"Unknown archive back-pressure policy: {policy}")
+        self.max_pending = max(1, max_pending)
+        self.policy = policy
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self._pending = deque()
+        self._busy = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="ImageArchiveWriter", daemon=True)
+        self._thread.start()
+
+    def submit(self, write_fn, *args):
+        """Queue write_fn(*args) to run on the writer thread. Returns False if the job was rejected."""
+        with self._cond:
+            if self._closed:
+                print("⚠️ Archive writer is closed, capture not saved")
+                return False
+            while len(self._pending) >= self.max_pending:
+                if self.policy == POLICY_DROP_OLDEST:
+                    self._pending.popleft()
+                    self.dropped += 1
+                else:
+                    self._cond.wait()
+                    if self._closed:
+                        return False
+            self._pending.append((write_fn, args))
+            self._cond.notify_all()
+        return True
+
+    def pending(self):
+        """Number of captures waiting to be written."""
+        with self._cond:
+            return len(self._pending) + (1 if self._busy else 0)
+
+    def flush(self, timeout=None):
+        """Block until every queued capture has been written. Returns False on timeout."""
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self._pending or self._busy:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stop(self):
+        """Stop accepting captures without waiting; the thread still writes what is queued, then exits."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def close(self, timeout=None):
+        """Flush outstanding captures and stop the writer thread."""
+        flushed = self.flush(timeout)
+        self.stop()
+        self._thread.join(timeout)
+        if not flushed:
+            print(f"⚠️ Archive writer closed with {self.pending()} captures unsaved")
+        return flushed
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                write_fn, args = self._pending.popleft()
+                self._busy = True
+                self._cond.notify_all()  # Wake producers blocked on a full queue
+            try:
+                write_fn(*args)
+                self.written += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"Error writing capture to archive: {e}")
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
@@ -0,0 +1,347 @@
+import os
+import sys
+import time
+import struct
+import asyncio
+import argparse
+from sensor_protocol import (Command, Response, Command_SID, Command_DID, CAP_PACKET_BYTES, CAP_IMAGE_STREAM_BYTES,
+                             CMD_FINGER_DETECT, CMD_GET_IMAGE, CMD_UP_IMAGE_CODE, CMD_GENERATE, CMD_SEARCH, CMD_DEL_CHAR,
+                             ERR_SUCCESS, MAX_TEMPLATE_ID, R307_HEADER, R307_ADDRESS, R307_COMMAND, R307_ACK, R307_END,
+                             R307_GEN_IMG, R307_IMG_2_TZ, R307_SEARCH, R307_DELETE, R307_UP_IMAGE, R307_VERIFY_PASSWORD,
+                             R307_SUCCESS, R307_CAPACITY)
+
+# Serial I/O for both sensor protocols on one asyncio event loop. Commands are awaitable, time out and
+# can be cancelled, so a single thread drives any number of sensors. pyserial only opens and configures
+# the port; reads and writes go through the event loop on the port's non-blocking file descriptor.
+# The station's sensor classes use it for the R307 capture path only, through a BlockingLink per sensor.
+COMMAND_TIMEOUT = 1.0        # Seconds for a command's response
+IMAGE_TIMEOUT = 8.0          # Seconds for a whole image upload
+RESYNC_QUIET = 0.05          # Silence that ends a late response after a timed out or cancelled command
+FINGER_POLL = 0.01           # Seconds between finger detection polls
+
+
+class SerialStream:
+    """Byte stream over a non-blocking file descriptor, served by the running event loop."""
+    def __init__(self, fd, owner=None):
+        self.fd = fd
+        self._owner = owner          # Keeps the object that owns the descriptor (the pyserial port) alive
+        self._loop = asyncio.get_running_loop()
+        self._buffer = bytearray()
+        self._waiter = None
+        self._error = None
+        os.set_blocking(fd, False)
+        self._loop.add_reader(fd, self._on_readable)
+
+    @classmethod
+    async def open(cls, port, baudrate):
+        """Open and configure a serial port with pyserial, then hand its descriptor to the event loop."""
+        import serial
+        ser = serial.Serial(port, baudrate, timeout=0)
+        return cls(ser.fileno(), ser)
+
+    def _on_readable(self):
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            data, self._error = b"", e
+        if not data:
+            self._error = self._error or ConnectionError("Serial port closed")
+            self._loop.remove_reader(self.fd)
+        self._buffer.extend(data)
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def read_exactly(self, count):
+        while len(self._buffer) < count:
+            if self._error is not None:
+                raise self._error
+            self._waiter = self._loop.create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+        data = bytes(self._buffer[:count])
+        del self._buffer[:count]
+        return data
+
+    async def write(self, data):
+        view = memoryview(bytes(data))
+        while view:
+            try:
+                view = view[os.write(self.fd, view):]
+            except BlockingIOError:
+                pass
+            if view:
+                ready = self._loop.create_future()
+                self._loop.add_writer(self.fd, ready.set_result, None)
+                try:
+                    await ready
+                finally:
+                    self._loop.remove_writer(self.fd)
+
+    async def discard_until_quiet(self, quiet=RESYNC_QUIET):
+        """Drop buffered and arriving bytes until the line has been silent for quiet seconds."""
+        while True:
+            self._buffer.clear()
+            await asyncio.sleep(quiet)
+            if not self._buffer:
+                return
+
+    def detach(self):
+        """Hand the descriptor back to blocking use without closing it; unread bytes are dropped."""
+        self._loop.remove_reader(self.fd)
+        os.set_blocking(self.fd, True)
+
+    def close(self):
+        self._loop.remove_reader(self.fd)
+        if self._owner is not None:
+            self._owner.close()
+        else:
+            os.close(self.fd)
+
+
+class _Protocol:
+    """One exchange at a time per sensor; a timed out or cancelled exchange resynchronizes the next one."""
+    def __init__(self, stream, timeout=COMMAND_TIMEOUT):
+        self.stream = stream
+        self.timeout = timeout
+        self._lock = asyncio.Lock()
+        self._stale = False
+
+    async def exchange(self, packet, receive, timeout=None):
+        async with self._lock:
+            if self._stale:
+                # A late response to the abandoned command must not be read as this one's
+                await self.stream.discard_until_quiet()
+                self._stale = False
+            await self.stream.write(packet)
+            try:
+                return await asyncio.wait_for(receive(), timeout or self.timeout)
+            except BaseException:
+                self._stale = True
+                raise
+
+    def close(self):
+        self.stream.close()
+
+
+class CapacitiveProtocol(_Protocol):
+    """Awaitable commands of the capacitive sensor (26-byte 0xAA55 / 0x55AA packets)."""
+    @staticmethod
+    def command_packet(cmd, data=b""):
+        packet = bytearray(CAP_PACKET_BYTES)
+        struct.pack_into("<HBBBBH", packet, 0, Command, Command_SID, Command_DID, cmd, 0x00, len(data))
+        packet[8:8 + len(data)] = bytes(data)
+        struct.pack_into("<H", packet, 24, sum(packet[:24]) & 0xffff)
+        return bytes(packet)
+
+    async def _read_response(self, cmd):
+        while True:
+            packet = await self.stream.read_exactly(CAP_PACKET_BYTES)
+            prefix, _, _, echoed, _, _, ret = struct.unpack_from("<HBBBBHH", packet)
+            if prefix != Response:
+                # Out of step: drop the line's backlog and wait for the next whole packet
+                await self.stream.discard_until_quiet()
+                raise IOError(f"Unexpected packet prefix 0x{prefix:04X}")
+            if sum(packet[:24]) & 0xffff != struct.unpack_from("<H", packet, 24)[0]:
+                raise IOError("Packet checksum mismatch")
+            if echoed == cmd:
+                return ret, packet[10:24]
+
+    async def command(self, cmd, data=b"", timeout=None):
+        """Send a command; returns (result code, 14 response data bytes)."""
+        return await self.exchange(self.command_packet(cmd, data), lambda: self._read_response(cmd), timeout)
+
+    async def finger_detect(self):
+        ret, data = await self.command(CMD_FINGER_DETECT)
+        return ret == ERR_SUCCESS and bool(data[0])
+
+    async def wait_for_finger(self, present=True, poll=FINGER_POLL):
+        while await self.finger_detect() != present:
+            await asyncio.sleep(poll)
+
+    async def get_image(self):
+        return (await self.command(CMD_GET_IMAGE))[0] == ERR_SUCCESS
+
+    async def generate(self, buffer=0):
+        return (await self.command(CMD_GENERATE, struct.pack("<H", buffer)))[0] == ERR_SUCCESS
+
+    async def search(self, start=1, end=MAX_TEMPLATE_ID, buffer=0):
+        """Matched slot in start..end for the template in a buffer, None when there is none."""
+        ret, data = await self.command(CMD_SEARCH, struct.pack("<HHH", buffer, start, end))
+        return struct.unpack_from("<H", data)[0] if ret == ERR_SUCCESS else None
+
+    async def delete(self, start, end):
+        return (await self.command(CMD_DEL_CHAR, struct.pack("<HH", start, end)))[0] == ERR_SUCCESS
+
+    async def up_image(self):
+        """Capture and upload the finger on the sensor; the raw stream for capture.decode_capacitive_image."""
+        if not await self.get_image():
+            return None
+        return await self.exchange(self.command_packet(CMD_UP_IMAGE_CODE, b"\x00"),
+                                   lambda: self.stream.read_exactly(CAP_IMAGE_STREAM_BYTES), IMAGE_TIMEOUT)
+
+
+class R307Protocol(_Protocol):
+    """Awaitable commands of the R307 optical sensor (0xEF01 packets)."""
+    def __init__(self, stream, timeout=COMMAND_TIMEOUT, address=R307_ADDRESS):
+        super().__init__(stream, timeout)
+        self.address = address
+
+    def packet(self, pid, payload):
+        length = len(payload) + 2
+        checksum = (pid + (length >> 8) + (length & 0xff) + sum(payload)) & 0xffff
+        return struct.pack(">HIBH", R307_HEADER, self.address, pid, length) + bytes(payload) + \
+            struct.pack(">H", checksum)
+
+    async def read_packet(self):
+        """(packet identifier, payload) of the next packet."""
+        header = await self.stream.read_exactly(9)
+        start, _, pid, length = struct.unpack(">HIBH", header)
+        if start != R307_HEADER:
+            await self.stream.discard_until_quiet()
+            raise IOError(f"Unexpected packet header 0x{start:04X}")
+        body = await self.stream.read_exactly(length)
+        payload = body[:-2]
+        if (pid + (length >> 8) + (length & 0xff) + sum(payload)) & 0xffff != struct.unpack(">H", body[-2:])[0]:
+            raise IOError("Packet checksum mismatch")
+        return pid, payload
+
+    async def _read_ack(self):
+        pid, payload = await self.read_packet()
+        if pid != R307_ACK:
+            raise IOError(f"Expected an acknowledge packet, got 0x{pid:02X}")
+        return payload[0], payload[1:]
+
+    async def command(self, instruction, params=b"", timeout=None):
+        """Send an instruction; returns (confirmation code, acknowledge payload after the code)."""
+        return await self.exchange(self.packet(R307_COMMAND, bytes([instruction]) + bytes(params)),
+                                   self._read_ack, timeout)
+
+    async def verify_password(self, password=0x00000000):
+        return (await self.command(R307_VERIFY_PASSWORD, struct.pack(">I", password)))[0] == R307_SUCCESS
+
+    async def gen_img(self):
+        """True when a finger was imaged, False when there is none."""
+        return (await self.command(R307_GEN_IMG))[0] == R307_SUCCESS
+
+    async def wait_for_finger(self, poll=FINGER_POLL):
+        while not await self.gen_img():
+            await asyncio.sleep(poll)
+
+    async def img_2_tz(self, buffer=1):
+        return (await self.command(R307_IMG_2_TZ, bytes([buffer])))[0] == R307_SUCCESS
+
+    async def search(self, buffer=1, start=0, count=R307_CAPACITY):
+        """(position, score) of the best match for a char buffer, None when there is none."""
+        code, data = await self.command(R307_SEARCH, struct.pack(">BHH", buffer, start, count))
+        return struct.unpack(">HH", data[:4]) if code == R307_SUCCESS else None
+
+    async def delete(self, start, count=1):
+        return (await self.command(R307_DELETE, struct.pack(">HH", start, count)))[0] == R307_SUCCESS
+
+    async def _read_image(self):
+        code, _ = await self._read_ack()
+        if code != R307_SUCCESS:
+            return None
+        data = bytearray()
+        while True:
+            pid, payload = await self.read_packet()
+            data.extend(payload)
+            if pid == R307_END:
+                return bytes(data)
+
+    async def up_image(self):
+        """Upload the image of the last gen_img; the packed stream for capture.decode_optical_image."""
+        return await self.exchange(self.packet(R307_COMMAND, bytes([R307_UP_IMAGE])), self._read_image,
+                                   IMAGE_TIMEOUT)
+
+
+class BlockingLink:
+    """A protocol on an open pyserial port, called from blocking code on one persistent event loop.
+
+    The loop is created once per sensor and only runs inside call(). Between calls the port's descriptor
+    is back in blocking mode, so the sensor class keeps its own port and reconnect logic. Calls from
+    several threads must not overlap, the sensor classes serve one operation at a time.
+    """
+    def __init__(self, ser, protocol, timeout=COMMAND_TIMEOUT):
+        self.ser = ser
+        self.protocol = protocol
+        self.timeout = timeout
+        self.loop = asyncio.new_event_loop()
+
+    def call(self, operation):
+        """Run operation(protocol) to completion and return its result."""
+        async def run():
+            stream = SerialStream(self.ser.fileno())
+            try:
+                return await operation(self.protocol(stream, self.timeout))
+            finally:
+                stream.detach()
+
+        self.ser.reset_input_buffer()  # A late response to an abandoned command must not be read as this one's
+        return self.loop.run_until_complete(run())
+
+    def close(self):
+        self.loop.close()
+
+
+async def identify_forever(name, protocol, on_result=print):
+    """Identify press after press on one sensor; cancel the task to stop it."""
+    capacitive = isinstance(protocol, CapacitiveProtocol)
+    while True:
+        if capacitive:
+            await protocol.wait_for_finger(True)
+        else:
+            await protocol.wait_for_finger()
+        start = time.time()
+        if capacitive:
+            match = await protocol.search() if await protocol.get_image() and await protocol.generate(0) else None
+        else:
+            match = await protocol.search() if await protocol.img_2_tz(1) else None
+        on_result(f"{name}: {'match ' + str(match) if match is not None else 'no match'} "
+                  f"in {(time.time() - start) * 1000:.0f} ms")
+        if capacitive:
+            await protocol.wait_for_finger(False)
+        else:
+            while await protocol.gen_img():
+                await asyncio.sleep(FINGER_POLL)
+
+
+async def run_sensors(capacitive_ports, optical_ports, duration=None):
+    protocols = {}
+    for port in capacitive_ports:
+        protocols[port] = CapacitiveProtocol(await SerialStream.open(port, 460800))
+    for port in optical_ports:
+        protocols[port] = R307Protocol(await SerialStream.open(port, 115200))
+    tasks = [asyncio.create_task(identify_forever(port, protocol)) for port, protocol in protocols.items()]
+    try:
+        await asyncio.wait(tasks, timeout=duration)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for protocol in protocols.values():
+            protocol.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Identify on several sensors from one asyncio event loop")
+    parser.add_argument("--capacitive", nargs="*", default=[], help="Capacitive sensor ports")
+    parser.add_argument("--optical", nargs="*", default=[], help="R307 optical sensor ports")
+    parser.add_argument("--duration", type=float, default=None, help="Seconds to run (default: until Ctrl-C)")
+    args = parser.parse_args(argv)
+    if not args.capacitive and not args.optical:
+        parser.error("give at least one --capacitive or --optical port")
+    try:
+        asyncio.run(run_sensors(args.capacitive, args.optical, args.duration))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+# Example usage: python async_transport.py --capacitive /dev/ttyUSB0 --optical /dev/ttyUSB1
+if __name__ == "__main__":
+    sys.exit(main())
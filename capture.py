@@ -0,0 +1,64 @@
+import time
+import numpy as np
+from PIL import Image
+
+# Native frame sizes of the supported sensors
+OPTICAL_WIDTH = 256
+OPTICAL_HEIGHT = 288
+CAPACITIVE_WIDTH = 242
+CAPACITIVE_HEIGHT = 266
+
+# Layout of the capacitive CMD_UP_IMAGE_CODE stream (see AnotherSensor.Data_Txt)
+CAP_HEADER_BYTES = 38
+CAP_BLOCKS = 129
+CAP_BLOCK_PAYLOAD = 8 * 62
+CAP_BLOCK_STRIDE = CAP_BLOCK_PAYLOAD + 14
+CAP_TAIL_BYTES = 6 * 62 + 8
+
+
+class CapturedFrame:
+    """A decoded 8-bit grayscale fingerprint frame kept in memory."""
+    def __init__(self, pixels, sensor_type, operation="search", template_id=None, timestamp=None):
+        self.pixels = np.ascontiguousarray(pixels, dtype=np.uint8)
+        self.height, self.width = self.pixels.shape
+        self.sensor_type = sensor_type
+        self.operation = operation
+        self.template_id = template_id
+        self.timestamp = timestamp if timestamp is not None else time.time()
+        self.image_path = None  # Filled in once the frame has been persisted
+
+    def to_pil(self):
+        """Return a PIL image that shares the frame's pixel buffer."""
+        return Image.frombuffer('L', (self.width, self.height), self.pixels, 'raw', 'L', 0, 1)
+
+    def __repr__(self):
+        return f"CapturedFrame({self.sensor_type}, {self.width}x{self.height}, {self.operation})"
+
+
+def decode_optical_image(image_data, sensor_type="Optical", operation="search", template_id=None):
+    """Unpack the R307 4-bit image stream into a 256x288 frame."""
+    packed = np.frombuffer(bytes(image_data), dtype=np.uint8)
+    pixels = np.empty(packed.size * 2, dtype=np.uint8)
+    pixels[0::2] = packed & 0xF0
+    pixels[1::2] = (packed & 0x0F) << 4
+    pixels = _fit(pixels, OPTICAL_WIDTH * OPTICAL_HEIGHT)
+    return CapturedFrame(pixels.reshape(OPTICAL_HEIGHT, OPTICAL_WIDTH), sensor_type, operation, template_id)
+
+
+def decode_capacitive_image(Rx_data, sensor_type="Capacitive", operation="search", template_id=None):
+    """Strip the packet framing from a capacitive image upload into a 242x266 frame."""
+    raw = np.asarray(Rx_data, dtype=np.uint8)
+    body_end = CAP_HEADER_BYTES + CAP_BLOCKS * CAP_BLOCK_STRIDE
+    body = raw[CAP_HEADER_BYTES:body_end].reshape(CAP_BLOCKS, CAP_BLOCK_STRIDE)[:, :CAP_BLOCK_PAYLOAD]
+    tail = raw[body_end:body_end + CAP_TAIL_BYTES]
+    pixels = _fit(np.concatenate((body.ravel(), tail)), CAPACITIVE_WIDTH * CAPACITIVE_HEIGHT)
+    return CapturedFrame(pixels.reshape(CAPACITIVE_HEIGHT, CAPACITIVE_WIDTH), sensor_type, operation, template_id)
+
+
+def _fit(pixels, size):
+    """Truncate or zero-pad a flat pixel buffer to exactly size bytes."""
+    if pixels.size >= size:
+        return pixels[:size]
+    padded = np.zeros(size, dtype=np.uint8)
+    padded[:pixels.size] = pixels
+    return padded
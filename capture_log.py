@@ -0,0 +1,186 @@
+import os
+import sys
+import glob
+import struct
+import threading
+import numpy as np
+from capture import CapturedFrame
+
+# Segment file layout
+#   header (64 bytes): magic, version, sensor code, width, height, record size
+#   records: fixed-size numpy structured records (metadata followed by raw pixels)
+# Each segment has a companion .idx file holding just the metadata of every committed
+# record. A record only counts once its index entry is written, and the record is fsynced
+# before that, so readers never see a half-written frame even if the station loses power
+# mid-append. A power loss can still drop the last index entries, never corrupt them.
+SEGMENT_MAGIC = b'FPLOG\x00'
+SEGMENT_VERSION = 1
+SEGMENT_HEADER_FORMAT = '<6sHBHHI'
+SEGMENT_HEADER_SIZE = 64
+SEGMENT_MAX_RECORDS = 4096  # ~300 MB per segment for optical frames
+LOG_QUEUE_SIZE = 64         # Records waiting for a sensor's log writer; a full queue blocks the search, never drops
+
+SENSOR_CODES = {"Capacitive": 0, "Optical": 1}
+
+# Spoof verdict codes stored in each record
+VERDICT_UNKNOWN = -1
+VERDICT_LIVE = 0
+VERDICT_FAKE = 1
+VERDICT_UNCERTAIN = 2
+VERDICT_CODES = {"LIVE": VERDICT_LIVE, "FAKE": VERDICT_FAKE, "UNCERTAIN": VERDICT_UNCERTAIN}
+
+INDEX_DTYPE = np.dtype([
+    ('timestamp', '<f8'),
+    ('template_position', '<i4'),
+    ('spoof_score', '<f4'),
+    ('sensor_type', 'u1'),
+    ('spoof_verdict', 'i1'),
+])
+
+
+def record_dtype(width, height):
+    """Structured dtype of one log record for frames of the given size."""
+    return np.dtype([
+        ('timestamp', '<f8'),
+        ('template_position', '<i4'),
+        ('spoof_score', '<f4'),
+        ('sensor_type', 'u1'),
+        ('spoof_verdict', 'i1'),
+        ('pixels', 'u1', (height, width)),
+    ])
+
+
+def verdict_code(spoof_status):
+    """Map the verdict reported by the sensors ("LIVE", "FAKE", ...) to its stored code."""
+    verdict = getattr(spoof_status, "verdict", spoof_status)
+    return VERDICT_CODES.get(str(verdict).upper(), VERDICT_UNKNOWN)
+
+
+class CaptureLog:
+    """Append-only capture sink writing fixed-size frame records to rolling segment files."""
+    def __init__(self, directory, sensor_type, width, height, max_records=SEGMENT_MAX_RECORDS):
+        self.directory = directory
+        self.sensor_type = sensor_type
+        self.sensor_code = SENSOR_CODES.get(sensor_type, 255)
+        self.width = width
+        self.height = height
+        self.max_records = max_records
+        self.dtype = record_dtype(width, height)
+        self.appended = 0
+        self._lock = threading.Lock()
+        self._segment = None
+        self._index = None
+        self._records = 0
+        self._sequence = self._last_sequence()
+        os.makedirs(directory, exist_ok=True)
+
+    def append(self, frame, template_position=-1, spoof_status=None, spoof_score=float('nan')):
+        """Append one frame record. Runs wherever it is called, normally on the archive writer thread."""
+        if (frame.width, frame.height) != (self.width, self.height):
+            raise ValueError(f"Frame is {frame.width}x{frame.height}, log expects {self.width}x{self.height}")
+        record = np.zeros(1, dtype=self.dtype)
+        record['timestamp'] = frame.timestamp
+        record['template_position'] = -1 if template_position is None else template_position
+        record['spoof_score'] = getattr(spoof_status, "fake_probability", spoof_score)
+        record['sensor_type'] = self.sensor_code
+        record['spoof_verdict'] = verdict_code(spoof_status)
+        record['pixels'][0] = frame.pixels
+
+        meta = np.zeros(1, dtype=INDEX_DTYPE)
+        for name in INDEX_DTYPE.names:
+            meta[name] = record[name]
+
+        with self._lock:
+            if self._segment is None or self._records >= self.max_records:
+                self._open_next_segment()
+            self._segment.write(record.tobytes())
+            self._segment.flush()
+            # The record must be on disk before an index entry can point at it
+            os.fsync(self._segment.fileno())
+            # Committing the index entry is what makes the record visible to readers
+            self._index.write(meta.tobytes())
+            self._index.flush()
+            self._records += 1
+            self.appended += 1
+
+    def close(self):
+        with self._lock:
+            self._close_segment()
+
+    def _open_next_segment(self):
+        self._close_segment()
+        self._sequence += 1
+        path = os.path.join(self.directory, f"{self.sensor_type.lower()}_{self._sequence:06d}.seg")
+        header = struct.pack(SEGMENT_HEADER_FORMAT, SEGMENT_MAGIC, SEGMENT_VERSION, self.sensor_code,
+                             self.width, self.height, self.dtype.itemsize)
+        self._segment = open(path, "wb")
+        self._segment.write(header.ljust(SEGMENT_HEADER_SIZE, b'\x00'))
+        self._index = open(path[:-4] + ".idx", "wb")
+        self._records = 0
+        print(f"Capture log segment started: {path}")
+
+    def _close_segment(self):
+        if self._segment is not None:
+            self._segment.close()
+            self._index.close()
+            self._segment = None
+            self._index = None
+
+    def _last_sequence(self):
+        pattern = os.path.join(self.directory, f"{self.sensor_type.lower()}_*.seg")
+        sequences = []
+        for path in glob.glob(pattern):
+            try:
+                sequences.append(int(os.path.basename(path).rsplit("_", 1)[1][:-4]))
+            except ValueError:
+                continue
+        return max(sequences, default=0)
+
+
+def open_segment(path):
+    """Map a segment read-only as a structured NumPy array (zero-copy) of its committed records."""
+    with open(path, "rb") as f:
+        header = f.read(SEGMENT_HEADER_SIZE)
+    magic, version, sensor_code, width, height, record_size = struct.unpack_from(SEGMENT_HEADER_FORMAT, header)
+    if magic != SEGMENT_MAGIC or version != SEGMENT_VERSION:
+        raise ValueError(f"{path} is not a capture log segment")
+    dtype = record_dtype(width, height)
+    if dtype.itemsize != record_size:
+        raise ValueError(f"{path} has unexpected record size {record_size}")
+
+    index_path = path[:-4] + ".idx"
+    committed = os.path.getsize(index_path) // INDEX_DTYPE.itemsize if os.path.exists(index_path) else 0
+    available = (os.path.getsize(path) - SEGMENT_HEADER_SIZE) // record_size
+    count = min(committed, available)
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=SEGMENT_HEADER_SIZE, shape=(count,))
+
+
+def list_segments(directory, sensor_type=None):
+    """Segment paths in a log directory, oldest first."""
+    prefix = f"{sensor_type.lower()}_" if sensor_type else ""
+    return sorted(glob.glob(os.path.join(directory, f"{prefix}*.seg")))
+
+
+def iter_frames(directory, sensor_type=None):
+    """Yield (record, CapturedFrame) for every committed record in a log directory."""
+    names = {code: name for name, code in SENSOR_CODES.items()}
+    for path in list_segments(directory, sensor_type):
+        records = open_segment(path)
+        for record in records:
+            frame = CapturedFrame(record['pixels'], names.get(int(record['sensor_type']), "Unknown"),
+                                  timestamp=float(record['timestamp']))
+            yield record, frame
+
+
+# Example usage: python capture_log.py /path/to/log
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python capture_log.py <log directory>")
+        sys.exit(1)
+    for segment_path in list_segments(sys.argv[1]):
+        segment = open_segment(segment_path)
+        verdicts = np.bincount(segment['spoof_verdict'].astype(np.int16) + 1, minlength=4) if len(segment) else [0] * 4
+        print(f"{os.path.basename(segment_path)}: {len(segment)} records, "
+              f"unknown={verdicts[0]} live={verdicts[1]} fake={verdicts[2]} uncertain={verdicts[3]}")
@@ -0,0 +1,55 @@
+import sys
+import numpy as np
+from liveness_prefilter import block_std, ridge_coherence, FOREGROUND_STD
+
+# A capture is only sent for template generation and search when it passes all three checks
+MIN_COVERAGE = 0.35     # Share of blocks covered by the finger
+MIN_CONTRAST = 18.0     # Mean per-block standard deviation over the finger
+MIN_CLARITY = 0.4       # Mean ridge orientation coherence over the finger
+QUALITY_RETRIES = 2     # Extra presses offered within one search before giving up
+
+
+class QualityReport:
+    """Quality measures of one capture and, when it is rejected, the reason to show the user."""
+    def __init__(self, coverage, contrast, clarity):
+        self.coverage = coverage
+        self.contrast = contrast
+        self.clarity = clarity
+        if coverage < MIN_COVERAGE:
+            self.reason = "Finger only partly on the sensor"
+        elif contrast < MIN_CONTRAST:
+            self.reason = "Image too faint, press a little firmer"
+        elif clarity < MIN_CLARITY:
+            self.reason = "Ridges not clear, finger may be too dry, wet or moving"
+        else:
+            self.reason = None
+
+    @property
+    def ok(self):
+        return self.reason is None
+
+    def __str__(self):
+        status = "OK" if self.ok else self.reason
+        return (f"{status} (coverage {self.coverage:.0%}, contrast {self.contrast:.1f}, "
+                f"clarity {self.clarity:.2f})")
+
+
+def assess_quality(pixels):
+    """Score an 8-bit grayscale frame on finger coverage, contrast and ridge clarity."""
+    image = pixels.astype(np.float32)
+    stds = block_std(image)
+    mask = stds > FOREGROUND_STD
+    if not mask.any():
+        return QualityReport(0.0, 0.0, 0.0)
+    coherence = ridge_coherence(image)
+    return QualityReport(float(mask.mean()), float(stds[mask].mean()), float(coherence[mask].mean()))
+
+
+# Example usage: python capture_quality.py fingerprint_images/search/20250101/*.png
+if __name__ == "__main__":
+    from capture_store import load_capture
+    if len(sys.argv) < 2:
+        print("Usage: python capture_quality.py <capture> [<capture> ...]")
+        sys.exit(1)
+    for path in sys.argv[1:]:
+        print(f"{path}: {assess_quality(load_capture(path).pixels)}")
@@ -0,0 +1,212 @@
+import os
+import sys
+import time
+import shutil
+import struct
+import datetime
+import threading
+import numpy as np
+from PIL import Image
+from capture import CapturedFrame
+
+# Compact on-disk formats
+#   .fp4 - optical frames packed back to the sensor's native 4 bits per pixel
+#   .u8  - raw 8-bit frame with a small header (no compression, fastest to write)
+#   .png - lossless compressed frame (default for capacitive captures)
+FP4_MAGIC = b'FP4\x01'
+U8_MAGIC = b'FPU8'
+HEADER_FORMAT = '<4sHH'  # magic, width, height
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+OPTICAL_FORMAT = "fp4"
+CAPACITIVE_FORMAT = "png"
+IMAGE_EXTENSIONS = (".bmp", ".png", ".jpg", ".jpeg", ".fp4", ".u8")
+
+# Retention defaults for search captures
+RETENTION_MAX_AGE_DAYS = 30
+RETENTION_MAX_BYTES = 512 * 1024 * 1024
+RETENTION_INTERVAL = 600        # Seconds between sweeps
+RETENTION_BATCH_SIZE = 200      # Files removed before yielding to other I/O
+RETENTION_BATCH_PAUSE = 0.05
+
+
+def capture_path(root, operation, extension, prefix=None, timestamp=None):
+    """Build <root>/<operation>/<YYYYMMDD>/<prefix>_<HHMMSS_micro>.<ext>, creating the day directory."""
+    moment = datetime.datetime.fromtimestamp(timestamp if timestamp is not None else time.time())
+    day_dir = os.path.join(root, operation, moment.strftime("%Y%m%d"))
+    os.makedirs(day_dir, exist_ok=True)
+    name = f"{prefix or operation}_{moment.strftime('%H%M%S_%f')}.{extension}"
+    return os.path.join(day_dir, name)
+
+
+def save_capture(frame, path):
+    """Write a frame in the format given by the path's extension."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".fp4":
+        pixels = frame.pixels.ravel()
+        packed = (pixels[0::2] & 0xF0) | (pixels[1::2] >> 4)
+        data = struct.pack(HEADER_FORMAT, FP4_MAGIC, frame.width, frame.height) + packed.tobytes()
+    elif extension == ".u8":
+        data = struct.pack(HEADER_FORMAT, U8_MAGIC, frame.width, frame.height) + frame.pixels.tobytes()
+    else:
+        # PNG/BMP and anything else PIL understands
+        frame.to_pil().save(path)
+        frame.image_path = path
+        return path
+
+    # Write next to the target and rename so readers never see a partial file
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    frame.image_path = path
+    return path
+
+
+def load_capture(path, sensor_type=None):
+    """Read a capture written by save_capture (or any grayscale image) back into a CapturedFrame."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".fp4", ".u8"):
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, width, height = struct.unpack_from(HEADER_FORMAT, data)
+        body = np.frombuffer(data, dtype=np.uint8, offset=HEADER_SIZE)
+        if magic == FP4_MAGIC:
+            pixels = np.empty(body.size * 2, dtype=np.uint8)
+            pixels[0::2] = body & 0xF0
+            pixels[1::2] = (body & 0x0F) << 4
+        elif magic == U8_MAGIC:
+            pixels = body
+        else:
+            raise ValueError(f"Unknown capture format in {path}")
+        pixels = pixels[:width * height].reshape(height, width)
+        default_type = "Optical" if magic == FP4_MAGIC else None
+    else:
+        with Image.open(path) as image:
+            pixels = np.asarray(image.convert("L"))
+        default_type = None
+
+    frame = CapturedFrame(pixels, sensor_type or default_type or "Unknown",
+                          timestamp=os.path.getmtime(path))
+    frame.image_path = path
+    return frame
+
+
+def find_images(directory):
+    """All capture files below a directory, sorted for reproducible output."""
+    paths = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(root, name))
+    return sorted(paths)
+
+
+class RetentionSweeper:
+    """Background thread that prunes old captures by age and total size, one day directory at a time."""
+    def __init__(self, directories, max_age_days=RETENTION_MAX_AGE_DAYS, max_bytes=RETENTION_MAX_BYTES,
+                 interval=RETENTION_INTERVAL, batch_size=RETENTION_BATCH_SIZE, batch_pause=RETENTION_BATCH_PAUSE):
+        self.directories = list(directories)
+        self.max_age_days = max_age_days
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.removed_files = 0
+        self.removed_bytes = 0
+        self._day_sizes = {}  # Sizes of closed (past) day directories, they no longer grow
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="RetentionSweeper", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sweep_once()
+            except Exception as e:
+                print(f"Error during capture retention sweep: {e}")
+            self._stop.wait(self.interval)
+
+    def sweep_once(self):
+        """Run a single retention pass over all directories."""
+        today = datetime.date.today().strftime("%Y%m%d")
+        cutoff = (datetime.date.today() - datetime.timedelta(days=self.max_age_days)).strftime("%Y%m%d")
+
+        # Day directories sort chronologically by name, oldest first across all roots
+        days = sorted(self._day_dirs(), key=lambda entry: entry[0])
+        for day, path in list(days):
+            if self._stop.is_set():
+                return
+            if self.max_age_days is not None and day < cutoff:
+                self._remove_day(path)
+                days.remove((day, path))
+
+        if self.max_bytes is None:
+            return
+        total = sum(self._day_size(day, path, day == today) for day, path in days)
+        for day, path in days:
+            if total <= self.max_bytes or day == today or self._stop.is_set():
+                break
+            total -= self._day_size(day, path, False)
+            self._remove_day(path)
+
+    def _day_dirs(self):
+        for directory in self.directories:
+            if not os.path.isdir(directory):
+                continue
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir() and len(entry.name) == 8 and entry.name.isdigit():
+                        yield entry.name, entry.path
+
+    def _day_size(self, day, path, is_open):
+        if not is_open and path in self._day_sizes:
+            return self._day_sizes[path]
+        size = 0
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    size += entry.stat().st_size
+        if not is_open:
+            self._day_sizes[path] = size
+        return size
+
+    def _remove_day(self, path):
+        """Delete a day directory in small batches so the sweep never stalls capture writes."""
+        removed = 0
+        with os.scandir(path) as entries:
+            files = [entry for entry in entries if entry.is_file()]
+        for entry in files:
+            if self._stop.is_set():
+                return
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                self.removed_files += 1
+                self.removed_bytes += size
+            except OSError as e:
+                print(f"Failed to remove old capture {entry.path}: {e}")
+            removed += 1
+            if removed % self.batch_size == 0:
+                time.sleep(self.batch_pause)
+        shutil.rmtree(path, ignore_errors=True)
+        self._day_sizes.pop(path, None)
+        print(f"Removed old captures in {path}")
+
+
+# Example usage: python capture_store.py capture.fp4 capture.png
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python capture_store.py <input capture> <output image>")
+        sys.exit(1)
+    save_capture(load_capture(sys.argv[1]), sys.argv[2])
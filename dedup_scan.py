@@ -0,0 +1,147 @@
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import threading
+from minutiae_index import CandidateIndex
+from parallel_matcher import ParallelMatcher, MATCH_CORES
+
+# A finger enrolled under two slots doubles its share of every 1:N search. Enrollment checks the first
+# capture against the gallery; the scanner finds duplicates already in it from the host minutiae index.
+DUPLICATE_POLICY = "reject"  # At enrollment: "reject" the new enrollment, "merge" it into the existing slot, "allow"
+DEDUP_CANDIDATES = 5         # Index candidates full-matched per enrolled template
+DEDUP_MIN_SCORE = 0.5        # Stricter than MATCH_THRESHOLD, every reported pair costs an operator a look
+DEDUP_INTERVAL = 6 * 3600    # Seconds between scans
+DEDUP_SLOT_PAUSE = 0.05      # Seconds yielded after every slot, so live searches keep the CPU
+DEDUP_NICE = 19              # Scheduling priority of the scanner thread (Linux)
+
+
+def lower_thread_priority(nice=DEDUP_NICE):
+    """Renice the calling thread only; Linux schedules threads individually."""
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), nice)
+    except (AttributeError, OSError):
+        pass
+
+
+def find_duplicates(index, slots=None, top_k=DEDUP_CANDIDATES, min_score=DEDUP_MIN_SCORE, stop=None, pause=0.0):
+    """{(slot, other): score} for enrolled slots whose templates match another slot in the index.
+
+    Only the templates of the given slots (default all) are used as probes; each pair is matched once.
+    The candidates of a probe are full-matched together, over the index's matcher pool when it has one.
+    """
+    templates = dict(index.templates)
+    found, checked = {}, set()
+    for slot in sorted(templates if slots is None else slots):
+        if stop is not None and stop.is_set():
+            break
+        for probe in templates.get(slot, []):
+            others = []
+            for other in index.candidates(probe, top_k + 1):
+                pair = (min(slot, other), max(slot, other))
+                if other == slot or pair in checked or other not in templates:
+                    continue
+                checked.add(pair)
+                others.append(other)
+            for other, score in index.scores(probe, others).items():
+                pair = (min(slot, other), max(slot, other))
+                if score >= min_score:
+                    found[pair] = max(score, found.get(pair, 0.0))
+        if pause:
+            time.sleep(pause)
+    return found
+
+
+class DedupScanner:
+    """Background thread that looks for fingers enrolled under several slots of the attached sensor."""
+    def __init__(self, interval=DEDUP_INTERVAL, slot_pause=DEDUP_SLOT_PAUSE, on_event=None):
+        self.interval = interval
+        self.slot_pause = slot_pause
+        self.on_event = on_event or print
+        self.sensor = None
+        self.duplicates = {}         # (slot, other) -> score from the last scan
+        self._scanned = {}           # Slot -> template list object probed in the last scan
+        self._stop = threading.Event()
+        self._thread = None
+
+    def attach(self, sensor):
+        """Scan the gallery of this sensor from now on."""
+        if sensor is not self.sensor:
+            self.sensor = sensor
+            self.duplicates = {}
+            self._scanned = {}
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="DedupScanner", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        lower_thread_priority()
+        while not self._stop.is_set():
+            try:
+                self.scan_once()
+            except Exception as e:
+                self.on_event(f"Error during duplicate scan: {e}")
+            self._stop.wait(self.interval)
+
+    def scan_once(self):
+        """Probe the slots enrolled or re-enrolled since the last scan; returns newly found duplicate pairs."""
+        sensor = self.sensor
+        index = getattr(sensor, 'candidate_index', None)
+        if index is None:
+            return {}
+        current = dict(index.templates)
+        # Add, merge and re-enroll replace a slot's template list, so identity tells what changed
+        changed = [slot for slot, templates in current.items() if self._scanned.get(slot) is not templates]
+        stale = set(changed)
+        self.duplicates = {pair: score for pair, score in self.duplicates.items()
+                           if pair[0] in current and pair[1] in current and not stale.intersection(pair)}
+        found = find_duplicates(index, changed, stop=self._stop, pause=self.slot_pause)
+        if self._stop.is_set() or sensor is not self.sensor:
+            return {}
+        self._scanned = {slot: current[slot] for slot in current}
+        new = {pair: score for pair, score in found.items() if pair not in self.duplicates}
+        self.duplicates.update(found)
+        for (slot, other), score in sorted(new.items()):
+            self.on_event(f"⚠️ Template positions {slot} and {other} look like the same finger (score {score:.2f})")
+        return new
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="List fingers enrolled under more than one template position")
+    parser.add_argument("database", help="Sensor database holding the host minutiae index")
+    parser.add_argument("--candidates", type=int, default=DEDUP_CANDIDATES)
+    parser.add_argument("--min-score", type=float, default=DEDUP_MIN_SCORE)
+    parser.add_argument("--cores", type=int, default=MATCH_CORES, help="Matcher processes")
+    args = parser.parse_args(argv)
+
+    index = CandidateIndex(args.database, matcher=ParallelMatcher(args.cores))
+    db = sqlite3.connect(args.database)
+    try:
+        names = dict(db.execute('SELECT template_position, name FROM fingerprints').fetchall())
+    except sqlite3.Error:
+        names = {}
+    finally:
+        db.close()
+    start = time.time()
+    try:
+        found = find_duplicates(index, top_k=args.candidates, min_score=args.min_score)
+    finally:
+        index.close()
+    for (slot, other), score in sorted(found.items(), key=lambda item: -item[1]):
+        print(f"{slot} ({names.get(slot, '?')}) ~ {other} ({names.get(other, '?')}): score {score:.2f}")
+    print(f"✅ {len(found)} duplicate pairs among {len(index)} indexed slots in {time.time() - start:.1f} seconds")
+    return 0
+
+
+# Example usage: python dedup_scan.py /home/live_finger/newtry27jan/fingerprints_capacitive.db
+if __name__ == "__main__":
+    sys.exit(main())
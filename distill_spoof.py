@@ -0,0 +1,173 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import Dataset, DataLoader, random_split
+from capture_store import load_capture, find_images
+from spoof_batch import label_for_path
+from spoof_model import (BACKBONES, CROP_TO_FOREGROUND, FAKE_CLASS, INPUT_SIZE, MODEL_PATH, Preprocessor, build_model,
+                         get_device, load_model, load_model_config, save_model_config)
+
+# Knowledge distillation of the ResNet-50 spoof classifier into a lighter backbone
+DEFAULT_STUDENT = "mobilenet_v3_large"
+TEMPERATURE = 4.0
+HARD_LABEL_WEIGHT = 0.5   # Share of the loss from live/ and fake/ labels where the archive has them
+LATENCY_TARGET_MS = 50
+
+
+class DistillDataset(Dataset):
+    """Captures as (tensor, label); label is -1 for unlabelled archive captures (teacher only)."""
+    def __init__(self, paths, preprocess):
+        self.paths = paths
+        self.labels = [label_for_path(path) for path in paths]
+        self.preprocess = preprocess
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, index):
+        return self.preprocess(load_capture(self.paths[index])), self.labels[index]
+
+
+def distillation_loss(student_logits, teacher_logits, labels, temperature=TEMPERATURE,
+                      hard_label_weight=HARD_LABEL_WEIGHT):
+    """Softened KL divergence to the teacher, mixed with cross-entropy on the labelled samples."""
+    soft = F.kl_div(F.log_softmax(student_logits / temperature, dim=1),
+                    F.softmax(teacher_logits / temperature, dim=1),
+                    reduction="batchmean") * temperature ** 2
+    labelled = labels >= 0
+    if not labelled.any():
+        return soft
+    hard = F.cross_entropy(student_logits[labelled], labels[labelled])
+    return (1 - hard_label_weight) * soft + hard_label_weight * hard
+
+
+def fake_scores(model, batch):
+    return torch.softmax(model(batch), dim=1)[:, FAKE_CLASS]
+
+
+def evaluate(student, teacher, loader, device, student_size):
+    """Verdict agreement with the teacher and, for labelled captures, the student's EER."""
+    from liveness_prefilter import equal_error_rate
+    student.eval()
+    student_scores, teacher_scores, labels = [], [], []
+    with torch.no_grad():
+        for batch, batch_labels in loader:
+            batch = batch.to(device)
+            teacher_scores.append(fake_scores(teacher, batch).cpu())
+            student_scores.append(fake_scores(student, resize_batch(batch, student_size)).cpu())
+            labels.append(batch_labels)
+    student_scores = torch.cat(student_scores).numpy()
+    teacher_scores = torch.cat(teacher_scores).numpy()
+    labels = torch.cat(labels).numpy()
+    agreement = float(np.mean((student_scores >= 0.5) == (teacher_scores >= 0.5)))
+    labelled = labels >= 0
+    eer = None
+    if labelled.any() and labels[labelled].min() != labels[labelled].max():
+        eer = equal_error_rate(student_scores[labelled], labels[labelled])[0]
+    return agreement, eer
+
+
+def resize_batch(batch, size):
+    if batch.shape[-1] == size:
+        return batch
+    return F.interpolate(batch, size=(size, size), mode="bilinear", align_corners=False)
+
+
+def cpu_latency(model, input_size, runs=30):
+    """Median single-frame CPU forward time in milliseconds."""
+    model = model.to("cpu").eval()
+    frame = torch.zeros(1, 3, input_size, input_size)
+    times = []
+    with torch.no_grad():
+        model(frame)
+        for _ in range(runs):
+            start = time.perf_counter()
+            model(frame)
+            times.append(time.perf_counter() - start)
+    return float(np.median(times) * 1000)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Distil the ResNet-50 spoof model into a lighter backbone")
+    parser.add_argument("input", help="Capture archive; captures under live/ or fake/ directories also use their label")
+    parser.add_argument("--teacher", default=MODEL_PATH, help="Teacher weights")
+    parser.add_argument("--backbone", default=DEFAULT_STUDENT, choices=BACKBONES)
+    parser.add_argument("--input-size", type=int, default=INPUT_SIZE, help="Student input size")
+    parser.add_argument("--output", default="model/student.pth", help="Student weights (config written next to it)")
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--temperature", type=float, default=TEMPERATURE)
+    parser.add_argument("--hard-label-weight", type=float, default=HARD_LABEL_WEIGHT)
+    parser.add_argument("--val-fraction", type=float, default=0.1)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args(argv)
+
+    device = get_device()
+    teacher = load_model(args.teacher, device)
+    if teacher is None:
+        return 1
+    teacher_size = load_model_config(args.teacher)["input_size"]
+    paths = find_images(args.input)
+    if not paths:
+        print(f"No captures found in {args.input}")
+        return 1
+
+    # Both models see the same frame, cropped only when inference crops too, resized on the GPU when their
+    # input sizes differ
+    dataset = DistillDataset(paths, Preprocessor(teacher_size, crop=CROP_TO_FOREGROUND))
+    val_size = max(1, int(len(dataset) * args.val_fraction))
+    train_set, val_set = random_split(dataset, [len(dataset) - val_size, val_size],
+                                      generator=torch.Generator().manual_seed(0))
+    train_loader = DataLoader(train_set, batch_size=args.batch_size, shuffle=True, num_workers=args.workers)
+    val_loader = DataLoader(val_set, batch_size=args.batch_size, num_workers=args.workers)
+    print(f"🔄 Distilling {args.teacher} into {args.backbone} on {len(train_set)} captures "
+          f"({sum(label >= 0 for label in dataset.labels)} labelled), validating on {val_size}")
+
+    student = build_model(args.backbone, pretrained=True).to(device)
+    optimizer = torch.optim.AdamW(student.parameters(), lr=args.lr)
+    scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, args.epochs)
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    best = -1.0
+    for epoch in range(args.epochs):
+        student.train()
+        total = 0.0
+        for batch, labels in train_loader:
+            batch, labels = batch.to(device), labels.to(device)
+            if torch.rand(1).item() < 0.5:
+                batch = torch.flip(batch, dims=[3])  # Fingers are placed either way round
+            with torch.no_grad():
+                teacher_logits = teacher(batch)
+            loss = distillation_loss(student(resize_batch(batch, args.input_size)), teacher_logits, labels,
+                                     args.temperature, args.hard_label_weight)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            total += loss.item() * len(labels)
+        scheduler.step()
+
+        agreement, eer = evaluate(student, teacher, val_loader, device, args.input_size)
+        line = f"Epoch {epoch + 1}/{args.epochs}: loss {total / len(train_set):.4f}, teacher agreement {agreement:.1%}"
+        print(line + (f", EER {eer:.2%}" if eer is not None else ""))
+        score = -eer if eer is not None else agreement
+        if score > best:
+            best = score
+            torch.save(student.state_dict(), args.output)
+            save_model_config(args.output, args.backbone, args.input_size, teacher=os.path.basename(args.teacher))
+
+    student.load_state_dict(torch.load(args.output, map_location="cpu"))
+    teacher_ms = cpu_latency(teacher, teacher_size)
+    student_ms = cpu_latency(student, args.input_size)
+    print(f"✅ Student written to {args.output}")
+    print(f"⏱️ CPU forward pass: teacher {teacher_ms:.1f} ms, student {student_ms:.1f} ms"
+          + (" (above the target)" if student_ms > LATENCY_TARGET_MS else ""))
+    return 0
+
+
+# Example usage: python distill_spoof.py fingerprint_images --backbone mobilenet_v3_large --output model/mnv3.pth
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+import sys
+import time
+import sqlite3
+import argparse
+import threading
+import numpy as np
+
+# Enrollment embeddings from the spoof backbone, kept in one contiguous matrix for vectorized cosine search.
+# float16 halves the memory, but NumPy has no half-precision BLAS, so it is scored in float32 chunks (~10x slower).
+EMBEDDING_DTYPE = np.float32
+SEARCH_CHUNK = 8192          # Rows converted to float32 per step when the matrix is not float32
+EMBEDDING_CANDIDATES = 5     # Gallery slots returned as candidates for the sensor search
+MIN_SIMILARITY = 0.5         # Cosine similarity below which an embedding candidate is ignored
+
+
+class EmbeddingGallery:
+    """Enrollment embeddings of one model, persisted in the sensor's SQLite database.
+
+    Rows from other models are kept in the table but not loaded: embeddings are only comparable
+    within the model that produced them. Pass db_path=None for an in-memory gallery.
+    """
+    def __init__(self, db_path=None, model_name="", dtype=EMBEDDING_DTYPE):
+        self.db_path = db_path
+        self.model_name = model_name
+        self.dtype = np.dtype(dtype)
+        self.matrix = None           # (capacity, D), rows [0, count) in use
+        self.slots = np.zeros(0, dtype=np.int32)
+        self.count = 0
+        self._rows = {}              # Slot -> row in the matrix
+        self._lock = threading.Lock()
+        if db_path:
+            self._load()
+
+    def _connect(self):
+        db = sqlite3.connect(self.db_path)
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS spoof_embeddings (
+                template_position INTEGER NOT NULL,
+                model TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                PRIMARY KEY (template_position, model)
+            )
+        ''')
+        return db
+
+    def _load(self):
+        db = self._connect()
+        try:
+            rows = db.execute('SELECT template_position, embedding FROM spoof_embeddings WHERE model = ?',
+                              (self.model_name,)).fetchall()
+        finally:
+            db.close()
+        for slot, embedding in rows:
+            self._append(slot, np.frombuffer(embedding, dtype=np.float32))
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, slot):
+        return slot in self._rows
+
+    def _append(self, slot, embedding):
+        if self.matrix is None:
+            self.matrix = np.zeros((64, len(embedding)), dtype=self.dtype)
+            self.slots = np.zeros(64, dtype=np.int32)
+        elif self.count == len(self.matrix):
+            # Grow by doubling so enrollment stays amortized O(1)
+            self.matrix = np.concatenate([self.matrix, np.zeros_like(self.matrix)])
+            self.slots = np.concatenate([self.slots, np.zeros_like(self.slots)])
+        self.matrix[self.count] = embedding
+        self.slots[self.count] = slot
+        self._rows[slot] = self.count
+        self.count += 1
+
+    def _drop(self, slot):
+        # Move the last row into the hole so the used rows stay contiguous
+        row = self._rows.pop(slot)
+        last = self.count - 1
+        if row != last:
+            self.matrix[row] = self.matrix[last]
+            self.slots[row] = self.slots[last]
+            self._rows[int(self.slots[row])] = row
+        self.count = last
+
+    def add(self, slot, embedding):
+        """Store the embedding of an enrolled slot, replacing any previous one."""
+        embedding = np.asarray(embedding, dtype=np.float32).ravel()
+        embedding = embedding / max(float(np.linalg.norm(embedding)), 1e-12)
+        with self._lock:
+            if self.matrix is not None and self.matrix.shape[1] != len(embedding):
+                raise ValueError(f"Embedding size {len(embedding)} does not match the gallery's "
+                                 f"{self.matrix.shape[1]}")
+            if self.db_path:
+                db = self._connect()
+                try:
+                    db.execute('INSERT OR REPLACE INTO spoof_embeddings (template_position, model, embedding) '
+                               'VALUES (?, ?, ?)', (slot, self.model_name, embedding.tobytes()))
+                    db.commit()
+                finally:
+                    db.close()
+            if slot in self._rows:
+                self._drop(slot)
+            self._append(slot, embedding)
+
+    def remove(self, slot):
+        """Forget a slot for every model (the template is gone from the sensor)."""
+        self.remove_many([slot])
+
+    def remove_many(self, slots):
+        """Forget several slots for every model with one database commit."""
+        slots = list(slots)
+        with self._lock:
+            if self.db_path:
+                db = self._connect()
+                try:
+                    db.executemany('DELETE FROM spoof_embeddings WHERE template_position = ?',
+                                   [(slot,) for slot in slots])
+                    db.commit()
+                finally:
+                    db.close()
+            for slot in slots:
+                if slot in self._rows:
+                    self._drop(slot)
+
+    def similarities(self, query):
+        """Cosine similarity of a query to every stored embedding, in row order."""
+        query = np.asarray(query, dtype=np.float32).ravel()
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        used = self.matrix[:self.count]
+        if self.dtype == np.float32:
+            return used @ query
+        return np.concatenate([used[i:i + SEARCH_CHUNK].astype(np.float32) @ query
+                               for i in range(0, self.count, SEARCH_CHUNK)])
+
+    def search(self, query, top_k=EMBEDDING_CANDIDATES, min_similarity=MIN_SIMILARITY):
+        """(slot, similarity) pairs of the top_k most similar enrolled embeddings, best first."""
+        with self._lock:
+            if self.count == 0:
+                return []
+            scores = self.similarities(query)
+            slots = self.slots[:self.count]
+            k = min(top_k, self.count)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(int(slots[i]), float(scores[i])) for i in top if scores[i] >= min_similarity]
+
+
+def benchmark(directory, model_path, ks, scale):
+    """Recall@k of embedding search with the first capture of every finger enrolled, and search time at scale."""
+    from capture_store import load_capture
+    from minutiae_index import grouped_captures
+    from spoof_model import SpoofDetector
+    detector = SpoofDetector(model_path, prefilter_path=None)
+    if detector.model is None:
+        return 1
+    groups = [paths for paths in grouped_captures(directory) if len(paths) > 1]
+    if not groups:
+        print(f"Need several captures per finger directory under {directory}")
+        return 1
+
+    print(f"🔄 Embedding {sum(len(paths) for paths in groups)} captures...")
+    gallery = EmbeddingGallery(dtype=np.float32)
+    probes = []
+    for slot, paths in enumerate(groups, 1):
+        embeddings = detector.embed([load_capture(path) for path in paths])
+        gallery.add(slot, embeddings[0])
+        probes.extend((slot, embedding) for embedding in embeddings[1:])
+
+    hits = {k: 0 for k in ks}
+    for slot, embedding in probes:
+        found = [s for s, _ in gallery.search(embedding, max(ks), min_similarity=-1.0)]
+        for k in ks:
+            hits[k] += slot in found[:k]
+    for k in ks:
+        print(f"recall@{k}: {hits[k] / len(probes):.1%} over {len(probes)} probes, gallery of {len(gallery)}")
+
+    # Pad with random unit vectors to time the search at the target gallery size
+    dim = gallery.matrix.shape[1]
+    padding = np.random.default_rng(0).standard_normal((max(scale - len(gallery), 0), dim)).astype(np.float32)
+    for dtype in (np.float32, np.float16):
+        large = EmbeddingGallery(dtype=dtype)
+        for slot, embedding in enumerate(np.concatenate([gallery.matrix[:len(gallery)], padding]), 1):
+            large.add(slot, embedding)
+        start = time.time()
+        for _, embedding in probes[:20]:
+            large.search(embedding)
+        per_search = (time.time() - start) / min(len(probes), 20)
+        print(f"{np.dtype(dtype).name}: {per_search * 1000:.1f} ms per search over {len(large)} embeddings "
+              f"of {dim} values ({large.matrix[:len(large)].nbytes / 2 ** 20:.0f} MiB)")
+    return 0
+
+
+def main(argv=None):
+    from spoof_model import MODEL_PATH
+    parser = argparse.ArgumentParser(description="Recall and speed of embedding search on the spoof backbone")
+    parser.add_argument("input", help="Directory with one sub-directory of captures per finger")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--k", type=int, nargs="+", default=[1, EMBEDDING_CANDIDATES, 20])
+    parser.add_argument("--scale", type=int, default=30000, help="Gallery size to time the search at")
+    args = parser.parse_args(argv)
+    return benchmark(args.input, args.model, args.k, args.scale)
+
+
+# Example usage: python embedding_gallery.py fingerprint_images/benchmark --scale 30000
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+import time
+from collections import deque
+
+# Access gates keep the sensor armed: one long-lived thread identifies press after press with the
+# sensor, spoof model and host indexes already warm, instead of a new thread per button press.
+GATE_WINDOW = 60             # Seconds over which throughput is reported
+GATE_LATENCY_SAMPLES = 200   # Recent identifications the latency percentiles are taken from
+GATE_REPORT_EVERY = 10       # Identifications between metrics reports
+
+
+class GateMetrics:
+    """Outcomes, capture-to-result latency and throughput of a continuous identification run."""
+    def __init__(self, window=GATE_WINDOW, samples=GATE_LATENCY_SAMPLES):
+        self.window = window
+        self.started = time.time()
+        self.matches = 0
+        self.no_matches = 0
+        self.failures = 0
+        self.latencies = deque(maxlen=samples)
+        self._finished = deque()     # Result times inside the throughput window
+
+    @property
+    def identified(self):
+        return self.matches + self.no_matches
+
+    def record(self, outcome, latency=None):
+        """Count one press: True matched, False unknown finger, None nothing identified."""
+        if outcome is None:
+            self.failures += 1
+            return
+        if outcome:
+            self.matches += 1
+        else:
+            self.no_matches += 1
+        now = time.time()
+        self._finished.append(now)
+        while self._finished[0] < now - self.window:
+            self._finished.popleft()
+        if latency is not None:
+            self.latencies.append(latency)
+
+    def per_minute(self):
+        span = min(self.window, time.time() - self.started)
+        return len(self._finished) * 60.0 / max(span, 1e-6)
+
+    def latency_percentile(self, q):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def summary(self):
+        text = (f"{self.identified} identified ({self.matches} matched, {self.no_matches} unknown, "
+                f"{self.failures} failed), {self.per_minute():.1f}/min")
+        if self.latencies:
+            text += (f", latency median {self.latency_percentile(0.5) * 1000:.0f} ms, "
+                     f"p95 {self.latency_percentile(0.95) * 1000:.0f} ms")
+        return text
+
+
+def run_gate(sensor, stop, update_ui_callback=None, search_complete_callback=None, frame_callback=None,
+             metrics_callback=None, metrics=None):
+    """Identify press after press on the calling thread until stop is set; returns the metrics.
+
+    The sensor needs identify(..., stop=) and wait_for_lift(stop). Latency runs from the first
+    frame of a press to its result, so time spent waiting for the next user is not counted.
+    """
+    metrics = metrics or GateMetrics()
+    while not stop.is_set():
+        captured = []
+
+        def on_frame(frame):
+            if not captured:
+                captured.append(time.time())
+            if frame_callback:
+                frame_callback(frame)
+
+        outcome = sensor.identify(update_ui_callback, search_complete_callback, on_frame, stop=stop)
+        if outcome is None and stop.is_set():
+            break
+        metrics.record(outcome, time.time() - captured[0] if captured else None)
+        if metrics_callback and (metrics.identified + metrics.failures) % GATE_REPORT_EVERY == 0:
+            metrics_callback(metrics)
+        # The same finger must not be identified twice
+        sensor.wait_for_lift(stop)
+    return metrics
@@ -0,0 +1,265 @@
+import os
+import sys
+import json
+import argparse
+import numpy as np
+
+# Hand-crafted liveness features, all computed with vectorized NumPy on the decoded frame
+BLOCK_SIZE = 16
+FOREGROUND_STD = 8.0          # Blocks with less variation than this are background
+MIN_COVERAGE = 0.2            # Frames with less foreground always go to the CNN
+RIDGE_PERIOD_RANGE = (5, 15)  # Ridge period in pixels at ~500 dpi
+FEATURE_NAMES = [
+    "coverage",
+    "local_contrast",
+    "ridge_coherence",
+    "ridge_frequency_energy",
+    "dark_saturation",
+    "bright_saturation",
+    "foreground_mean",
+]
+
+# Default cascade bands, overwritten by `report --write` once tuned on archived captures
+DEFAULT_LIVE_BELOW = 0.02
+DEFAULT_FAKE_ABOVE = 0.98
+
+
+def block_view(image, block=BLOCK_SIZE):
+    """View an image as a (rows, cols, block, block) grid of blocks, dropping partial edge blocks."""
+    rows, cols = image.shape[0] // block, image.shape[1] // block
+    trimmed = image[:rows * block, :cols * block]
+    return trimmed.reshape(rows, block, cols, block).swapaxes(1, 2)
+
+
+def block_std(image, block=BLOCK_SIZE):
+    """Per-block standard deviation of an image."""
+    return block_view(image.astype(np.float32), block).std(axis=(2, 3))
+
+
+def structure_tensor(image, block=BLOCK_SIZE):
+    """Per-block sums (gxx, gyy, gxy) of the gradient structure tensor of an image."""
+    gy, gx = np.gradient(image.astype(np.float32))
+    return (block_view(gx * gx, block).sum(axis=(2, 3)), block_view(gy * gy, block).sum(axis=(2, 3)),
+            block_view(gx * gy, block).sum(axis=(2, 3)))
+
+
+def ridge_coherence(image, block=BLOCK_SIZE):
+    """Per-block ridge orientation coherence in [0, 1]: 1 for parallel ridges, 0 for no dominant direction."""
+    gxx, gyy, gxy = structure_tensor(image, block)
+    return np.sqrt((gxx - gyy) ** 2 + 4 * gxy ** 2) / (gxx + gyy + 1e-6)
+
+
+def foreground_blocks(image, block=BLOCK_SIZE, threshold=FOREGROUND_STD):
+    """Boolean block mask of where the finger is (block-variance segmentation)."""
+    return block_std(image, block) > threshold
+
+
+def extract_features(pixels):
+    """Compute the FEATURE_NAMES vector for one 8-bit grayscale frame."""
+    image = pixels.astype(np.float32)
+    stds = block_std(image)
+    mask = stds > FOREGROUND_STD
+    coverage = float(mask.mean())
+    if not mask.any():
+        return np.array([coverage, 0.0, 0.0, 0.0, float((pixels <= 16).mean()),
+                         float((pixels >= 240).mean()), float(image.mean())], dtype=np.float32)
+
+    # Ridge continuity: orientation coherence of the gradient structure tensor per block
+    coherence = ridge_coherence(image)
+
+    # Share of spectral energy at ridge frequencies (live skin gives a sharp ridge band)
+    spectrum = np.abs(np.fft.rfft2(image - image.mean())) ** 2
+    fy = np.fft.fftfreq(image.shape[0])[:, None]
+    fx = np.fft.rfftfreq(image.shape[1])[None, :]
+    radius = np.sqrt(fy ** 2 + fx ** 2)
+    low, high = 1.0 / RIDGE_PERIOD_RANGE[1], 1.0 / RIDGE_PERIOD_RANGE[0]
+    band = (radius >= low) & (radius <= high)
+    total = spectrum[radius > 1.0 / 64].sum() + 1e-6
+
+    foreground = block_view(image)[mask]
+    return np.array([
+        coverage,
+        float(stds[mask].mean()),
+        float(coherence[mask].mean()),
+        float(spectrum[band].sum() / total),
+        float((pixels <= 16).mean()),
+        float((pixels >= 240).mean()),
+        float(foreground.mean()),
+    ], dtype=np.float32)
+
+
+class LivenessPrefilter:
+    """Logistic model over the hand-crafted features that settles clear cases before the CNN."""
+    def __init__(self, weights, bias, mean, std, live_below=DEFAULT_LIVE_BELOW, fake_above=DEFAULT_FAKE_ABOVE):
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self.bias = float(bias)
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.std = np.asarray(std, dtype=np.float32)
+        self.live_below = live_below
+        self.fake_above = fake_above
+
+    def score_features(self, features):
+        """FAKE probability for one feature vector or a (N, F) matrix of them."""
+        z = (np.asarray(features, dtype=np.float32) - self.mean) / self.std
+        logits = np.clip(z @ self.weights + self.bias, -50, 50)
+        return 1.0 / (1.0 + np.exp(-logits))
+
+    def decide(self, pixels):
+        """Return (verdict, fake probability); verdict is None when the frame must go to the CNN."""
+        features = extract_features(pixels)
+        probability = float(self.score_features(features))
+        if features[0] < MIN_COVERAGE:
+            return None, probability  # Too little finger to trust hand-crafted features
+        if probability <= self.live_below:
+            return "LIVE", probability
+        if probability >= self.fake_above:
+            return "FAKE", probability
+        return None, probability
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump({
+                "features": FEATURE_NAMES,
+                "weights": self.weights.tolist(),
+                "bias": self.bias,
+                "mean": self.mean.tolist(),
+                "std": self.std.tolist(),
+                "live_below": self.live_below,
+                "fake_above": self.fake_above,
+            }, f, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            config = json.load(f)
+        if config.get("features") != FEATURE_NAMES:
+            raise ValueError(f"{path} was fitted on a different feature set")
+        return cls(config["weights"], config["bias"], config["mean"], config["std"],
+                   config["live_below"], config["fake_above"])
+
+
+def fit_prefilter(features, labels, iterations=2000, learning_rate=0.1, l2=1e-3):
+    """Fit the logistic prefilter (labels: 1 = FAKE) with batch gradient descent."""
+    features = np.asarray(features, dtype=np.float32)
+    labels = np.asarray(labels, dtype=np.float32)
+    mean = features.mean(axis=0)
+    std = features.std(axis=0) + 1e-6
+    z = (features - mean) / std
+    weights = np.zeros(z.shape[1], dtype=np.float32)
+    bias = 0.0
+    for _ in range(iterations):
+        p = 1.0 / (1.0 + np.exp(-(z @ weights + bias)))
+        error = p - labels
+        weights -= learning_rate * (z.T @ error / len(labels) + l2 * weights)
+        bias -= learning_rate * float(error.mean())
+    return LivenessPrefilter(weights, bias, mean, std)
+
+
+def equal_error_rate(scores, labels):
+    """EER of FAKE scores against labels (1 = FAKE), and the threshold where it occurs."""
+    scores = np.asarray(scores, dtype=np.float64)
+    labels = np.asarray(labels, dtype=bool)
+    order = np.argsort(-scores)
+    sorted_labels = labels[order]
+    # Flagging the top k scores as FAKE: live wrongly rejected vs. fakes let through
+    false_rejects = np.cumsum(~sorted_labels) / max((~labels).sum(), 1)
+    false_accepts = 1.0 - np.cumsum(sorted_labels) / max(labels.sum(), 1)
+    k = int(np.argmin(np.abs(false_rejects - false_accepts)))
+    return float((false_rejects[k] + false_accepts[k]) / 2), float(scores[order][k])
+
+
+def cascade_scores(prefilter_scores, cnn_scores, live_below, fake_above):
+    """Final scores of the cascade and the mask of frames escalated to the CNN."""
+    escalated = (prefilter_scores > live_below) & (prefilter_scores < fake_above)
+    return np.where(escalated, cnn_scores, prefilter_scores), escalated
+
+
+def tune_bands(prefilter_scores, cnn_scores, labels, tolerance=0.0):
+    """Widest short-circuit bands whose cascade EER stays within tolerance of the CNN alone."""
+    cnn_eer, _ = equal_error_rate(cnn_scores, labels)
+    candidates = np.unique(np.concatenate(([0.0, 1.0], np.quantile(prefilter_scores, np.linspace(0, 1, 41)))))
+    best = (0.0, 1.0, 1.0, cnn_eer)  # live_below, fake_above, escalated share, eer
+    for live_below in candidates:
+        for fake_above in candidates[candidates > live_below]:
+            scores, escalated = cascade_scores(prefilter_scores, cnn_scores, live_below, fake_above)
+            share = float(escalated.mean())
+            if share >= best[2]:
+                continue
+            eer, _ = equal_error_rate(scores, labels)
+            if eer <= cnn_eer + tolerance:
+                best = (float(live_below), float(fake_above), share, eer)
+    return best, cnn_eer
+
+
+def load_labelled(directory):
+    """Capture paths and labels from <directory>/live/** and <directory>/fake/**."""
+    from capture_store import find_images
+    paths, labels = [], []
+    for label, name in ((0, "live"), (1, "fake")):
+        found = find_images(os.path.join(directory, name))
+        paths.extend(found)
+        labels.extend([label] * len(found))
+    return paths, np.array(labels)
+
+
+def feature_matrix(paths):
+    from capture_store import load_capture
+    return np.stack([extract_features(load_capture(path).pixels) for path in paths])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fit and evaluate the liveness prefilter cascade")
+    parser.add_argument("command", choices=["fit", "report"])
+    parser.add_argument("input", help="Directory with live/ and fake/ sub-directories of captures")
+    parser.add_argument("--prefilter", default="prefilter.json", help="Prefilter file to write (fit) or evaluate (report)")
+    parser.add_argument("--model", default=None, help="CNN weights used as the reference in report")
+    parser.add_argument("--tolerance", type=float, default=0.0, help="Allowed EER increase over the CNN alone")
+    parser.add_argument("--write", action="store_true", help="Store the tuned bands in the prefilter file")
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args(argv)
+
+    paths, labels = load_labelled(args.input)
+    if len(paths) == 0 or labels.min() == labels.max():
+        print(f"Need both live and fake captures under {args.input}")
+        return 1
+    print(f"🔄 Computing features for {len(paths)} captures...")
+    features = feature_matrix(paths)
+
+    if args.command == "fit":
+        prefilter = fit_prefilter(features, labels)
+        prefilter.save(args.prefilter)
+        eer, _ = equal_error_rate(prefilter.score_features(features), labels)
+        print(f"✅ Prefilter written to {args.prefilter} (prefilter-only EER: {eer:.2%})")
+        return 0
+
+    from spoof_batch import ImageFolderDataset, score_dataset
+    from spoof_model import SpoofDetector, MODEL_PATH
+    prefilter = LivenessPrefilter.load(args.prefilter)
+    detector = SpoofDetector(args.model or MODEL_PATH, prefilter_path=None)
+    if detector.model is None:
+        return 1
+    stats = {}
+    cnn = {label: score for label, score, _ in
+           score_dataset(detector, ImageFolderDataset(paths, detector.preprocessor), stats, workers=args.workers)}
+    cnn_scores = np.array([cnn[path] for path in paths])
+    prefilter_scores = prefilter.score_features(features)
+
+    current, escalated = cascade_scores(prefilter_scores, cnn_scores, prefilter.live_below, prefilter.fake_above)
+    (live_below, fake_above, share, eer), cnn_eer = tune_bands(prefilter_scores, cnn_scores, labels, args.tolerance)
+    per_image = stats["inference_time"] / max(stats["images"], 1)
+    print(f"CNN only:          EER {cnn_eer:.2%}, {per_image * 1000:.1f} ms inference per image")
+    print(f"Current cascade:   EER {equal_error_rate(current, labels)[0]:.2%}, "
+          f"{1 - escalated.mean():.1%} of CNN passes saved "
+          f"(live <= {prefilter.live_below:.3f}, fake >= {prefilter.fake_above:.3f})")
+    print(f"Tuned cascade:     EER {eer:.2%}, {1 - share:.1%} of CNN passes saved "
+          f"(live <= {live_below:.3f}, fake >= {fake_above:.3f})")
+    if args.write:
+        prefilter.live_below, prefilter.fake_above = live_below, fake_above
+        prefilter.save(args.prefilter)
+        print(f"✅ Tuned bands written to {args.prefilter}")
+    return 0
+
+
+# Example usage: python liveness_prefilter.py fit /data/labelled --prefilter model/prefilter.json
+if __name__ == "__main__":
+    sys.exit(main())
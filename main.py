@@ -1,11 +1,30 @@
 import sys
+import argparse
 from PyQt6.QtWidgets import QApplication
 from main_window import MainWindow
 import os
 import serial
 
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    window = MainWindow()
+    parser = argparse.ArgumentParser(description="Fingerprint liveness detection station")
+    parser.add_argument("--gate", action="store_true",
+                        help="Access gate: identify every press continuously, the search button stops and restarts it")
+    parser.add_argument("--hub", nargs="*", metavar="TYPE:PORT", default=None,
+                        help="Run several sensors at once, e.g. capacitive:/dev/ttyUSB0 optical:/dev/ttyUSB1 "
+                             "(no ports: probe the serial ports)")
+    parser.add_argument("--embedding-search", action="store_true",
+                        help="Keep the spoof pass's backbone features to rank search candidates (needs anti-spoof on)")
+    parser.add_argument("--no-burst", action="store_true",
+                        help="Report uncertain spoof checks as they are instead of re-checking them with a burst")
+    args, qt_args = parser.parse_known_args()
+    hub_sensors = None
+    if args.hub is not None:
+        from sensor_hub import parse_ports, discover_sensors
+        hub_sensors = parse_ports(args.hub) if args.hub else discover_sensors()
+        if not hub_sensors:
+            parser.exit(1, "❌ No sensors answered on the serial ports, give them as TYPE:PORT\n")
+    app = QApplication(sys.argv[:1] + qt_args)
+    window = MainWindow(gate_mode=args.gate, hub_sensors=hub_sensors, embedding_search=args.embedding_search,
+                        burst_recheck=not args.no_burst)
     window.show()
-    sys.exit(app.exec())
\ No newline at end of file
+    sys.exit(app.exec())
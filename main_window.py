@@ -1,27 +1,52 @@
 from PyQt6.QtWidgets import (QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
                             QPushButton, QLabel, QStatusBar, QTextEdit, QMessageBox,
                             QInputDialog, QDialog, QVBoxLayout, QListWidget, QListWidgetItem,
-                            QLineEdit, QGridLayout)
-from PyQt6.QtCore import Qt, QThread, pyqtSignal, QObject, QCoreApplication, QTimer
+                            QLineEdit, QGridLayout, QAbstractItemView)
+from PyQt6.QtCore import Qt, QThread, pyqtSignal, QObject, QCoreApplication, QTimer, QSize
 from PyQt6.QtGui import QPixmap, QImage
 from mainwindow_ui import Ui_FingerprintApp
-from CapSensor import AnotherSensor
-from OptSensor import FingerprintSensor
+from CapSensor import AnotherSensor, ARCHIVE_ROOT as CAPACITIVE_ARCHIVE_ROOT
+from OptSensor import FingerprintSensor, save_dir as OPTICAL_ARCHIVE_ROOT
+from archive_writer import ImageArchiveWriter, ARCHIVE_QUEUE_SIZE, ARCHIVE_POLICY
+from capture_store import RetentionSweeper
+from model_manager import ModelManager
+from dedup_scan import DedupScanner
+from gate_mode import run_gate
+from sensor_hub import SensorHub
 import os
 import time
 import sqlite3
+import threading
 import sys
 from io import StringIO
 
+# Directory for the append-only capture log (see capture_log.py), None disables it
+CAPTURE_LOG_DIR = None
+
+# Size of the fingerprint preview label, frames are pre-scaled to this in the worker threads
+PREVIEW_SIZE = QSize(256, 288)
+
+def frame_to_qimage(frame, size=PREVIEW_SIZE):
+    """Wrap a captured frame's pixel buffer in a QImage and pre-scale it for display."""
+    if frame is None:
+        return None
+    # The QImage shares the numpy buffer, scaled() produces the copy the GUI thread owns
+    image = QImage(frame.pixels.data, frame.width, frame.height, frame.width,
+                   QImage.Format.Format_Grayscale8)
+    return image.scaled(size, Qt.AspectRatioMode.KeepAspectRatio,
+                        Qt.TransformationMode.SmoothTransformation)
+
 class SensorSignals(QObject):
     """Signals for sensor communication"""
     update_ui = pyqtSignal(str)
-    update_image = pyqtSignal(str)  # For single image
+    update_image = pyqtSignal(object)  # For single pre-scaled QImage
     update_match_status = pyqtSignal(str)
     update_spoof_status = pyqtSignal(str)
     enrollment_error = pyqtSignal(str)  # New signal for enrollment errors
-    enrollment_complete = pyqtSignal(list)  # For final image paths
-    search_complete = pyqtSignal(bool, str, str, str)  # match status, image path, spoof status, matched name
+    enrollment_complete = pyqtSignal(list)  # For final pre-scaled QImages
+    search_complete = pyqtSignal(bool, object, str, str)  # match status, QImage, spoof status, matched name
+    hub_result = pyqtSignal(str, bool, object, str, str)  # port, then the search_complete arguments
+    spoof_model_status = pyqtSignal(str)  # loading / warming up / ready / unavailable
 
 class SensorThread(QThread):
     """Thread for handling sensor communication"""
@@ -183,10 +208,11 @@ class KeyboardDialog(QDialog):
 
 class EnrollmentThread(QThread):
     """Dedicated thread for enrollment process"""
-    def __init__(self, sensor, name):
+    def __init__(self, sensor, name, preview_size=PREVIEW_SIZE):
         super().__init__()
         self.sensor = sensor
         self.name = name
+        self.preview_size = preview_size
         self.signals = SensorSignals()
 
     def run(self):
@@ -194,13 +220,14 @@ class EnrollmentThread(QThread):
             def update_ui(message):
                 self.signals.update_ui.emit(message)
                 
-            def on_scan_complete(image_path):
-                if isinstance(image_path, list):
-                    # This is the final callback with both images
-                    self.signals.enrollment_complete.emit(image_path)
+            def on_scan_complete(frame):
+                if isinstance(frame, list):
+                    # This is the final callback with both frames
+                    self.signals.enrollment_complete.emit(
+                        [frame_to_qimage(f, self.preview_size) for f in frame])
                 else:
-                    # This is a single scan image
-                    self.signals.update_image.emit(image_path)
+                    # This is a single scan frame
+                    self.signals.update_image.emit(frame_to_qimage(frame, self.preview_size))
                 
             self.sensor.enroll_finger(self.name, 
                                     update_ui_callback=update_ui,
@@ -210,9 +237,10 @@ class EnrollmentThread(QThread):
 
 class SearchThread(QThread):
     """Dedicated thread for search process"""
-    def __init__(self, sensor):
+    def __init__(self, sensor, preview_size=PREVIEW_SIZE):
         super().__init__()
         self.sensor = sensor
+        self.preview_size = preview_size
         self.signals = SensorSignals()
 
     def run(self):
@@ -220,16 +248,98 @@ class SearchThread(QThread):
             def update_ui(message):
                 self.signals.update_ui.emit(message)
                 
-            def on_search_complete(is_match, image_path, spoof_status, matched_name=None):
-                self.signals.search_complete.emit(is_match, image_path, spoof_status, matched_name)
+            def on_frame(frame):
+                self.signals.update_image.emit(frame_to_qimage(frame, self.preview_size))
+                
+            def on_search_complete(is_match, frame, spoof_status, matched_name=None):
+                # spoof_status is a SpoofResult (verdict plus probabilities) or a plain status string
+                self.signals.search_complete.emit(is_match, frame_to_qimage(frame, self.preview_size),
+                                                  str(spoof_status), matched_name)
                 
             self.sensor.search_finger(update_ui_callback=update_ui, 
-                                    search_complete_callback=on_search_complete)
+                                    search_complete_callback=on_search_complete,
+                                    frame_callback=on_frame)
         except Exception as e:
             self.signals.update_ui.emit(f"Search error: {str(e)}")
 
+class VerifyThread(QThread):
+    """Dedicated thread for 1:1 verification against a claimed identity"""
+    def __init__(self, sensor, claim, preview_size=PREVIEW_SIZE):
+        super().__init__()
+        self.sensor = sensor
+        self.claim = claim
+        self.preview_size = preview_size
+        self.signals = SensorSignals()
+
+    def run(self):
+        try:
+            def update_ui(message):
+                self.signals.update_ui.emit(message)
+
+            def on_frame(frame):
+                self.signals.update_image.emit(frame_to_qimage(frame, self.preview_size))
+
+            def on_verify_complete(is_match, frame, spoof_status, matched_name=None):
+                self.signals.search_complete.emit(is_match, frame_to_qimage(frame, self.preview_size),
+                                                  str(spoof_status), matched_name)
+
+            self.sensor.verify_finger(self.claim,
+                                      update_ui_callback=update_ui,
+                                      verify_complete_callback=on_verify_complete,
+                                      frame_callback=on_frame)
+        except Exception as e:
+            self.signals.update_ui.emit(f"Verification error: {str(e)}")
+
+class GateThread(QThread):
+    """Long-lived thread that keeps the sensor armed and identifies every press until stopped"""
+    def __init__(self, sensor, preview_size=PREVIEW_SIZE):
+        super().__init__()
+        self.sensor = sensor
+        self.preview_size = preview_size
+        self.signals = SensorSignals()
+        self.stop_event = threading.Event()
+
+    def run(self):
+        def update_ui(message):
+            self.signals.update_ui.emit(message)
+
+        def on_frame(frame):
+            self.signals.update_image.emit(frame_to_qimage(frame, self.preview_size))
+
+        def on_search_complete(is_match, frame, spoof_status, matched_name=None):
+            self.signals.search_complete.emit(is_match, frame_to_qimage(frame, self.preview_size),
+                                              str(spoof_status), matched_name)
+
+        def on_metrics(metrics):
+            self.signals.update_ui.emit(f"📊 Gate: {metrics.summary()}")
+
+        try:
+            metrics = run_gate(self.sensor, self.stop_event, update_ui, on_search_complete, on_frame, on_metrics)
+            self.signals.update_ui.emit(f"📊 Gate stopped: {metrics.summary()}")
+        except Exception as e:
+            self.signals.update_ui.emit(f"Gate error: {str(e)}")
+
+    def stop(self):
+        self.stop_event.set()
+
+class ModelWarmupThread(QThread):
+    """Warms up the sensor's spoof model in the background so the first search is not slowed down"""
+    def __init__(self, sensor):
+        super().__init__()
+        self.sensor = sensor
+        self.signals = SensorSignals()
+
+    def run(self):
+        detector = getattr(self.sensor, 'spoof_detector', None)
+        if detector is None:
+            return
+        self.signals.spoof_model_status.emit(detector.status)
+        if not detector.is_ready:  # Already warm when the model manager shares it across sensors
+            detector.warm_up(*self.sensor.frame_size)
+        self.signals.spoof_model_status.emit(detector.status)
+
 class MainWindow(QMainWindow, Ui_FingerprintApp):
-    def __init__(self):
+    def __init__(self, gate_mode=False, hub_sensors=None, embedding_search=False, burst_recheck=True):
         super().__init__()
         self.setupUi(self)
         
@@ -237,7 +347,48 @@ class MainWindow(QMainWindow, Ui_FingerprintApp):
         try:
             # Start with capacitive sensor by default
             self.current_sensor_type = "Capacitive"
-            self.sensor = AnotherSensor()  # Default to capacitive sensor
+            # One background writer persists captures for whichever sensor is active
+            self.archive_writer = ImageArchiveWriter(ARCHIVE_QUEUE_SIZE, ARCHIVE_POLICY)
+            # Search captures are pruned by age/size in the background, enrollment scans are kept
+            self.retention_sweeper = RetentionSweeper([
+                os.path.join(CAPACITIVE_ARCHIVE_ROOT, "search"),
+                os.path.join(OPTICAL_ARCHIVE_ROOT, "search"),
+                os.path.join(CAPACITIVE_ARCHIVE_ROOT, "verify"),
+                os.path.join(OPTICAL_ARCHIVE_ROOT, "verify"),
+            ])
+            self.retention_sweeper.start()
+            # New weights in the model directory are validated and swapped in between searches
+            self.model_manager = ModelManager()
+            # With several readers the hub owns every sensor, the first one serves enroll/verify/delete
+            self.hub = None
+            self.hub_signals = SensorSignals()
+            self.hub_preview_size = None  # Read on the GUI thread when the gate starts, workers only scale to it
+            if hub_sensors is not None:
+                if not hub_sensors:
+                    raise ValueError("No sensors given for the hub")
+                self.hub = SensorHub(self.archive_writer, self.model_manager, CAPTURE_LOG_DIR,
+                                     on_result=self.on_hub_result, on_event=self.hub_signals.update_ui.emit)
+                self.hub.open(hub_sensors)
+                self.sensor = self.hub.primary
+                self.current_sensor_type = self.sensor.sensor_type
+                gate_mode = True
+            else:
+                self.sensor = AnotherSensor(archive_writer=self.archive_writer,
+                                            capture_log_dir=CAPTURE_LOG_DIR)  # Default to capacitive sensor
+                self.model_manager.attach(self.sensor)
+            self.embedding_search = embedding_search
+            self.burst_recheck = burst_recheck
+            if self.hub is not None:
+                self.hub.set_embedding_search(embedding_search)
+                self.hub.set_burst_recheck(burst_recheck)
+            else:
+                self.sensor.is_embedding_search_enabled = embedding_search
+                self.sensor.is_burst_enabled = burst_recheck
+            self.model_manager.start()
+            # Fingers enrolled under several slots are looked for at low priority between searches
+            self.dedup_scanner = DedupScanner()
+            self.dedup_scanner.attach(self.sensor)
+            self.dedup_scanner.start()
             self.is_anti_spoof_enabled = False
             self.initialize_database()
             self.current_enrollment_images = []
@@ -246,6 +397,10 @@ class MainWindow(QMainWindow, Ui_FingerprintApp):
             # Initialize threads as None
             self.enrollment_thread = None
             self.search_thread = None
+            self.verify_thread = None
+            self.warmup_thread = None
+            self.gate_thread = None
+            self.gate_mode = gate_mode
             
             # Force UI updates
             self.resultsDisplay.setUpdatesEnabled(True)
@@ -277,11 +432,27 @@ class MainWindow(QMainWindow, Ui_FingerprintApp):
         # Connect UI signals to slots
         self.enrollButton.clicked.connect(self.open_enroll_dialog)
         self.deleteButton.clicked.connect(self.open_delete_dialog)
-        self.searchButton.clicked.connect(self.search_fingerprint)
+        # At an access gate the search button starts and stops continuous identification instead
+        self.searchButton.clicked.connect(self.toggle_gate if self.gate_mode else self.search_fingerprint)
+        self.verifyButton.clicked.connect(self.open_verify_dialog)
         self.sensorTypeButton.clicked.connect(self.toggle_sensor_type)
         self.spoofToggleButton.clicked.connect(self.toggle_anti_spoof)
         self.exitButton.clicked.connect(self.close)
+        self.hub_signals.update_ui.connect(self.append_to_results)
+        self.hub_signals.hub_result.connect(self.on_hub_search_complete)
+        if self.hub is not None:
+            # The hub's sensors stay on their ports
+            self.sensorTypeButton.setEnabled(False)
+            if not self.hub.can_edit_templates:
+                self.enrollButton.setEnabled(False)
+                self.deleteButton.setEnabled(False)
+                self.append_to_results(f"ℹ️ Enroll and Delete are off: several {self.sensor.sensor_type.lower()} "
+                                       f"sensors share one name database, change them all with template_store.py push")
         
+        self.start_spoof_model_warmup()
+        if self.gate_mode:
+            self.start_gate()
+
         # Create directories for storing images
         os.makedirs("fingerprint_images/enroll", exist_ok=True)
         os.makedirs("fingerprint_images/search", exist_ok=True)
@@ -418,6 +589,7 @@ class MainWindow(QMainWindow, Ui_FingerprintApp):
         if self.enrollment_in_progress:
             self.append_to_results("⚠️ Enrollment already in progress")
             return
+        self.stop_gate()  # The sensor serves one operation at a time
             
         self.enrollment_in_progress = True
         self.enrollButton.setEnabled(False)  # Disable button during enrollment
@@ -442,7 +614,7 @@ class MainWindow(QMainWindow, Ui_FingerprintApp):
             self.append_to_results("🔄 Please follow on-screen instructions...")
             
             # Create and start enrollment thread
-            self.enrollment_thread = EnrollmentThread(self.sensor, name)
+            self.enrollment_thread = EnrollmentThread(self.sensor, name, self.imageLabel.size())
             self.enrollment_thread.signals.update_ui.connect(self.append_to_results)
             self.enrollment_thread.signals.update_image.connect(self.display_fingerprint_image)
             self.enrollment_thread.signals.enrollment_complete.connect(self.on_enrollment_complete)
@@ -459,23 +631,33 @@ class MainWindow(QMainWindow, Ui_FingerprintApp):
         QMessageBox.critical(self, "Enrollment Error", 
             f"Enrollment failed due to:\n{error_message}\n\nPlease check sensor connection and try again.")
 
-    def display_fingerprint_image(self, image_path):
-        """Display the fingerprint image and force update"""
-        if not image_path or not os.path.exists(image_path):
+    def display_fingerprint_image(self, image):
+        """Display the fingerprint image (pre-scaled QImage or file path) and force update"""
+        if image is None:
             self.imageLabel.setText("No image available")
             return
 
         try:
-            pixmap = QPixmap(image_path)
-            if pixmap.isNull():
-                self.imageLabel.setText("Failed to load image")
-                return
+            if isinstance(image, QImage):
+                # Already decoded and scaled in the worker thread, just upload it
+                if image.isNull():
+                    self.imageLabel.setText("Failed to load image")
+                    return
+                scaled_pixmap = QPixmap.fromImage(image)
+            else:
+                if not os.path.exists(image):
+                    self.imageLabel.setText("No image available")
+                    return
+                pixmap = QPixmap(image)
+                if pixmap.isNull():
+                    self.imageLabel.setText("Failed to load image")
+                    return
 
-            scaled_pixmap = pixmap.scaled(
-                self.imageLabel.size(),
-                Qt.AspectRatioMode.KeepAspectRatio,
-                Qt.TransformationMode.SmoothTransformation
-            )
+                scaled_pixmap = pixmap.scaled(
+                    self.imageLabel.size(),
+                    Qt.AspectRatioMode.KeepAspectRatio,
+                    Qt.TransformationMode.SmoothTransformation
+                )
             self.imageLabel.setPixmap(scaled_pixmap)
             self.imageLabel.setAlignment(Qt.AlignmentFlag.AlignCenter)
             self.imageLabel.repaint()
@@ -485,6 +667,7 @@ class MainWindow(QMainWindow, Ui_FingerprintApp):
         
     def open_delete_dialog(self):
         """Open dialog for deleting a fingerprint"""
+        self.stop_gate()  # The sensor serves one operation at a time
         self.on_delete()
 
     def confirm_delete(self, fingerprint_id):
@@ -535,6 +718,27 @@ class MainWindow(QMainWindow, Ui_FingerprintApp):
             if 'db' in locals():
                 db.close()
 
+    def confirm_delete_many(self, fingerprint_ids):
+        """Confirm and delete several fingerprints in one batch"""
+        reply = QMessageBox.question(
+            self,
+            "Confirm Deletion",
+            f"Delete {len(fingerprint_ids)} fingerprints?",
+            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+            QMessageBox.StandardButton.No
+        )
+        if reply != QMessageBox.StandardButton.Yes:
+            self.append_to_results("⚠️ Delete operation cancelled")
+            return
+        try:
+            self.append_to_results(f"🗑️ Deleting {len(fingerprint_ids)} fingerprints...")
+            # The sensor removes the database rows itself, in one commit
+            if self.sensor.delete_fingers(fingerprint_ids, self.append_to_results) < len(fingerprint_ids):
+                QMessageBox.warning(self, "Error", "Some fingerprints could not be deleted")
+        except Exception as e:
+            self.append_to_results(f"❌ Delete error: {str(e)}")
+            QMessageBox.critical(self, "Error", f"Deletion failed:\n{str(e)}")
+
     def on_delete(self):
         """Handle delete button click"""
         try:
@@ -552,10 +756,11 @@ class MainWindow(QMainWindow, Ui_FingerprintApp):
             
             # Create selection dialog
             dialog = QDialog(self)
-            dialog.setWindowTitle("Select Fingerprint to Delete")
+            dialog.setWindowTitle("Select Fingerprints to Delete")
             layout = QVBoxLayout()
             
             list_widget = QListWidget()
+            list_widget.setSelectionMode(QAbstractItemView.SelectionMode.ExtendedSelection)
             for id, name in fingerprints:
                 item = QListWidgetItem(f"{name} (ID: {id})")
                 item.setData(Qt.ItemDataRole.UserRole, id)
@@ -570,7 +775,10 @@ class MainWindow(QMainWindow, Ui_FingerprintApp):
             
             def on_delete_clicked():
                 selected_items = list_widget.selectedItems()
-                if selected_items:
+                if len(selected_items) > 1:
+                    dialog.accept()
+                    self.confirm_delete_many([item.data(Qt.ItemDataRole.UserRole) for item in selected_items])
+                elif selected_items:
                     fingerprint_id = selected_items[0].data(Qt.ItemDataRole.UserRole)
                     dialog.accept()
                     self.confirm_delete(fingerprint_id)
@@ -601,7 +809,7 @@ class MainWindow(QMainWindow, Ui_FingerprintApp):
         
         try:
             # Create and start search thread
-            self.search_thread = SearchThread(self.sensor)
+            self.search_thread = SearchThread(self.sensor, self.imageLabel.size())
             self.search_thread.signals.update_ui.connect(self.append_to_results)
             self.search_thread.signals.update_image.connect(self.display_fingerprint_image)
             self.search_thread.signals.search_complete.connect(self.on_search_complete)
@@ -612,26 +820,110 @@ class MainWindow(QMainWindow, Ui_FingerprintApp):
             QMessageBox.critical(self, "Search Error", 
                 f"Failed to start search:\n{str(e)}\n\nCheck sensor connection and try again.")
 
+    def start_gate(self):
+        """Arm the sensor for continuous identification on one long-lived thread"""
+        if self.hub is not None:
+            if not self.hub.running:
+                self.hub.set_anti_spoof(self.sensor.is_anti_spoof_enabled)
+                self.append_to_results(f"🚪 Continuous identification started on {len(self.hub.sensors)} sensors")
+                self.update_match_status("Match Status: Waiting for finger...")
+                self.hub_preview_size = self.imageLabel.size()
+                self.hub.start()
+                self.searchButton.setText("Stop Gate")
+            return
+        if self.gate_thread is not None:
+            return
+        self.append_to_results("🚪 Continuous identification started")
+        self.update_match_status("Match Status: Waiting for finger...")
+        self.gate_thread = GateThread(self.sensor, self.imageLabel.size())
+        self.gate_thread.signals.update_ui.connect(self.append_to_results)
+        self.gate_thread.signals.update_image.connect(self.display_fingerprint_image)
+        self.gate_thread.signals.search_complete.connect(self.on_search_complete)
+        self.gate_thread.start()
+        self.searchButton.setText("Stop Gate")
+
+    def stop_gate(self):
+        """Disarm continuous identification, waiting for the press in progress to finish"""
+        if self.hub is not None:
+            if self.hub.running:
+                self.hub.stop()
+                self.append_to_results(f"📊 Gate stopped:\n{self.hub.summary()}")
+                self.searchButton.setText("Start Gate")
+            return
+        if self.gate_thread is None:
+            return
+        self.gate_thread.stop()
+        self.gate_thread.wait()
+        self.gate_thread.deleteLater()
+        self.gate_thread = None
+        self.searchButton.setText("Start Gate")
+
+    def toggle_gate(self):
+        if self.gate_thread is None and not (self.hub is not None and self.hub.running):
+            self.start_gate()
+        else:
+            self.stop_gate()
+
+    def on_hub_result(self, port, is_match, frame, spoof_status, matched_name=None):
+        """Called on a hub worker thread; the result and its port travel to the GUI thread in one signal"""
+        self.hub_signals.hub_result.emit(port, is_match, frame_to_qimage(frame, self.hub_preview_size),
+                                         str(spoof_status), matched_name)
+
+    def on_hub_search_complete(self, port, is_match, image, spoof_status, matched_name=None):
+        self.on_search_complete(is_match, image, spoof_status, matched_name, source=port)
+
+    def open_verify_dialog(self):
+        """Ask for the claimed name or fingerprint ID and verify against it only"""
+        self.stop_gate()  # The sensor serves one operation at a time
+        keyboard_dialog = KeyboardDialog(self)
+        keyboard_dialog.setWindowTitle("Enter Name or ID")
+        if keyboard_dialog.exec() != QDialog.DialogCode.Accepted or not keyboard_dialog.name:
+            self.append_to_results("❌ Verification cancelled - no name or ID provided")
+            return
+
+        claim = keyboard_dialog.name
+        self.resultsDisplay.clear()
+        self.message_queue.clear()
+        self.current_messages.clear()
+        self.append_to_results(f"🔍 Verifying claimed identity: {claim}")
+        self.update_match_status("Match Status: Verifying...")
+
+        try:
+            self.verify_thread = VerifyThread(self.sensor, claim, self.imageLabel.size())
+            self.verify_thread.signals.update_ui.connect(self.append_to_results)
+            self.verify_thread.signals.update_image.connect(self.display_fingerprint_image)
+            self.verify_thread.signals.search_complete.connect(self.on_search_complete)
+            self.verify_thread.finished.connect(self.on_verify_thread_finished)
+            self.verify_thread.start()
+        except Exception as e:
+            self.append_to_results(f"❌ Verification failed to start: {str(e)}")
+
+    def on_verify_thread_finished(self):
+        if self.verify_thread:
+            self.verify_thread.deleteLater()
+            self.verify_thread = None
+
     def on_search_thread_finished(self):
         """Handle search thread completion"""
         if self.search_thread:
             self.search_thread.deleteLater()
             self.search_thread = None
 
-    def on_search_complete(self, is_match, image_path, spoof_status, matched_name=None):
-        """Handle search completion"""
-        self.display_fingerprint_image(image_path)
+    def on_search_complete(self, is_match, image, spoof_status, matched_name=None, source=None):
+        """Handle search completion, source is the port of a hub sensor"""
+        self.display_fingerprint_image(image)
+        where = f" on {source}" if source else ""
         
         if is_match:
             if matched_name:
-                self.update_match_status(f"Match Status: Matched\nName: {matched_name}")
-                self.append_to_results(f"✅ Fingerprint matched with: {matched_name}")
+                self.update_match_status(f"Match Status: Matched{where}\nName: {matched_name}")
+                self.append_to_results(f"✅ Fingerprint matched{where} with: {matched_name}")
             else:
-                self.update_match_status("Match Status: Matched")
-                self.append_to_results("✅ Fingerprint matched")
+                self.update_match_status(f"Match Status: Matched{where}")
+                self.append_to_results(f"✅ Fingerprint matched{where}")
         else:
-            self.update_match_status("Match Status: No Match")
-            self.append_to_results("❌ No match found.")
+            self.update_match_status(f"Match Status: No Match{where}")
+            self.append_to_results(f"❌ No match found{where}.")
             
         # Only update spoof status if anti-spoof detection is enabled
         if self.sensor.is_anti_spoof_enabled:
@@ -655,6 +947,7 @@ class MainWindow(QMainWindow, Ui_FingerprintApp):
         """Toggle sensor type between Capacitive and Optical"""
         try:
             self.sensorTypeButton.setEnabled(False)
+            self.stop_gate()
             
             # Clean up current sensor and thread
             if hasattr(self, 'sensor_thread'):
@@ -666,7 +959,8 @@ class MainWindow(QMainWindow, Ui_FingerprintApp):
                 if hasattr(self.sensor, 'ser') and self.sensor.ser.is_open:
                     self.sensor.ser.close()
                 if hasattr(self.sensor, 'cleanup'):
-                    self.sensor.cleanup()
+                    # The old sensor's log records finish writing in the background
+                    self.sensor.cleanup(wait=False)
                 del self.sensor
                 
             # Switch sensor type with clear feedback
@@ -676,11 +970,15 @@ class MainWindow(QMainWindow, Ui_FingerprintApp):
             # Switch sensor type
             if self.current_sensor_type == "Capacitive":
                 self.current_sensor_type = "Optical"
-                self.sensor = FingerprintSensor(port='/dev/ttyUSB1')
+                self.sensor = FingerprintSensor(port='/dev/ttyUSB1', archive_writer=self.archive_writer,
+                                                capture_log_dir=CAPTURE_LOG_DIR,
+                                                spoof_detector=self.model_manager.detector)
                 self.append_to_results("✅ Optical sensor initialized successfully")
             else:
                 self.current_sensor_type = "Capacitive"
-                self.sensor = AnotherSensor(port='/dev/ttyUSB0')
+                self.sensor = AnotherSensor(port='/dev/ttyUSB0', archive_writer=self.archive_writer,
+                                            capture_log_dir=CAPTURE_LOG_DIR,
+                                            spoof_detector=self.model_manager.detector)
                 self.append_to_results("✅ Capacitive sensor initialized successfully")
                 
             # Update UI and restart thread
@@ -696,6 +994,12 @@ class MainWindow(QMainWindow, Ui_FingerprintApp):
             self.sensor_thread.signals.enrollment_complete.connect(self.on_enrollment_complete)
             self.sensor_thread.signals.search_complete.connect(self.on_search_complete)
             
+            self.sensor.is_embedding_search_enabled = self.embedding_search
+            self.sensor.is_burst_enabled = self.burst_recheck
+            self.model_manager.attach(self.sensor)
+            self.dedup_scanner.attach(self.sensor)
+            self.start_spoof_model_warmup()
+
             # Re-enable the button after a short delay
             QTimer.singleShot(1000, lambda: self.sensorTypeButton.setEnabled(True))
             
@@ -705,13 +1009,38 @@ class MainWindow(QMainWindow, Ui_FingerprintApp):
             self.update_sensor_type_button(self.current_sensor_type)
             self.sensorTypeButton.setEnabled(True)
 
+    def start_spoof_model_warmup(self):
+        """Warm up the active sensor's spoof model off the GUI thread"""
+        if self.warmup_thread is not None:
+            self.warmup_thread.wait()
+        self.warmup_thread = ModelWarmupThread(self.sensor)
+        self.warmup_thread.signals.spoof_model_status.connect(self.on_spoof_model_status)
+        self.warmup_thread.start()
+
+    def on_spoof_model_status(self, status):
+        """Show the spoof model state while it loads and warms up"""
+        detector = getattr(self.sensor, 'spoof_detector', None)
+        if status == "ready" and detector is not None:
+            self.append_to_results(f"🛡️ Spoof model ready (warm-up {detector.warmup_time:.1f} s)")
+        elif status == "unavailable":
+            self.append_to_results("⚠️ Spoof model unavailable")
+        else:
+            self.append_to_results(f"🔄 Spoof model {status}...")
+        if self.sensor.is_anti_spoof_enabled:
+            self.update_spoof_status(f"Spoof Status: Enabled (model {status})")
+
     def toggle_anti_spoof(self):
         """Toggle anti-spoof detection"""
         if self.sensor:
             try:
                 # Toggle the status
                 self.sensor.is_anti_spoof_enabled = not self.sensor.is_anti_spoof_enabled
+                if self.hub is not None:
+                    self.hub.set_anti_spoof(self.sensor.is_anti_spoof_enabled)
                 status = "Enabled" if self.sensor.is_anti_spoof_enabled else "Disabled"
+                detector = getattr(self.sensor, 'spoof_detector', None)
+                if self.sensor.is_anti_spoof_enabled and detector is not None and not detector.is_ready:
+                    status += f" (model {detector.status})"
                 
                 # Update UI with simple status
                 self.append_to_results(f"🛡️ Anti-spoof detection {status}")
@@ -727,10 +1056,10 @@ class MainWindow(QMainWindow, Ui_FingerprintApp):
         else:
             self.append_to_results("⚠️ No active sensor for spoof detection")
 
-    def on_enrollment_complete(self, image_paths):
+    def on_enrollment_complete(self, images):
         """Handle enrollment completion"""
-        if len(image_paths) > 1:
-            self.display_fingerprint_image(image_paths[1])  # Show the second scan
+        if len(images) > 1:
+            self.display_fingerprint_image(images[1])  # Show the second scan
             self.append_to_results("✅ Enrollment completed successfully!")
             
             # Get the name of the last enrolled fingerprint
@@ -763,13 +1092,16 @@ class MainWindow(QMainWindow, Ui_FingerprintApp):
             # Restore stdout
             sys.stdout = self.old_stdout
             
+            if getattr(self, 'gate_thread', None) is not None or getattr(self, 'hub', None) is not None:
+                self.stop_gate()
+
             # Stop the sensor thread
             if hasattr(self, 'sensor_thread'):
                 self.sensor_thread.stop()
                 self.sensor_thread.wait()
             
-            # Clean up the sensor
-            if hasattr(self, 'sensor'):
+            # Clean up the sensor, unless it is the hub's primary: hub.close() cleans up every hub sensor
+            if hasattr(self, 'sensor') and getattr(self, 'hub', None) is None:
                 # Close the serial connection if it exists
                 if hasattr(self.sensor, 'serial'):
                     self.sensor.serial.close()
@@ -777,6 +1109,21 @@ class MainWindow(QMainWindow, Ui_FingerprintApp):
                 # Clean up any other resources
                 if hasattr(self.sensor, 'cleanup'):
                     self.sensor.cleanup()
+            
+            if getattr(self, 'hub', None) is not None:
+                self.hub.close()
+            if getattr(self, 'warmup_thread', None) is not None:
+                self.warmup_thread.wait()
+            if hasattr(self, 'model_manager'):
+                self.model_manager.stop()
+            if hasattr(self, 'dedup_scanner'):
+                self.dedup_scanner.stop()
+
+            # Write out any captures still queued before exiting
+            if hasattr(self, 'archive_writer'):
+                self.archive_writer.close()
+            if hasattr(self, 'retention_sweeper'):
+                self.retention_sweeper.stop()
         except Exception as e:
             print(f"Error during cleanup: {str(e)}")
         finally:
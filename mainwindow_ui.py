@@ -79,7 +79,7 @@ class Ui_FingerprintApp(object):
         """)
         self.spoofStatusDisplay.setObjectName("spoofStatusDisplay")
         self.resultsDisplay = QtWidgets.QTextEdit(parent=self.centralwidget)
-        self.resultsDisplay.setGeometry(QtCore.QRect(20, 10, 241, 271))
+        self.resultsDisplay.setGeometry(QtCore.QRect(20, 10, 241, 194))
         self.resultsDisplay.setMinimumSize(QtCore.QSize(0, 150))
         self.resultsDisplay.setStyleSheet("""
             QTextEdit {
@@ -223,6 +223,24 @@ class Ui_FingerprintApp(object):
 "            background: #E57373;\n"
 "          }")
         self.deleteButton.setObjectName("deleteButton")
+        self.verifyButton = QtWidgets.QPushButton(parent=self.centralwidget)
+        self.verifyButton.setGeometry(QtCore.QRect(20, 223, 239, 51))
+        self.verifyButton.setStyleSheet("QPushButton {\n"
+"            padding: 10px;\n"
+"            font-size: 18px;\n"
+"            background: #673AB7;\n"
+"            color: white;\n"
+"            border-radius: 8px;\n"
+"            font-weight: bold;\n"
+"            font-family: Arial, sans-serif;\n"
+"          }\n"
+"          QPushButton:hover {\n"
+"            background: #512DA8;\n"
+"          }\n"
+"          QPushButton:disabled {\n"
+"            background: #9575CD;\n"
+"          }")
+        self.verifyButton.setObjectName("verifyButton")
         FingerprintApp.setCentralWidget(self.centralwidget)
 
         self.retranslateUi(FingerprintApp)
@@ -244,6 +262,7 @@ class Ui_FingerprintApp(object):
         self.exitButton.setText(_translate("FingerprintApp", "Exit"))
         self.enrollButton.setText(_translate("FingerprintApp", "Enroll"))
         self.deleteButton.setText(_translate("FingerprintApp", "Delete"))
+        self.verifyButton.setText(_translate("FingerprintApp", "Verify"))
 
     def update_sensor_type_button(self, sensor_type):
         """Update the sensor type button text"""
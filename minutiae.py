@@ -0,0 +1,286 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from liveness_prefilter import foreground_blocks, structure_tensor, ridge_coherence, BLOCK_SIZE
+
+# Host-side minutiae extraction and matching, independent of the sensor's on-chip matcher.
+# A template is a float32 (N, 4) array of x, y, ridge angle (radians, modulo pi) and type.
+MINUTIA_ENDING = 1
+MINUTIA_BIFURCATION = 3
+BINARIZE_WINDOW = 15         # Local mean window for ridge/valley separation
+MIN_MINUTIA_DISTANCE = 8     # Minutiae closer than this are treated as noise (breaks, spurs, bridges)
+MAX_MINUTIAE = 80           # Beyond this, minutiae spread over the finger in clear ridge areas are kept
+
+# Matching
+NEIGHBOURS = 4               # Nearest neighbours in the rotation-invariant local descriptor
+ALIGNMENT_CANDIDATES = 24    # Best descriptor pairs tried as alignment hypotheses
+DISTANCE_TOLERANCE = 10.0    # Pixels
+ANGLE_TOLERANCE = np.pi / 8
+MIN_MINUTIAE = 6             # Templates with fewer minutiae never match
+MATCH_THRESHOLD = 0.2        # Score (paired minutiae squared over both template sizes) to accept a match
+
+
+def box_mean(image, size):
+    """Mean over a size x size window for every pixel, via an integral image."""
+    pad = size // 2
+    padded = np.pad(image, pad + 1, mode="reflect").astype(np.float64)
+    integral = padded.cumsum(0).cumsum(1)
+    h, w = image.shape
+    window = (integral[size:size + h, size:size + w] - integral[:h, size:size + w]
+              - integral[size:size + h, :w] + integral[:h, :w])
+    return (window / (size * size)).astype(np.float32)
+
+
+def orientation_field(image, block=BLOCK_SIZE):
+    """Per-block ridge orientation (radians, modulo pi) from the smoothed gradient structure tensor."""
+    gxx, gyy, gxy = structure_tensor(image, block)
+    # Average the doubled-angle vectors over neighbouring blocks before halving the angle
+    cos2 = np.pad(gxx - gyy, 1, mode="edge")
+    sin2 = np.pad(2 * gxy, 1, mode="edge")
+    rows, cols = gxx.shape
+    cos2 = sum(cos2[r:r + rows, c:c + cols] for r in range(3) for c in range(3))
+    sin2 = sum(sin2[r:r + rows, c:c + cols] for r in range(3) for c in range(3))
+    # Ridges run perpendicular to the dominant gradient
+    return np.mod(0.5 * np.arctan2(sin2, cos2) + np.pi / 2, np.pi)
+
+
+def binarize(image, mask):
+    """Ridge pixels (dark) as True, restricted to the foreground mask."""
+    smoothed = box_mean(image.astype(np.float32), 3)
+    return (smoothed < box_mean(smoothed, BINARIZE_WINDOW)) & mask
+
+
+def neighbours(padded):
+    """The 8 neighbours P2..P9 (clockwise from north) of every interior pixel of a 1-padded image."""
+    return [padded[:-2, 1:-1], padded[:-2, 2:], padded[1:-1, 2:], padded[2:, 2:],
+            padded[2:, 1:-1], padded[2:, :-2], padded[1:-1, :-2], padded[:-2, :-2]]
+
+
+def thin(binary):
+    """Zhang-Suen thinning, each sub-iteration applied to the whole image at once."""
+    image = np.pad(binary.astype(np.uint8), 1)
+    while True:
+        changed = False
+        for step in (0, 1):
+            p2, p3, p4, p5, p6, p7, p8, p9 = neighbours(image)
+            ring = [p2, p3, p4, p5, p6, p7, p8, p9, p2]
+            count = p2 + p3 + p4 + p5 + p6 + p7 + p8 + p9
+            transitions = sum(((ring[k] == 0) & (ring[k + 1] == 1)).astype(np.uint8) for k in range(8))
+            if step == 0:
+                side = (p2 * p4 * p6 == 0) & (p4 * p6 * p8 == 0)
+            else:
+                side = (p2 * p4 * p8 == 0) & (p2 * p6 * p8 == 0)
+            remove = (image[1:-1, 1:-1] == 1) & (count >= 2) & (count <= 6) & (transitions == 1) & side
+            if remove.any():
+                image[1:-1, 1:-1][remove] = 0
+                changed = True
+        if not changed:
+            return image[1:-1, 1:-1].astype(bool)
+
+
+def crossing_number(skeleton):
+    """Crossing number of every pixel: 1 at ridge endings, 3 at bifurcations."""
+    padded = np.pad(skeleton.astype(np.int8), 1)
+    ring = neighbours(padded)
+    ring.append(ring[0])
+    return sum(np.abs(ring[k] - ring[k + 1]) for k in range(8)) // 2
+
+
+def select_minutiae(template, quality, count=MAX_MINUTIAE):
+    """Up to count minutiae, picked far from those already kept and weighted by the quality of their area."""
+    if len(template) <= count:
+        return template
+    points = template[:, :2]
+    chosen = [int(np.argmax(quality))]
+    nearest = np.linalg.norm(points - points[chosen[0]], axis=1)
+    for _ in range(count - 1):
+        # Kept minutiae have distance 0, so they are never picked again
+        pick = int(np.argmax(nearest * (quality + 1e-3)))
+        chosen.append(pick)
+        nearest = np.minimum(nearest, np.linalg.norm(points - points[pick], axis=1))
+    return template[np.sort(chosen)]
+
+
+def extract_minutiae(pixels, block=BLOCK_SIZE):
+    """Minutiae template of an 8-bit grayscale frame."""
+    image = pixels.astype(np.float32)
+    blocks = foreground_blocks(pixels, block)
+    if not blocks.any():
+        return np.zeros((0, 4), dtype=np.float32)
+    # Erode the block mask so the ridge ends at the finger's outline are not reported
+    padded = np.pad(blocks, 1)
+    inner = blocks & padded[:-2, 1:-1] & padded[2:, 1:-1] & padded[1:-1, :-2] & padded[1:-1, 2:]
+    mask = np.zeros(pixels.shape, dtype=bool)
+    rows, cols = blocks.shape
+    mask[:rows * block, :cols * block] = np.kron(blocks, np.ones((block, block), dtype=bool))
+    valid = np.zeros(pixels.shape, dtype=bool)
+    valid[:rows * block, :cols * block] = np.kron(inner, np.ones((block, block), dtype=bool))
+
+    skeleton = thin(binarize(image, mask))
+    cn = crossing_number(skeleton)
+    ys, xs = np.nonzero(skeleton & valid & ((cn == MINUTIA_ENDING) | (cn == MINUTIA_BIFURCATION)))
+    if len(xs) == 0:
+        return np.zeros((0, 4), dtype=np.float32)
+
+    # Minutiae in tight clusters come from noise, drop every one that has a close neighbour
+    points = np.stack([xs, ys], axis=1).astype(np.float32)
+    distances = np.linalg.norm(points[:, None] - points[None], axis=2)
+    np.fill_diagonal(distances, np.inf)
+    keep = distances.min(axis=1) >= MIN_MINUTIA_DISTANCE
+    xs, ys = xs[keep], ys[keep]
+
+    block_rows, block_cols = np.minimum(ys // block, rows - 1), np.minimum(xs // block, cols - 1)
+    angles = orientation_field(image, block)[block_rows, block_cols]
+    template = np.stack([xs, ys, angles, cn[ys, xs]], axis=1).astype(np.float32)
+    return select_minutiae(template, ridge_coherence(image, block)[block_rows, block_cols])
+
+
+def angle_difference(a, b):
+    """Absolute difference of two ridge angles modulo pi."""
+    d = np.mod(np.abs(a - b), np.pi)
+    return np.minimum(d, np.pi - d)
+
+
+def local_descriptors(template, k=NEIGHBOURS):
+    """Rotation invariant neighbour distances and relative angles of every minutia."""
+    points = template[:, :2]
+    distances = np.linalg.norm(points[:, None] - points[None], axis=2)
+    np.fill_diagonal(distances, np.inf)
+    nearest = np.argsort(distances, axis=1)[:, :k]
+    near_distances = np.take_along_axis(distances, nearest, axis=1)
+    relative_angles = np.mod(template[nearest, 2] - template[:, None, 2], np.pi)
+    return near_distances, relative_angles
+
+
+def match_score(probe, gallery):
+    """Similarity of two templates in [0, 1], from the best of several rigid alignments."""
+    n, m = len(probe), len(gallery)
+    if n < MIN_MINUTIAE or m < MIN_MINUTIAE:
+        return 0.0
+    k = min(NEIGHBOURS, n - 1, m - 1)
+    probe_distances, probe_angles = local_descriptors(probe, k)
+    gallery_distances, gallery_angles = local_descriptors(gallery, k)
+    dissimilarity = (np.abs(probe_distances[:, None] - gallery_distances[None]).sum(axis=2) / DISTANCE_TOLERANCE
+                     + angle_difference(probe_angles[:, None], gallery_angles[None]).sum(axis=2) / ANGLE_TOLERANCE)
+    dissimilarity += (probe[:, None, 3] != gallery[None, :, 3]) * k  # Prefer pairs of the same type
+    best = np.argsort(dissimilarity, axis=None)[:ALIGNMENT_CANDIDATES]
+    pi, gj = np.unravel_index(best, dissimilarity.shape)
+
+    # Ridge angles are only known modulo pi, so every pair gives two rotation hypotheses
+    rotation = np.concatenate([gallery[gj, 2] - probe[pi, 2], gallery[gj, 2] - probe[pi, 2] + np.pi])
+    pi, gj = np.concatenate([pi, pi]), np.concatenate([gj, gj])
+    cos, sin = np.cos(rotation)[:, None], np.sin(rotation)[:, None]
+    relative = probe[None, :, :2] - probe[pi, None, :2]                     # (H, N, 2)
+    x = cos * relative[..., 0] - sin * relative[..., 1] + gallery[gj, None, 0]
+    y = sin * relative[..., 0] + cos * relative[..., 1] + gallery[gj, None, 1]
+    distance = np.hypot(x[..., None] - gallery[None, None, :, 0], y[..., None] - gallery[None, None, :, 1])
+    angles = angle_difference(probe[None, :, None, 2] + rotation[:, None, None], gallery[None, None, :, 2])
+    paired = (distance < DISTANCE_TOLERANCE) & (angles < ANGLE_TOLERANCE)   # (H, N, M)
+    return float(best_pairing(paired, distance) ** 2) / (n * m)
+
+
+def best_pairing(paired, distance):
+    """Most one-to-one minutia pairs over the alignment hypotheses, each probe and gallery minutia used once.
+
+    Pairs are taken greedily, closest first. Hypotheses are tried in order of their upper bound (minutiae
+    with any partner on either side) and the search stops once no remaining bound can beat the best count.
+    """
+    upper = np.minimum(paired.any(axis=2).sum(axis=1), paired.any(axis=1).sum(axis=1))
+    best = 0
+    for hypothesis in np.argsort(-upper, kind="stable"):
+        if upper[hypothesis] <= best:
+            break
+        probe_idx, gallery_idx = np.nonzero(paired[hypothesis])
+        order = np.argsort(distance[hypothesis, probe_idx, gallery_idx], kind="stable")
+        used_probe, used_gallery = set(), set()
+        for p, g in zip(probe_idx[order].tolist(), gallery_idx[order].tolist()):
+            if p not in used_probe and g not in used_gallery:
+                used_probe.add(p)
+                used_gallery.add(g)
+        best = max(best, len(used_probe))
+    return best
+
+
+def identify(probe, gallery, threshold=MATCH_THRESHOLD, top_k=5):
+    """Best (index, score) pairs of a gallery (sequence of templates) above the threshold, best first."""
+    scores = np.array([match_score(probe, template) for template in gallery])
+    order = np.argsort(-scores)[:top_k]
+    return [(int(i), float(scores[i])) for i in order if scores[i] >= threshold]
+
+
+def template_to_bytes(template):
+    return np.asarray(template, dtype=np.float32).tobytes()
+
+
+def template_from_bytes(data):
+    return np.frombuffer(data, dtype=np.float32).reshape(-1, 4)
+
+
+def _extract_path(path):
+    from capture_store import load_capture
+    return extract_minutiae(load_capture(path).pixels)
+
+
+def _match_rows(args):
+    templates, rows = args
+    return [[match_score(templates[i], templates[j]) for j in range(len(templates))] for i in rows]
+
+
+def benchmark(paths, workers):
+    """Extraction and all-pairs matching throughput, single core and with a process pool."""
+    from multiprocessing import Pool
+    start = time.time()
+    templates = [_extract_path(path) for path in paths]
+    single_extract = time.time() - start
+    pairs = len(templates) ** 2
+    start = time.time()
+    _match_rows((templates, range(len(templates))))
+    single_match = time.time() - start
+    print(f"1 core:    {len(paths) / single_extract:.1f} extractions/s, {pairs / single_match:.0f} matches/s")
+
+    with Pool(workers) as pool:
+        start = time.time()
+        pool.map(_extract_path, paths)
+        pool_extract = time.time() - start
+        chunks = [(templates, range(i, len(templates), workers)) for i in range(workers)]
+        start = time.time()
+        pool.map(_match_rows, chunks)
+        pool_match = time.time() - start
+    print(f"{workers} workers: {len(paths) / pool_extract:.1f} extractions/s, {pairs / pool_match:.0f} matches/s")
+    counts = [len(template) for template in templates]
+    print(f"Minutiae per capture: mean {np.mean(counts):.1f}, min {min(counts)}, max {max(counts)}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Host-side minutiae extraction and matching")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    match = subparsers.add_parser("match", help="Score two captures against each other")
+    match.add_argument("probe")
+    match.add_argument("gallery")
+    bench = subparsers.add_parser("benchmark", help="Measure throughput on a directory of captures")
+    bench.add_argument("input")
+    bench.add_argument("--workers", type=int, default=os.cpu_count())
+    bench.add_argument("--limit", type=int, default=200, help="Captures to use")
+    args = parser.parse_args(argv)
+
+    if args.command == "match":
+        probe, gallery = _extract_path(args.probe), _extract_path(args.gallery)
+        score = match_score(probe, gallery)
+        verdict = "MATCH" if score >= MATCH_THRESHOLD else "NO MATCH"
+        print(f"{len(probe)} / {len(gallery)} minutiae, score {score:.3f}: {verdict}")
+        return 0
+
+    from capture_store import find_images
+    paths = find_images(args.input)[:args.limit]
+    if not paths:
+        print(f"No captures found in {args.input}")
+        return 1
+    benchmark(paths, args.workers)
+    return 0
+
+
+# Example usage: python minutiae.py benchmark fingerprint_images/enroll --workers 4
+if __name__ == "__main__":
+    sys.exit(main())
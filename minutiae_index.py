@@ -0,0 +1,308 @@
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import threading
+import numpy as np
+from minutiae import extract_minutiae, match_score, template_to_bytes, template_from_bytes, MATCH_THRESHOLD
+
+# Candidate retrieval for large 1:N galleries: every triangle formed by a minutia and two of its nearest
+# neighbours is hashed by its side lengths and the ridge angles at its corners (relative to its longest side),
+# and gallery templates sharing many hashes with the probe are the candidates sent to full matching.
+# Both features are invariant to rotation and translation of the finger.
+INDEX_NEIGHBOURS = 5         # Nearest neighbours each minutia forms triangles with
+TRIPLET_BIN = 4.0            # Side length quantization in pixels
+TRIPLET_BINS = 64            # Sides longer than TRIPLET_BINS * TRIPLET_BIN share the last bin
+ANGLE_BINS = 8               # Ridge angle quantization over [0, pi)
+CANDIDATES = 20              # Candidates returned for full matching
+
+
+def triangle_features(template, k=INDEX_NEIGHBOURS):
+    """Features (T, 6) of the distinct triangles a minutia forms with two of its k nearest neighbours.
+
+    Columns are the side lengths in increasing order, then the ridge angle at the corner opposite each side
+    relative to the direction of the longest side, both quantized to bin units (not yet floored).
+    """
+    points = template[:, :2]
+    n = len(points)
+    if n < 3:
+        return np.zeros((0, 6), dtype=np.float32)
+    k = min(k, n - 1)
+    distances = np.linalg.norm(points[:, None] - points[None], axis=2)
+    np.fill_diagonal(distances, np.inf)
+    nearest = np.argsort(distances, axis=1)[:, :k]
+    first, second = np.triu_indices(k, 1)
+    triangles = np.stack([np.repeat(np.arange(n), len(first)),
+                          nearest[:, first].ravel(), nearest[:, second].ravel()], axis=1)
+    triangles = np.unique(np.sort(triangles, axis=1), axis=0)
+    a, b, c = triangles.T
+    opposite = np.stack([distances[b, c], distances[c, a], distances[a, b]], axis=1)
+    order = np.argsort(opposite, axis=1)
+    corners = np.take_along_axis(triangles, order, axis=1)
+    sides = np.take_along_axis(opposite, order, axis=1)
+    # The longest side joins the first two corners
+    delta = points[corners[:, 1]] - points[corners[:, 0]]
+    direction = np.arctan2(delta[:, 1], delta[:, 0])
+    angles = np.mod(template[corners, 2] - direction[:, None], np.pi)
+    return np.concatenate([sides / TRIPLET_BIN, angles * ANGLE_BINS / np.pi], axis=1)
+
+
+def hash_bins(bins):
+    sides = np.clip(bins[..., :3], 0, TRIPLET_BINS - 1).astype(np.int64)
+    angles = np.mod(bins[..., 3:], ANGLE_BINS).astype(np.int64)
+    key = (sides[..., 0] * TRIPLET_BINS + sides[..., 1]) * TRIPLET_BINS + sides[..., 2]
+    for column in range(3):
+        key = key * ANGLE_BINS + angles[..., column]
+    return key
+
+
+def template_hashes(template):
+    """Distinct triangle hashes stored for a gallery template."""
+    return np.unique(hash_bins(np.floor(triangle_features(template)))).astype(np.int32)
+
+
+def probe_hashes(template):
+    """Triangle hashes looked up for a probe: each feature in its own bin and in the nearer adjacent one."""
+    scaled = triangle_features(template)
+    base = np.floor(scaled)
+    alternative = base + np.where(scaled - base < 0.5, -1, 1)
+    choices = np.stack([base, alternative])                                      # (2, T, 6)
+    combos = (np.arange(64)[:, None] >> np.arange(6)) & 1                         # (64, 6)
+    bins = choices[combos[:, None, :], np.arange(scaled.shape[0])[None, :, None], np.arange(6)]
+    return np.unique(hash_bins(bins)).astype(np.int32)
+
+
+class CandidateIndex:
+    """Inverted lists from triangle hash to template slot, persisted in the sensor's SQLite database.
+
+    Each enrolled slot keeps its minutiae templates and their hashes in one row per impression, so the
+    in-memory lists are rebuilt at start-up without re-hashing. Pass db_path=None for an in-memory index.
+    Candidates are full-matched by a ParallelMatcher when one is given, in the calling thread otherwise.
+    """
+    def __init__(self, db_path=None, matcher=None):
+        self.db_path = db_path
+        self.matcher = matcher
+        self._matcher_stale = True   # The matcher's gallery is reloaded before the next match after a change
+        self._match_lock = threading.Lock()
+        self.templates = {}       # Slot -> list of minutiae templates (one per enrolled impression)
+        self.hash_counts = {}     # Slot -> number of distinct hashes, to normalize votes
+        self._hashes = np.zeros(0, dtype=np.int32)     # Posting keys, sorted
+        self._slots = np.zeros(0, dtype=np.int32)      # Slot of every posting
+        self._pending = []        # (hashes, slots) added since the postings were last sorted
+        self._lock = threading.Lock()
+        if db_path:
+            self._load()
+
+    def _connect(self):
+        db = sqlite3.connect(self.db_path)
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS minutiae_templates (
+                template_position INTEGER NOT NULL,
+                minutiae BLOB NOT NULL,
+                triplets BLOB NOT NULL
+            )
+        ''')
+        db.execute('CREATE INDEX IF NOT EXISTS minutiae_templates_position ON minutiae_templates (template_position)')
+        return db
+
+    def _load(self):
+        db = self._connect()
+        try:
+            rows = db.execute('SELECT template_position, minutiae, triplets FROM minutiae_templates').fetchall()
+        finally:
+            db.close()
+        hashes = {}
+        for slot, minutiae, triplets in rows:
+            self.templates.setdefault(slot, []).append(template_from_bytes(minutiae))
+            hashes.setdefault(slot, []).append(np.frombuffer(triplets, dtype=np.int32))
+        for slot, arrays in hashes.items():
+            self._add_postings(slot, np.unique(np.concatenate(arrays)))
+
+    def __len__(self):
+        return len(self.templates)
+
+    def _add_postings(self, slot, hashes):
+        self.hash_counts[slot] = len(hashes)
+        self._pending.append((hashes, np.full(len(hashes), slot, dtype=np.int32)))
+
+    def _sorted_postings(self):
+        if self._pending:
+            hashes = np.concatenate([self._hashes] + [h for h, _ in self._pending])
+            slots = np.concatenate([self._slots] + [s for _, s in self._pending])
+            order = np.argsort(hashes, kind="stable")
+            self._hashes, self._slots = hashes[order], slots[order]
+            self._pending = []
+        return self._hashes, self._slots
+
+    def add(self, slot, templates):
+        """Index the minutiae templates of an enrolled slot, replacing what was stored for it before."""
+        templates = [np.asarray(t, dtype=np.float32) for t in templates if len(t) >= 3]
+        if not templates:
+            return False
+        hashes = [template_hashes(t) for t in templates]
+        with self._lock:
+            if slot in self.templates:
+                self._remove_postings(slot)
+            if self.db_path:
+                db = self._connect()
+                try:
+                    db.execute('DELETE FROM minutiae_templates WHERE template_position = ?', (slot,))
+                    db.executemany('INSERT INTO minutiae_templates (template_position, minutiae, triplets) '
+                                   'VALUES (?, ?, ?)',
+                                   [(slot, template_to_bytes(t), h.tobytes()) for t, h in zip(templates, hashes)])
+                    db.commit()
+                finally:
+                    db.close()
+            self.templates[slot] = templates
+            self._add_postings(slot, np.unique(np.concatenate(hashes)))
+            self._matcher_stale = True
+        return True
+
+    def add_frames(self, slot, frames):
+        """Extract and index the minutiae of the enrollment frames of a slot."""
+        return self.add(slot, [extract_minutiae(frame.pixels) for frame in frames if frame is not None])
+
+    def remove(self, slot):
+        self.remove_many([slot])
+
+    def remove_many(self, slots):
+        """Forget several slots with one database commit and one pass over the postings."""
+        slots = list(slots)
+        with self._lock:
+            if self.db_path:
+                db = self._connect()
+                try:
+                    db.executemany('DELETE FROM minutiae_templates WHERE template_position = ?',
+                                   [(slot,) for slot in slots])
+                    db.commit()
+                finally:
+                    db.close()
+            self._remove_postings(*[slot for slot in slots if slot in self.templates])
+            self._matcher_stale = True
+
+    def _remove_postings(self, *removed):
+        if not removed:
+            return
+        hashes, slots = self._sorted_postings()
+        keep = ~np.isin(slots, removed)
+        self._hashes, self._slots = hashes[keep], slots[keep]
+        for slot in removed:
+            del self.templates[slot]
+            del self.hash_counts[slot]
+
+    def candidates(self, probe, top_k=CANDIDATES):
+        """Up to top_k slots sharing the most triangle hashes with the probe template, best first."""
+        query = probe_hashes(probe)
+        with self._lock:
+            hashes, slots = self._sorted_postings()
+            if len(hashes) == 0 or len(query) == 0:
+                return []
+            starts = np.searchsorted(hashes, query, side="left")
+            lengths = np.searchsorted(hashes, query, side="right") - starts
+            hit = lengths > 0
+            starts, lengths = starts[hit], lengths[hit]
+            if len(starts) == 0:
+                return []
+            # Gather all postings of the matching hashes without a Python loop
+            offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+            voters, votes = np.unique(slots[offsets], return_counts=True)
+            counts = np.array([self.hash_counts[int(slot)] for slot in voters], dtype=np.float32)
+        scores = votes / np.sqrt(counts)
+        order = np.argsort(-scores)[:top_k]
+        return [int(voters[i]) for i in order]
+
+    def scores(self, probe, slots):
+        """{slot: best full-match score over its templates} for the given indexed slots."""
+        if self.matcher is None:
+            templates = dict(self.templates)
+            return {slot: max(match_score(probe, template) for template in templates[slot])
+                    for slot in slots if slot in templates}
+        with self._match_lock:
+            with self._lock:
+                if self._matcher_stale:
+                    self.matcher.load_index(self)
+                    self._matcher_stale = False
+            return self.matcher.scores(probe, slots)
+
+    def identify(self, probe, top_k=CANDIDATES, threshold=MATCH_THRESHOLD):
+        """Full-match the candidates of a probe; (slot, score) pairs above the threshold, best first."""
+        scores = self.scores(probe, self.candidates(probe, top_k))
+        return sorted(((slot, score) for slot, score in scores.items() if score >= threshold),
+                      key=lambda result: -result[1])
+
+    def close(self):
+        """Stop the matcher's worker pool."""
+        if self.matcher is not None:
+            with self._match_lock:
+                self.matcher.close()
+            self._matcher_stale = True
+
+
+def grouped_captures(directory):
+    """Capture paths grouped by their parent directory (one directory per finger)."""
+    from capture_store import find_images
+    groups = {}
+    for path in find_images(directory):
+        groups.setdefault(os.path.dirname(path), []).append(path)
+    return [paths for _, paths in sorted(groups.items())]
+
+
+def benchmark(directory, ks, limit=None):
+    """Recall@k of the index against exhaustive matching, with the first capture of every finger enrolled."""
+    from capture_store import load_capture
+    groups = grouped_captures(directory)[:limit]
+    groups = [paths for paths in groups if len(paths) > 1]
+    if not groups:
+        print(f"Need several captures per finger directory under {directory}")
+        return 1
+    print(f"🔄 Extracting minutiae from {sum(len(paths) for paths in groups)} captures...")
+    index = CandidateIndex()
+    gallery = []
+    probes = []
+    start = time.time()
+    for slot, paths in enumerate(groups, 1):
+        templates = [extract_minutiae(load_capture(path).pixels) for path in paths]
+        index.add(slot, templates[:1])
+        gallery.append(templates[0])
+        probes.extend(templates[1:])
+    print(f"Gallery of {len(gallery)} fingers, {len(probes)} probes ({time.time() - start:.1f} s)")
+
+    max_k = max(ks)
+    hits = {k: 0 for k in ks}
+    counted = 0
+    exhaustive_time = index_time = 0.0
+    for probe in probes:
+        start = time.time()
+        scores = [match_score(probe, template) for template in gallery]
+        exhaustive_time += time.time() - start
+        best = int(np.argmax(scores)) + 1
+        start = time.time()
+        candidates = index.candidates(probe, max_k)
+        index_time += time.time() - start
+        if scores[best - 1] < MATCH_THRESHOLD:
+            continue  # Exhaustive matching found nothing either
+        counted += 1
+        for k in ks:
+            hits[k] += best in candidates[:k]
+
+    print(f"Exhaustive match: {exhaustive_time / len(probes) * 1000:.1f} ms per probe, "
+          f"{counted} of {len(probes)} probes matched")
+    print(f"Index lookup:     {index_time / len(probes) * 1000:.1f} ms per probe")
+    for k in ks:
+        print(f"recall@{k}: {hits[k] / max(counted, 1):.1%} (full matching on {k / len(gallery):.1%} of the gallery)")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recall of the minutiae candidate index versus exhaustive matching")
+    parser.add_argument("input", help="Directory with one sub-directory of captures per finger")
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 5, 10, CANDIDATES])
+    parser.add_argument("--limit", type=int, default=None, help="Fingers to use")
+    args = parser.parse_args(argv)
+    return benchmark(args.input, args.k, args.limit)
+
+
+# Example usage: python minutiae_index.py fingerprint_images/benchmark --k 1 5 20
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+import os
+import glob
+import threading
+from capture_store import load_capture
+from spoof_model import SpoofDetector, MODEL_PATH
+
+# New weights dropped into the model directory are picked up without restarting the station
+MODEL_POLL_INTERVAL = 30        # Seconds between directory checks
+MIN_FIXTURE_ACCURACY = 0.9      # Share of fixture captures a new model must classify correctly
+ROLLBACK_ERRORS = 3             # Consecutive inference errors after a swap that trigger a rollback
+ALLOW_UNVALIDATED = False       # Swap in models even when there are no fixtures to check them against
+
+
+def fixture_set(fixture_dir):
+    """(path, verdict) pairs from <fixture_dir>/live/ and <fixture_dir>/fake/."""
+    from capture_store import find_images
+    fixtures = []
+    for verdict, name in (("LIVE", "live"), ("FAKE", "fake")):
+        fixtures.extend((path, verdict) for path in find_images(os.path.join(fixture_dir, name)))
+    return fixtures
+
+
+class ModelManager:
+    """Watches the model directory and swaps validated spoof models into the attached sensors."""
+    def __init__(self, model_path=MODEL_PATH, fixture_dir=None, interval=MODEL_POLL_INTERVAL,
+                 min_accuracy=MIN_FIXTURE_ACCURACY, allow_unvalidated=ALLOW_UNVALIDATED, on_event=None):
+        self.model_dir = os.path.dirname(model_path)
+        self.fixture_dir = fixture_dir or os.path.join(self.model_dir, "fixtures")
+        self.interval = interval
+        self.min_accuracy = min_accuracy
+        self.allow_unvalidated = allow_unvalidated
+        self.on_event = on_event or print
+        self.sensors = []           # Sensors sharing the managed detector
+        self.detector = None
+        self.previous = None
+        self._current_key = self._file_key(model_path)
+        self._rejected = set()
+        self._pending = {}  # Candidate key seen on the last poll, loaded once it stops changing
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def attach(self, *sensors):
+        """Make the sensors use the managed detector, adopting the first sensor's detector if there is none yet.
+
+        Replaces the sensors attached before; a station with several sensors attaches them all in one call.
+        """
+        with self._lock:
+            self.sensors = list(sensors)
+            for sensor in self.sensors:
+                if self.detector is None:
+                    self.detector = getattr(sensor, 'spoof_detector', None)
+                elif hasattr(sensor, 'spoof_detector'):
+                    sensor.spoof_detector = self.detector
+
+    def _install(self, detector):
+        for sensor in self.sensors:
+            if hasattr(sensor, 'spoof_detector'):
+                sensor.spoof_detector = detector
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="ModelManager", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.check_once()
+            except Exception as e:
+                self.on_event(f"Error while checking for new spoof models: {e}")
+            self._stop.wait(self.interval)
+
+    def check_once(self):
+        """Roll back a failing model, then load, validate and swap in the newest weights file if it changed."""
+        detector = self.detector
+        if self.previous is not None and detector is not None and detector.consecutive_errors >= ROLLBACK_ERRORS:
+            self.rollback(f"{detector.consecutive_errors} consecutive inference errors")
+
+        candidate = self._newest_candidate()
+        if candidate is None:
+            return False
+        # Only load files that did not change since the last poll, so half-copied weights are skipped
+        if self._pending.get(candidate[0]) != candidate:
+            self._pending = {candidate[0]: candidate}
+            return False
+        self._pending = {}
+        path = candidate[0]
+        self.on_event(f"🔄 Loading new spoof model {os.path.basename(path)}...")
+
+        new_detector = SpoofDetector(path)
+        width, height = getattr(self.sensors[0] if self.sensors else None, 'frame_size', (256, 288))
+        if not new_detector.warm_up(width, height):
+            return self._reject(candidate, "model could not be loaded")
+        accuracy = self.validate(new_detector)
+        if accuracy is None:
+            # An empty fixture directory must not wave untested weights through
+            if not self.allow_unvalidated:
+                return self._reject(candidate, f"no fixtures in {self.fixture_dir} to validate it against")
+            self.on_event(f"⚠️ No fixtures in {self.fixture_dir}, new spoof model only checked for loading")
+        elif accuracy < self.min_accuracy:
+            return self._reject(candidate, f"fixture accuracy {accuracy:.0%} below {self.min_accuracy:.0%}")
+        self.swap(new_detector, candidate)
+        return True
+
+    def validate(self, detector):
+        """Fixture accuracy of a detector, None when there is no fixture set to check against."""
+        fixtures = fixture_set(self.fixture_dir)
+        if not fixtures:
+            return None
+        correct = sum(detector.detect(load_capture(path)).verdict == verdict for path, verdict in fixtures)
+        return correct / len(fixtures)
+
+    def swap(self, detector, candidate):
+        """Atomically replace the sensors' detector; a search already running keeps the one it started with."""
+        with self._lock:
+            self.previous, self.detector = self.detector, detector
+            self._current_key = candidate
+            self._install(detector)
+        self.on_event(f"✅ Spoof model switched to {os.path.basename(candidate[0])}")
+
+    def rollback(self, reason):
+        with self._lock:
+            if self.previous is None:
+                return
+            self._rejected.add(self._current_key)
+            failed, self.detector, self.previous = self.detector, self.previous, None
+            self._current_key = self._file_key(self.detector.model_path)
+            self._install(self.detector)
+        self.on_event(f"⚠️ Spoof model {os.path.basename(failed.model_path)} rolled back ({reason})")
+
+    def _reject(self, candidate, reason):
+        self._rejected.add(candidate)
+        self.on_event(f"❌ Spoof model {os.path.basename(candidate[0])} rejected: {reason}")
+        return False
+
+    def _newest_candidate(self):
+        keys = [self._file_key(path) for path in glob.glob(os.path.join(self.model_dir, "*.pth"))]
+        keys = [key for key in keys if key is not None]
+        if not keys:
+            return None
+        newest = max(keys, key=lambda key: key[1])
+        if newest == self._current_key or newest in self._rejected:
+            return None
+        if self._current_key is not None and newest[1] <= self._current_key[1]:
+            return None
+        return newest
+
+    @staticmethod
+    def _file_key(path):
+        """(path, mtime, size) identifying one version of a weights file."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return path, stat.st_mtime, stat.st_size
@@ -0,0 +1,267 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import multiprocessing
+from multiprocessing import shared_memory
+from minutiae import match_score, MATCH_THRESHOLD
+
+# 1:N host matching sharded over a persistent process pool, so it is not bound to one core by the GIL.
+# The gallery lives once in shared memory; workers map it instead of receiving pickled copies.
+MATCH_CORES = max(1, (os.cpu_count() or 1) - 1)   # Leave a core for the UI and serial threads
+SHARDS_PER_CORE = 2          # Smaller shards even out templates of different sizes
+WORKER_NICE = 10             # Workers yield to the UI and serial threads when the board is busy
+PARALLEL_MIN_ROWS = 8        # Fewer templates are matched in the calling process, a match costs a few ms
+POOL_START_METHOD = "forkserver"   # Never fork the station: its Qt, torch and serial threads can hold locks
+TOP_K = 5
+
+_blocks = {}                 # Worker side: shared memory name -> (block, offsets, slots, minutiae)
+
+
+def gallery_views(buffer, count, total):
+    """Offsets (count + 1), slots (count) and minutiae (total, 4) laid out back to back in a buffer."""
+    offsets = np.ndarray((count + 1,), dtype=np.int64, buffer=buffer)
+    slots = np.ndarray((count,), dtype=np.int64, buffer=buffer, offset=8 * (count + 1))
+    minutiae = np.ndarray((total, 4), dtype=np.float32, buffer=buffer, offset=8 * (2 * count + 1))
+    return offsets, slots, minutiae
+
+
+def attach(name):
+    """Map an existing block; only the creating process unlinks it."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13: pool workers share the creator's resource tracker, so tracking again is harmless
+        return shared_memory.SharedMemory(name=name)
+
+
+def _init_worker(nice):
+    if nice:
+        os.nice(nice)
+
+
+def _gallery(name, count, total):
+    if name not in _blocks:
+        # A new gallery generation replaces the one mapped before
+        for old in list(_blocks):
+            _blocks.pop(old)[0].close()
+        block = attach(name)
+        _blocks[name] = (block,) + gallery_views(block.buf, count, total)
+    return _blocks[name][1:]
+
+
+def match_rows(probe, offsets, slots, minutiae, ranges, top_k=None):
+    """Best (score, slot) pairs of the gallery rows in [start, end) ranges, one per slot, all when top_k is None."""
+    best = {}
+    for start, end in ranges:
+        for row in range(start, end):
+            score = match_score(probe, minutiae[offsets[row]:offsets[row + 1]])
+            slot = int(slots[row])
+            if score > best.get(slot, -1.0):
+                best[slot] = score
+    return sorted(((score, slot) for slot, score in best.items()), reverse=True)[:top_k]
+
+
+def _match_shard(args):
+    (name, count, total), ranges, probe, top_k = args
+    offsets, slots, minutiae = _gallery(name, count, total)
+    return match_rows(probe, offsets, slots, minutiae, ranges, top_k)
+
+
+def split_ranges(ranges, pieces):
+    """Row ranges cut into at most pieces lists holding about the same number of rows."""
+    rows = [row for start, end in ranges for row in range(start, end)]
+    shards = []
+    for part in np.array_split(np.asarray(rows, dtype=np.int64), min(pieces, len(rows))):
+        shard = []
+        for row in part.tolist():
+            if shard and shard[-1][1] == row:
+                shard[-1][1] = row + 1
+            else:
+                shard.append([row, row + 1])
+        shards.append([tuple(r) for r in shard])
+    return shards
+
+
+class ParallelMatcher:
+    """Shards the host gallery over a persistent process pool; probes go to all shards, results are merged."""
+    def __init__(self, cores=MATCH_CORES, nice=WORKER_NICE):
+        self.cores = max(1, cores)
+        self.nice = nice
+        self.block = None
+        self.layout = None           # (shared memory name, rows, minutiae) sent with every task
+        self.shards = []             # Row range lists the whole gallery is split into
+        self.slot_rows = {}          # Slot -> (start, end) rows of its templates
+        self._pool = None
+        self._local = None           # Views used directly when there is a single core
+
+    def __len__(self):
+        return self.layout[1] if self.layout else 0
+
+    def load(self, entries):
+        """Replace the gallery with (slot, template) pairs; a slot may have several templates."""
+        # Templates of a slot are kept in adjacent rows
+        entries = sorted(((slot, np.asarray(t, dtype=np.float32).reshape(-1, 4)) for slot, t in entries),
+                         key=lambda entry: entry[0])
+        count = len(entries)
+        total = sum(len(t) for _, t in entries)
+        block = shared_memory.SharedMemory(create=True, size=max(8 * (2 * count + 1) + 16 * total, 1))
+        offsets, slots, minutiae = gallery_views(block.buf, count, total)
+        offsets[0] = 0
+        offsets[1:] = np.cumsum([len(t) for _, t in entries])
+        slots[:] = [slot for slot, _ in entries]
+        if total:
+            minutiae[:] = np.concatenate([t for _, t in entries])
+
+        old = self.block
+        self.block, self.layout = block, (block.name, count, total)
+        self._local = (offsets, slots, minutiae)
+        pieces = min(max(count, 1), self.cores * SHARDS_PER_CORE)
+        bounds = np.linspace(0, count, pieces + 1).astype(int)
+        self.shards = [[(int(a), int(b))] for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+        self.slot_rows = {}
+        for row, (slot, _) in enumerate(entries):
+            start, _ = self.slot_rows.get(slot, (row, row))
+            self.slot_rows[slot] = (start, row + 1)
+        if old is not None:
+            # Workers still mapping it keep their pages, the name just goes away
+            old.close()
+            old.unlink()
+
+    def load_index(self, index):
+        """Load the templates of a CandidateIndex (see minutiae_index.py)."""
+        self.load([(slot, template) for slot, templates in index.templates.items() for template in templates])
+
+    def _ensure_pool(self):
+        if self._pool is None and self.cores > 1:
+            context = multiprocessing.get_context(POOL_START_METHOD)
+            self._pool = context.Pool(self.cores, initializer=_init_worker, initargs=(self.nice,))
+        return self._pool
+
+    def _match(self, probe, shards, top_k=None):
+        """Per-shard (score, slot) lists, in the pool unless there are too few rows to be worth sending."""
+        probe = np.asarray(probe, dtype=np.float32)
+        rows = sum(end - start for shard in shards for start, end in shard)
+        pool = self._ensure_pool() if rows >= PARALLEL_MIN_ROWS else None
+        if pool is None:
+            offsets, slots, minutiae = self._local
+            return [match_rows(probe, offsets, slots, minutiae, [r for shard in shards for r in shard], top_k)]
+        return pool.map(_match_shard, [(self.layout, shard, probe, top_k) for shard in shards])
+
+    def scores(self, probe, slots):
+        """{slot: best score over its templates} for the given slots, with their templates split over the pool."""
+        ranges = [self.slot_rows[slot] for slot in dict.fromkeys(slots) if slot in self.slot_rows]
+        if not ranges:
+            return {}
+        best = {}
+        for score, slot in (pair for shard in self._match(probe, split_ranges(ranges, self.cores)) for pair in shard):
+            best[slot] = max(score, best.get(slot, -1.0))
+        return best
+
+    def identify(self, probe, top_k=TOP_K, threshold=MATCH_THRESHOLD):
+        """(slot, score) pairs of the best matching slots above the threshold, best first."""
+        if not len(self):
+            return []
+        results = self._match(probe, self.shards, top_k)
+        best = {}
+        for score, slot in (pair for shard in results for pair in shard):
+            best[slot] = max(score, best.get(slot, -1.0))
+        merged = sorted(best.items(), key=lambda item: -item[1])[:top_k]
+        return [(slot, score) for slot, score in merged if score >= threshold]
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        if self.block is not None:
+            self.block.close()
+            self.block.unlink()
+            self.block = self.layout = self._local = None
+
+
+def random_template(count, rng, width=256, height=288):
+    """Random minutiae of a typical count, to pad benchmark galleries with impostors that cost a full match."""
+    return np.stack([rng.uniform(16, width - 16, count), rng.uniform(16, height - 16, count),
+                     rng.uniform(0, np.pi, count), rng.choice([1, 3], count)], axis=1).astype(np.float32)
+
+
+def displaced_template(template, rng, shift=20.0, jitter=2.0):
+    """A second impression of a template: rotated, shifted, with jittered positions and a few minutiae lost."""
+    angle = rng.uniform(-0.3, 0.3)
+    cos, sin = np.cos(angle), np.sin(angle)
+    keep = template[rng.random(len(template)) > 0.1]
+    x, y = keep[:, 0], keep[:, 1]
+    moved = np.stack([cos * x - sin * y + rng.uniform(-shift, shift), sin * x + cos * y + rng.uniform(-shift, shift),
+                      np.mod(keep[:, 2] + angle, np.pi), keep[:, 3]], axis=1)
+    moved[:, :2] += rng.normal(0, jitter, (len(keep), 2))
+    return moved.astype(np.float32)
+
+
+def benchmark(directory, gallery_size, probe_count, core_counts):
+    """Probe throughput at each core count on a gallery padded to gallery_size entries.
+
+    Without a capture directory the fingers are synthetic, probes being displaced copies of their templates.
+    """
+    from minutiae_index import CANDIDATES
+    rng = np.random.default_rng(0)
+    entries, probes = [], []
+    if directory is None:
+        for slot in range(1, probe_count + 1):
+            template = random_template(int(rng.integers(30, 60)), rng)
+            entries.append((slot, template))
+            probes.append((slot, displaced_template(template, rng)))
+        groups = entries
+    else:
+        from capture_store import load_capture
+        from minutiae import extract_minutiae
+        from minutiae_index import grouped_captures
+        groups = [paths for paths in grouped_captures(directory) if len(paths) > 1]
+        if not groups:
+            print(f"Need several captures per finger directory under {directory}")
+            return 1
+        print(f"🔄 Extracting minutiae from {len(groups)} fingers...")
+        for slot, paths in enumerate(groups, 1):
+            entries.append((slot, extract_minutiae(load_capture(paths[0]).pixels)))
+            if len(probes) < probe_count:
+                probes.append((slot, extract_minutiae(load_capture(paths[1]).pixels)))
+    while len(entries) < gallery_size:
+        entries.append((len(entries) + 1, random_template(len(entries[rng.integers(len(groups))][1]), rng)))
+
+    baseline = None
+    for cores in core_counts:
+        matcher = ParallelMatcher(cores)
+        matcher.load(entries)
+        matcher.identify(probes[0][1])  # Start the pool and map the gallery
+        start = time.time()
+        correct = sum(bool(found) and found[0][0] == slot
+                      for slot, found in ((slot, matcher.identify(probe)) for slot, probe in probes))
+        per_probe = (time.time() - start) / len(probes)
+        # The index path: full matches of a candidate list only
+        start = time.time()
+        for slot, probe in probes:
+            matcher.scores(probe, [slot] + [int(s) for s in rng.integers(1, len(entries) + 1, CANDIDATES - 1)])
+        per_candidates = (time.time() - start) / len(probes)
+        matcher.close()
+        baseline = baseline or (per_probe, per_candidates)
+        print(f"{cores} core(s): {per_probe * 1000:.0f} ms per probe over {len(entries)} templates, "
+              f"speed-up {baseline[0] / per_probe:.2f}x, {correct}/{len(probes)} identified; "
+              f"{per_candidates * 1000:.0f} ms per {CANDIDATES} candidates, speed-up {baseline[1] / per_candidates:.2f}x")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scaling of the sharded host matcher over CPU cores")
+    parser.add_argument("input", nargs="?", help="Directory with one sub-directory of captures per finger "
+                                                 "(default: synthetic fingers)")
+    parser.add_argument("--gallery-size", type=int, default=1000, help="Pad the gallery to this many templates")
+    parser.add_argument("--probes", type=int, default=10)
+    parser.add_argument("--cores", type=int, nargs="+", default=list(range(1, (os.cpu_count() or 1) + 1)))
+    args = parser.parse_args(argv)
+    return benchmark(args.input, args.gallery_size, args.probes, args.cores)
+
+
+# Example usage: python parallel_matcher.py fingerprint_images/benchmark --gallery-size 5000 --cores 1 2 3 4
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,237 @@
+import os
+import sys
+import glob
+import json
+import time
+import asyncio
+import argparse
+import threading
+from async_transport import SerialStream, CapacitiveProtocol, R307Protocol
+from archive_writer import ImageArchiveWriter
+from gate_mode import GateMetrics, run_gate
+from model_manager import ModelManager
+from template_store import open_sensor
+from sensor_protocol import CMD_FINGER_DETECT
+
+# Stations with several readers: every sensor on its own port gets its own worker thread running the gate
+# loop, while the spoof model, archive writer and per-type name database are shared. Serial waits and
+# model inference release the GIL, so throughput adds up across sensors until the model is saturated.
+HUB_PORT_PATTERNS = ["/dev/ttyUSB*", "/dev/ttyACM*"]   # Ports probed when none are given
+PROBE_TIMEOUT = 0.5          # Seconds a port gets to answer a probe command
+CAPACITIVE_BAUD = 460800
+OPTICAL_BAUD = 115200
+HUB_REPORT_INTERVAL = 60     # Seconds between aggregate throughput reports of the CLI
+
+
+async def probe_port(port, timeout=PROBE_TIMEOUT):
+    """Sensor type answering on a port ("capacitive" or "optical"), None when neither does."""
+    for sensor_type, baudrate, protocol in (("capacitive", CAPACITIVE_BAUD, CapacitiveProtocol),
+                                            ("optical", OPTICAL_BAUD, R307Protocol)):
+        try:
+            link = protocol(await SerialStream.open(port, baudrate), timeout)
+        except OSError:
+            return None
+        try:
+            if sensor_type == "capacitive":
+                await link.command(CMD_FINGER_DETECT)
+                return sensor_type
+            if await link.verify_password():
+                return sensor_type
+        except (asyncio.TimeoutError, IOError):
+            pass
+        finally:
+            link.close()
+    return None
+
+
+def discover_sensors(patterns=HUB_PORT_PATTERNS, timeout=PROBE_TIMEOUT):
+    """{port: sensor type} of the sensors answering on ports matching the patterns, all probed at once."""
+    ports = sorted({port for pattern in patterns for port in glob.glob(pattern)})
+
+    async def probe_all():
+        return await asyncio.gather(*(probe_port(port, timeout) for port in ports))
+
+    found = asyncio.run(probe_all()) if ports else []
+    return {port: sensor_type for port, sensor_type in zip(ports, found) if sensor_type}
+
+
+def parse_ports(specs):
+    """{port: sensor type} from "capacitive:/dev/ttyUSB0" style specs."""
+    sensors = {}
+    for spec in specs:
+        sensor_type, sep, port = spec.partition(":")
+        if not sep or sensor_type not in ("capacitive", "optical"):
+            raise ValueError(f"Expected capacitive:PORT or optical:PORT, got {spec!r}")
+        sensors[port] = sensor_type
+    return sensors
+
+
+class SensorHub:
+    """Owns one sensor per port and identifies press after press on each in its own worker thread."""
+    def __init__(self, archive_writer=None, model_manager=None, capture_log_dir=None, on_result=None, on_event=None):
+        self.owns_archive_writer = archive_writer is None
+        self.archive_writer = archive_writer or ImageArchiveWriter()
+        self.model_manager = model_manager or ModelManager()
+        self.capture_log_dir = capture_log_dir
+        self.on_result = on_result or self.print_result
+        self.on_event = on_event or print
+        self.sensors = {}            # Port -> sensor
+        self.metrics = {}            # Port -> GateMetrics of the current run
+        self._stop = threading.Event()
+        self._threads = {}
+
+    def open(self, sensors):
+        """Open the {port: sensor type} sensors; they all share the managed spoof model."""
+        for port, sensor_type in sorted(sensors.items()):
+            # One capture log per sensor, appends from several workers must not interleave
+            log_dir = os.path.join(self.capture_log_dir, os.path.basename(port)) if self.capture_log_dir else None
+            # Only the first sensor loads a model, the manager adopts it and hands it to the others
+            sensor, _, _ = open_sensor(sensor_type, port, archive_writer=self.archive_writer,
+                                       capture_log_dir=log_dir, spoof_detector=self.model_manager.detector)
+            self.sensors[port] = sensor
+            self.model_manager.attach(*self.sensors.values())
+            self.on_event(f"✅ {sensor.sensor_type} sensor opened on {port}")
+        return self.sensors
+
+    @property
+    def primary(self):
+        """The sensor enrollment, verification and deletion run on, the first port."""
+        return self.sensors[min(self.sensors)] if self.sensors else None
+
+    @property
+    def can_edit_templates(self):
+        """Whether Enroll and Delete may change the primary's flash: no other sensor shares its name database.
+
+        Names are keyed by slot only, so a slot freed and reused on one unit would name the old template still
+        stored in that slot on the others.
+        """
+        primary = self.primary
+        return primary is not None and \
+            sum(sensor.sensor_type == primary.sensor_type for sensor in self.sensors.values()) == 1
+
+    def warm_up(self):
+        detector = self.model_manager.detector
+        if detector is not None and not detector.is_ready and self.sensors:
+            detector.warm_up(*self.primary.frame_size)
+
+    def set_anti_spoof(self, enabled):
+        for sensor in self.sensors.values():
+            sensor.is_anti_spoof_enabled = enabled
+
+    def set_embedding_search(self, enabled):
+        for sensor in self.sensors.values():
+            sensor.is_embedding_search_enabled = enabled
+
+    def set_burst_recheck(self, enabled):
+        for sensor in self.sensors.values():
+            sensor.is_burst_enabled = enabled
+
+    @property
+    def running(self):
+        return bool(self._threads)
+
+    def start(self):
+        """Start a gate worker per sensor."""
+        if self._threads:
+            return
+        self._stop.clear()
+        for port in sorted(self.sensors):
+            self.metrics[port] = GateMetrics()
+            self._threads[port] = threading.Thread(target=self._run, args=(port,), name=f"Hub {port}", daemon=True)
+            self._threads[port].start()
+
+    def stop(self, timeout=None):
+        """Stop every worker once its press in progress is finished."""
+        self._stop.set()
+        for thread in self._threads.values():
+            thread.join(timeout)
+        self._threads = {}
+
+    def _run(self, port):
+        sensor = self.sensors[port]
+
+        def on_complete(is_match, frame, spoof_status, matched_name=None):
+            self.on_result(port, is_match, frame, spoof_status, matched_name)
+
+        try:
+            run_gate(sensor, self._stop, lambda message: self.on_event(f"[{port}] {message}"), on_complete,
+                     metrics=self.metrics[port])
+        except Exception as e:
+            self.on_event(f"❌ Sensor on {port} stopped: {e}")
+
+    def per_minute(self):
+        """Identifications per minute over all sensors."""
+        return sum(metrics.per_minute() for metrics in self.metrics.values())
+
+    def summary(self):
+        lines = [f"{port} ({self.sensors[port].sensor_type}): {metrics.summary()}"
+                 for port, metrics in sorted(self.metrics.items())]
+        lines.append(f"All {len(self.metrics)} sensors: {self.per_minute():.1f}/min")
+        return "\n".join(lines)
+
+    def print_result(self, port, is_match, frame, spoof_status, matched_name=None):
+        if is_match:
+            self.on_event(f"✅ [{port}] Fingerprint matched{' with: ' + matched_name if matched_name else ''}")
+        else:
+            self.on_event(f"❌ [{port}] No match found.")
+
+    def close(self):
+        self.stop()
+        for sensor in self.sensors.values():
+            sensor.cleanup()
+        self.sensors = {}
+        if self.owns_archive_writer:
+            self.archive_writer.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Identify on every connected sensor at once")
+    parser.add_argument("sensors", nargs="*", help="capacitive:PORT or optical:PORT (default: probe serial ports)")
+    parser.add_argument("--anti-spoof", action="store_true", help="Spoof-check every press")
+    parser.add_argument("--embedding-search", action="store_true",
+                        help="Rank search candidates by the spoof pass's backbone features (with --anti-spoof)")
+    parser.add_argument("--no-burst", action="store_true",
+                        help="Report uncertain spoof checks as they are instead of re-checking them with a burst")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON lines for other services")
+    parser.add_argument("--duration", type=float, default=None, help="Seconds to run (default: until Ctrl-C)")
+    args = parser.parse_args(argv)
+
+    try:
+        sensors = parse_ports(args.sensors) if args.sensors else discover_sensors()
+    except ValueError as e:
+        parser.error(str(e))
+    if not sensors:
+        print("❌ No sensors found")
+        return 1
+
+    def json_result(port, is_match, frame, spoof_status, matched_name=None):
+        print(json.dumps({"port": port, "time": time.time(), "match": bool(is_match), "name": matched_name,
+                          "spoof": str(spoof_status)}), flush=True)
+
+    hub = SensorHub(on_result=json_result if args.json else None,
+                    on_event=(lambda message: print(message, file=sys.stderr)) if args.json else None)
+    try:
+        hub.open(sensors)
+        hub.set_anti_spoof(args.anti_spoof)
+        hub.set_embedding_search(args.embedding_search)
+        hub.set_burst_recheck(not args.no_burst)
+        hub.warm_up()
+        hub.model_manager.start()
+        hub.start()
+        deadline = time.time() + args.duration if args.duration else None
+        while deadline is None or time.time() < deadline:
+            time.sleep(max(0.0, min(HUB_REPORT_INTERVAL, deadline - time.time())) if deadline else HUB_REPORT_INTERVAL)
+            hub.on_event(f"📊 {hub.summary()}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        hub.stop()
+        hub.on_event(f"📊 {hub.summary()}")
+        hub.model_manager.stop()
+        hub.close()
+    return 0
+
+
+# Example usage: python sensor_hub.py capacitive:/dev/ttyUSB0 capacitive:/dev/ttyUSB2 optical:/dev/ttyUSB1
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,66 @@
+# Framing, command and result codes of both sensor protocols, shared by the blocking sensor classes
+# (CapSensor.py, OptSensor.py) and the asyncio transport (async_transport.py).
+
+# Capacitive sensor: 26-byte 0xAA55 command / 0x55AA response packets
+Command = 0xAA55
+Response = 0x55AA
+Command_SID = 0x00
+Response_SID = 0x01
+Command_DID = 0x00
+Response_DID = 0x00
+Command_Data = 0xA55A    # Prefix of command packets carrying a data payload
+Response_Data = 0x5AA5   # Prefix of response packets carrying a data payload
+CAP_PACKET_BYTES = 26
+CAP_IMAGE_STREAM_BYTES = 66218   # Bytes following CMD_UP_IMAGE_CODE, see capture.decode_capacitive_image
+
+# Command and Response codes
+CMD_FINGER_DETECT = 0x21
+CMD_GET_IMAGE = 0x20
+CMD_GENERATE = 0x60
+CMD_MERGE = 0x61
+CMD_STORE_CHAR = 0x40
+CMD_LOAD_CHAR = 0x41
+CMD_UP_CHAR = 0x42
+CMD_DOWN_CHAR = 0x43
+CMD_GET_EMPTY_ID = 0x45
+CMD_SEARCH = 0x63
+CMD_UP_IMAGE_CODE = 0x22
+CMD_DEL_CHAR = 0x44
+CMD_GET_ENROLL_COUNT = 0x48
+CMD_GET_ENROLLED_ID_LIST = 0x49
+
+# Result codes
+ERR_SUCCESS = 0x00
+ERR_FAIL = 0x01
+ERR_FP_NOT_DETECTED = 0x28
+ERR_INVALID_PARAM = 0x22
+ERR_TMPL_EMPTY = 0x12
+
+# Data lengths
+DATA_0 = 0x0000
+DATA_1 = 0x0001
+DATA_2 = 0x0002
+DATA_3 = 0x0003
+DATA_4 = 0x0004
+DATA_6 = 0x0006
+
+# Template slots of the capacitive sensor
+MAX_TEMPLATE_ID = 3000
+
+# R307 optical sensor: 0xEF01 packets (header, 32-bit address, packet identifier, big-endian length and checksum)
+R307_HEADER = 0xEF01
+R307_ADDRESS = 0xFFFFFFFF
+R307_COMMAND = 0x01
+R307_DATA = 0x02
+R307_ACK = 0x07
+R307_END = 0x08
+R307_GEN_IMG = 0x01
+R307_IMG_2_TZ = 0x02
+R307_SEARCH = 0x04
+R307_DELETE = 0x0C
+R307_UP_IMAGE = 0x0A
+R307_VERIFY_PASSWORD = 0x13
+R307_SUCCESS = 0x00
+R307_NO_FINGER = 0x02
+R307_NOT_FOUND = 0x09
+R307_CAPACITY = 1000
@@ -0,0 +1,221 @@
+import os
+import sys
+import tty
+import time
+import struct
+import asyncio
+import argparse
+import threading
+from sensor_protocol import (Response, Response_SID, Response_DID, CAP_PACKET_BYTES, CAP_IMAGE_STREAM_BYTES,
+                             CMD_FINGER_DETECT, CMD_GET_IMAGE, CMD_GENERATE, CMD_SEARCH, CMD_DEL_CHAR, CMD_UP_IMAGE_CODE,
+                             ERR_SUCCESS, ERR_FAIL, ERR_FP_NOT_DETECTED, R307_HEADER, R307_ADDRESS, R307_DATA, R307_ACK,
+                             R307_END, R307_GEN_IMG, R307_IMG_2_TZ, R307_SEARCH, R307_DELETE, R307_UP_IMAGE,
+                             R307_VERIFY_PASSWORD, R307_SUCCESS, R307_NO_FINGER, R307_NOT_FOUND)
+
+# Both sensors emulated on a pseudo-terminal, so async_transport, sensor_hub and the R307 capture path of
+# OptSensor can be exercised without hardware. The device side answers the commands the transport sends.
+R307_IMAGE_BYTES = 256 * 288 // 2    # Packed 4-bit image uploaded by UP_IMAGE
+R307_DATA_PACKET = 128               # Payload bytes per image data packet
+SIMULATED_SCORE = 120                # Match score reported by the R307 search
+
+
+class SimulatedSensor:
+    """A capacitive or R307 sensor answering on a pty; port is the path the host side opens."""
+    def __init__(self, sensor_type, finger=True, match=1):
+        self.sensor_type = sensor_type
+        self.finger = finger             # Whether a finger is on the sensor
+        self.match = match               # Slot the search reports, None for no match
+        self.delay = 0.0                 # Seconds the next response is held back
+        self.commands = []               # Command codes received, in order
+        self.master, slave = os.openpty()
+        tty.setraw(self.master)
+        tty.setraw(slave)
+        self.port = os.ttyname(slave)
+        self._slave = slave              # Kept open so the pty stays up between host connections
+        self._thread = threading.Thread(target=self._serve, name=f"Simulated {sensor_type}", daemon=True)
+        self._thread.start()
+
+    def _read(self, count):
+        data = b""
+        while len(data) < count:
+            chunk = os.read(self.master, count - len(data))
+            if not chunk:
+                raise EOFError
+            data += chunk
+        return data
+
+    def _send(self, data):
+        if self.delay:
+            time.sleep(self.delay)
+            self.delay = 0.0
+        os.write(self.master, data)
+
+    def _serve(self):
+        try:
+            while True:
+                if self.sensor_type == "capacitive":
+                    self._serve_capacitive()
+                else:
+                    self._serve_r307()
+        except (EOFError, OSError):
+            pass
+
+    def _serve_capacitive(self):
+        packet = self._read(CAP_PACKET_BYTES)
+        cmd = packet[4]
+        self.commands.append(cmd)
+        if cmd == CMD_UP_IMAGE_CODE:
+            self._send(bytes(i & 0xff for i in range(CAP_IMAGE_STREAM_BYTES)))
+            return
+        ret, data = ERR_SUCCESS, b""
+        if cmd == CMD_FINGER_DETECT:
+            data = bytes([self.finger])
+        elif cmd == CMD_GET_IMAGE and not self.finger:
+            ret = ERR_FP_NOT_DETECTED
+        elif cmd == CMD_SEARCH:
+            ret, data = (ERR_FAIL, b"") if self.match is None else (ERR_SUCCESS, struct.pack("<H", self.match))
+        elif cmd not in (CMD_GET_IMAGE, CMD_GENERATE, CMD_DEL_CHAR):
+            ret = ERR_FAIL
+        response = bytearray(CAP_PACKET_BYTES)
+        struct.pack_into("<HBBBBHH", response, 0, Response, Response_SID, Response_DID, cmd, 0x00, 2 + len(data), ret)
+        response[10:10 + len(data)] = data
+        struct.pack_into("<H", response, 24, sum(response[:24]) & 0xffff)
+        self._send(bytes(response))
+
+    def _r307_packet(self, pid, payload):
+        length = len(payload) + 2
+        checksum = (pid + (length >> 8) + (length & 0xff) + sum(payload)) & 0xffff
+        return struct.pack(">HIBH", R307_HEADER, R307_ADDRESS, pid, length) + bytes(payload) + struct.pack(">H", checksum)
+
+    def _serve_r307(self):
+        _, _, _, length = struct.unpack(">HIBH", self._read(9))
+        instruction = self._read(length)[0]
+        self.commands.append(instruction)
+        code, data = R307_SUCCESS, b""
+        if instruction == R307_GEN_IMG and not self.finger:
+            code = R307_NO_FINGER
+        elif instruction == R307_SEARCH:
+            code, data = (R307_NOT_FOUND, b"") if self.match is None else \
+                (R307_SUCCESS, struct.pack(">HH", self.match, SIMULATED_SCORE))
+        elif instruction not in (R307_GEN_IMG, R307_IMG_2_TZ, R307_DELETE, R307_UP_IMAGE, R307_VERIFY_PASSWORD):
+            code = 0x01
+        reply = self._r307_packet(R307_ACK, bytes([code]) + data)
+        if instruction == R307_UP_IMAGE:
+            image = bytes(i & 0xff for i in range(R307_IMAGE_BYTES))
+            chunks = [image[i:i + R307_DATA_PACKET] for i in range(0, len(image), R307_DATA_PACKET)]
+            reply += b"".join(self._r307_packet(R307_END if i == len(chunks) - 1 else R307_DATA, chunk)
+                              for i, chunk in enumerate(chunks))
+        self._send(reply)
+
+    def close(self):
+        os.close(self.master)
+        os.close(self._slave)
+
+
+async def check_transport(capacitive, optical):
+    """Round trips, a timeout followed by a late response, cancellation and image uploads on both protocols."""
+    from async_transport import SerialStream, CapacitiveProtocol, R307Protocol
+
+    def open_link(sensor, protocol):
+        return protocol(SerialStream(os.open(sensor.port, os.O_RDWR | os.O_NOCTTY)), timeout=0.3)
+
+    cap = open_link(capacitive, CapacitiveProtocol)
+    try:
+        assert await cap.finger_detect()
+        assert await cap.search() == capacitive.match
+        capacitive.delay = 0.4
+        try:
+            await cap.finger_detect()
+            raise AssertionError("The delayed response did not time out")
+        except asyncio.TimeoutError:
+            pass
+        assert await cap.generate(), "The late response was read as the next one's"
+        task = asyncio.create_task(cap.up_image())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        stream = await cap.up_image()
+        assert stream is not None and len(stream) == CAP_IMAGE_STREAM_BYTES
+    finally:
+        cap.close()
+
+    r307 = open_link(optical, R307Protocol)
+    try:
+        assert await r307.verify_password()
+        assert await r307.gen_img()
+        assert len(await r307.up_image()) == R307_IMAGE_BYTES
+        assert await r307.img_2_tz(1)
+        assert await r307.search() == (optical.match, SIMULATED_SCORE)
+        optical.finger = False
+        assert not await r307.gen_img()
+    finally:
+        r307.close()
+        optical.finger = True
+
+
+def check_blocking(optical):
+    """The R307 capture path of OptSensor: gen_img and up_image through a BlockingLink on a pyserial port."""
+    try:
+        import serial
+    except ImportError:
+        return "skipped, pyserial is not installed"
+    from async_transport import R307Protocol, BlockingLink
+    ser = serial.Serial(optical.port, 115200, timeout=1)
+    link = BlockingLink(ser, R307Protocol)
+    try:
+        assert link.call(lambda r307: r307.gen_img())
+        assert len(link.call(lambda r307: r307.up_image())) == R307_IMAGE_BYTES
+        # The port is back in blocking mode for the rest of the sensor class
+        assert os.get_blocking(ser.fileno())
+        # The same loop serves every call
+        assert link.call(lambda r307: r307.gen_img())
+    finally:
+        link.close()
+        ser.close()
+    return "ok"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulated sensors on pseudo-terminals")
+    parser.add_argument("sensor_type", nargs="?", choices=["capacitive", "optical"],
+                        help="Serve one simulated sensor until Ctrl-C")
+    parser.add_argument("--check", action="store_true", help="Verify async_transport against both simulated sensors")
+    parser.add_argument("--match", type=int, default=1, help="Slot the search reports (default: 1)")
+    parser.add_argument("--no-match", action="store_true", help="Report no match to every search")
+    args = parser.parse_args(argv)
+    match = None if args.no_match else args.match
+
+    if args.check:
+        capacitive, optical = SimulatedSensor("capacitive", match=match), SimulatedSensor("optical", match=match)
+        try:
+            asyncio.run(check_transport(capacitive, optical))
+            print("✅ async_transport: round trips, timeout and resync, cancellation, image uploads")
+            print(f"✅ Blocking R307 capture path: {check_blocking(optical)}")
+        except AssertionError as e:
+            print(f"❌ Check failed: {e}")
+            return 1
+        finally:
+            capacitive.close()
+            optical.close()
+        return 0
+
+    if not args.sensor_type:
+        parser.error("give a sensor type to serve, or --check")
+    sensor = SimulatedSensor(args.sensor_type, match=match)
+    print(f"✅ Simulated {args.sensor_type} sensor on {sensor.port}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sensor.close()
+    return 0
+
+
+# Example usage: python sensor_simulator.py --check
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,178 @@
+import os
+import sys
+import csv
+import time
+import argparse
+import numpy as np
+import torch
+from torch.utils.data import Dataset, DataLoader
+from capture_store import load_capture, find_images
+from capture_log import list_segments, open_segment, SENSOR_CODES
+from capture import CapturedFrame
+from spoof_model import SpoofDetector, Preprocessor, MODEL_PATH, SPOOF_THRESHOLD, UNCERTAIN_MARGIN
+
+SENSOR_NAMES = {code: name for name, code in SENSOR_CODES.items()}
+
+
+class ImageFolderDataset(Dataset):
+    """Decodes archived capture files in DataLoader worker processes."""
+    def __init__(self, paths, preprocess):
+        self.paths = paths
+        self.preprocess = preprocess
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, index):
+        path = self.paths[index]
+        return self.preprocess(load_capture(path)), path
+
+
+class CaptureLogDataset(Dataset):
+    """Reads frames straight out of memory-mapped capture log segments."""
+    def __init__(self, directory, preprocess):
+        self.preprocess = preprocess
+        self.segment_paths = list_segments(directory)
+        self.entries = []
+        for segment_index, path in enumerate(self.segment_paths):
+            self.entries.extend((segment_index, i) for i in range(len(open_segment(path))))
+        self._segments = {}  # Opened lazily so every worker maps its own view
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, index):
+        segment_index, record_index = self.entries[index]
+        if segment_index not in self._segments:
+            self._segments[segment_index] = open_segment(self.segment_paths[segment_index])
+        record = self._segments[segment_index][record_index]
+        frame = CapturedFrame(record['pixels'], SENSOR_NAMES.get(int(record['sensor_type']), "Unknown"))
+        label = f"{os.path.basename(self.segment_paths[segment_index])}#{record_index}"
+        return self.preprocess(frame), label
+
+
+def collate_by_size(samples):
+    """Group a batch by input size, frames may come out of preprocessing at different sizes."""
+    groups = {}
+    for tensor, label in samples:
+        groups.setdefault(tuple(tensor.shape), []).append((tensor, label))
+    return [(torch.stack([t for t, _ in group]), [label for _, label in group]) for group in groups.values()]
+
+
+def score_dataset(detector, dataset, stats, batch_size=32, workers=4):
+    """Yield (label, fake score, verdict) per image, filling stats with the aggregate timing."""
+    loader = DataLoader(dataset, batch_size=batch_size, num_workers=workers, collate_fn=collate_by_size,
+                        pin_memory=detector.device.type == "cuda")
+    stats.update({"images": 0, "inference_time": 0.0, "wait_time": 0.0})
+    start = time.time()
+    batch_start = start
+    for groups in loader:
+        stats["wait_time"] += time.time() - batch_start
+        for batch, labels in groups:
+            inference_start = time.time()
+            scores = detector.score_batch(batch)
+            stats["inference_time"] += time.time() - inference_start
+            stats["images"] += len(labels)
+            for label, score in zip(labels, scores.tolist()):
+                yield label, score, detector.result_for(score).verdict
+        batch_start = time.time()
+    stats["total_time"] = time.time() - start
+
+
+def label_for_path(path):
+    """1 for a capture under a fake/ directory, 0 under live/, -1 if it is unlabelled."""
+    parts = set(os.path.normpath(path).lower().split(os.sep))
+    if "fake" in parts:
+        return 1
+    if "live" in parts:
+        return 0
+    return -1
+
+
+def labels_from_paths(paths):
+    """Labels of all captures, None if any of them is unlabelled."""
+    labels = np.array([label_for_path(path) for path in paths])
+    if len(labels) == 0 or (labels < 0).any():
+        return None
+    return labels
+
+
+def compare_preprocessing(detector, paths, args):
+    """Score the same captures with the full-frame and the cropped pipeline and report both."""
+    from liveness_prefilter import equal_error_rate
+    input_size = detector.preprocessor.input_size
+    pipelines = [
+        ("full frame", Preprocessor(input_size, crop=False)),
+        ("cropped", Preprocessor(input_size, crop=True, small_input_size=args.small_input)),
+    ]
+    labels = labels_from_paths(paths)
+    results = {}
+    for name, preprocess in pipelines:
+        stats = {}
+        scores = {label: score for label, score, _ in
+                  score_dataset(detector, ImageFolderDataset(paths, preprocess), stats, args.batch_size, args.workers)}
+        results[name] = np.array([scores[path] for path in paths])
+        line = f"{name:>10}: {stats['inference_time'] / max(stats['images'], 1) * 1000:.1f} ms inference per image"
+        if labels is not None and labels.min() != labels.max():
+            line += f", EER {equal_error_rate(results[name], labels)[0]:.2%}"
+        print(line)
+    full, cropped = results["full frame"], results["cropped"]
+    agreement = np.mean((full >= detector.threshold) == (cropped >= detector.threshold))
+    print(f"Verdict agreement between pipelines: {agreement:.1%}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score archived fingerprint captures with the anti-spoof model")
+    parser.add_argument("input", help="Directory of capture images, or a capture log directory with --log")
+    parser.add_argument("--log", action="store_true", help="Read frames from capture log segments")
+    parser.add_argument("--model", default=MODEL_PATH, help="Model weights to score with")
+    parser.add_argument("--output", default="spoof_scores.csv", help="CSV file for per-image scores")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=4, help="Parallel decoding processes")
+    parser.add_argument("--threshold", type=float, default=SPOOF_THRESHOLD, help="FAKE probability threshold")
+    parser.add_argument("--uncertain-margin", type=float, default=UNCERTAIN_MARGIN,
+                        help="Scores this close to the threshold are reported as UNCERTAIN")
+    parser.add_argument("--crop", action="store_true", help="Feed the finger crop instead of the whole frame")
+    parser.add_argument("--small-input", type=int, default=None, help="Input size used for small crops")
+    parser.add_argument("--compare", action="store_true",
+                        help="Compare latency/accuracy of cropped vs. full-frame preprocessing (image folders only)")
+    args = parser.parse_args(argv)
+
+    detector = SpoofDetector(args.model, threshold=args.threshold, uncertain_margin=args.uncertain_margin)
+    if detector.model is None:
+        return 1
+    if args.compare:
+        return compare_preprocessing(detector, find_images(args.input), args)
+
+    preprocess = Preprocessor(detector.preprocessor.input_size, crop=args.crop,
+                              small_input_size=args.small_input)
+    if args.log:
+        dataset = CaptureLogDataset(args.input, preprocess)
+    else:
+        dataset = ImageFolderDataset(find_images(args.input), preprocess)
+    if len(dataset) == 0:
+        print(f"No captures found in {args.input}")
+        return 1
+
+    print(f"🔄 Scoring {len(dataset)} captures with {args.model} on {detector.device}...")
+    counts = {}
+    stats = {}
+    with open(args.output, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["image", "fake_score", "verdict"])
+        for label, score, verdict in score_dataset(detector, dataset, stats, args.batch_size, args.workers):
+            writer.writerow([label, f"{score:.6f}", verdict])
+            counts[verdict] = counts.get(verdict, 0) + 1
+
+    print(f"✅ Scores written to {args.output}")
+    print(f"Images: {stats['images']} " + ", ".join(f"{verdict}: {count}" for verdict, count in sorted(counts.items())))
+    print(f"⏱️ Total time: {stats['total_time']:.2f} seconds "
+          f"({stats['images'] / max(stats['total_time'], 1e-9):.1f} images/second)")
+    print(f"⏱️ Inference: {stats['inference_time']:.2f} seconds, waiting on decode: {stats['wait_time']:.2f} seconds")
+    return 0
+
+
+# Example usage: python spoof_batch.py fingerprint_images/search --output scores.csv
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,453 @@
+import os
+import json
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+from torchvision import models, transforms
+from PIL import Image
+from collections import OrderedDict
+from liveness_prefilter import LivenessPrefilter, foreground_blocks, BLOCK_SIZE
+
+MODEL_PATH = "/home/live_finger/newtry27jan/model/may2_4.pth"
+# Optional hand-crafted prefilter (see liveness_prefilter.py), used when the file exists
+PREFILTER_PATH = os.path.join(os.path.dirname(MODEL_PATH), "prefilter.json")
+
+# Classifier backbones; the model config next to the weights (may2_4.json for may2_4.pth)
+# names the backbone and input size, weights without a config are the original ResNet-50
+BACKBONES = ("resnet50", "resnet18", "mobilenet_v3_small", "mobilenet_v3_large", "efficientnet_b0")
+DEFAULT_MODEL_CONFIG = {"backbone": "resnet50", "input_size": 224}
+
+# Index of the FAKE class in the classifier output
+FAKE_CLASS = 1
+
+# Decision rule on the FAKE probability: FAKE at or above the threshold, LIVE below it,
+# UNCERTAIN when it lies within the margin around the threshold
+SPOOF_THRESHOLD = 0.5
+UNCERTAIN_MARGIN = 0.15
+
+VERDICT_LIVE = "LIVE"
+VERDICT_FAKE = "FAKE"
+VERDICT_UNCERTAIN = "UNCERTAIN"
+
+# Input preprocessing: optionally crop to the finger's bounding box before resizing so the model sees
+# ridges instead of empty background, and use a smaller input size for small crops
+INPUT_SIZE = 224
+CROP_TO_FOREGROUND = False     # The shipped weights were trained on full frames; enable once --compare shows parity
+CROP_MARGIN = 8
+SMALL_INPUT_SIZE = None        # e.g. 160 to enable
+SMALL_CROP_FRACTION = 0.4      # Crops covering less of the frame than this use SMALL_INPUT_SIZE
+
+# Forward passes on a dummy frame at load time, so the first real search is not the slow one
+WARMUP_RUNS = 3
+
+# Burst mode: extra frames grabbed while the finger stays down, scored in one batched pass. The time they may
+# add (BURST_LATENCY_BUDGET) is set per sensor from its frame upload time, see CapSensor.py and OptSensor.py
+BURST_FRAMES = 3
+BURST_FUSION = "mean"          # "mean", "median" or "max" (most suspicious frame decides)
+BURST_RECHECK = True           # Re-check UNCERTAIN touches with a burst; the band is the only trigger
+
+# Identity embeddings: the pooled backbone features the spoof pass computes anyway, L2-normalized for cosine
+# search. A model config may name another module instead, e.g. a fine-tuned identity head.
+EMBEDDING_LAYER = "avgpool"
+
+STATUS_LOADING = "loading"
+STATUS_WARMING_UP = "warming up"
+STATUS_READY = "ready"
+STATUS_UNAVAILABLE = "unavailable"
+
+
+def get_device():
+    return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+
+def build_transform(input_size=224):
+    """Preprocessing applied to every frame before inference."""
+    return transforms.Compose([
+        transforms.Resize((input_size, input_size)),
+        transforms.ToTensor(),
+        transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+    ])
+
+
+def model_config_path(model_path):
+    return os.path.splitext(model_path)[0] + ".json"
+
+
+def load_model_config(model_path=MODEL_PATH):
+    """Backbone and input size for a weights file, from its config file if there is one."""
+    config = dict(DEFAULT_MODEL_CONFIG)
+    path = model_config_path(model_path)
+    if os.path.exists(path):
+        with open(path) as f:
+            config.update(json.load(f))
+    if config["backbone"] not in BACKBONES:
+        raise ValueError(f"Unknown backbone {config['backbone']!r} in {path}")
+    return config
+
+
+def save_model_config(model_path, backbone, input_size=INPUT_SIZE, **extra):
+    with open(model_config_path(model_path), "w") as f:
+        json.dump({"backbone": backbone, "input_size": input_size, **extra}, f, indent=2)
+
+
+def build_model(backbone="resnet50", num_classes=2, pretrained=False):
+    """Create a backbone with a num_classes head (LIVE/FAKE)."""
+    if backbone not in BACKBONES:
+        raise ValueError(f"Unknown backbone {backbone!r}, expected one of {', '.join(BACKBONES)}")
+    model = getattr(models, backbone)(pretrained=pretrained)
+    if backbone.startswith("resnet"):
+        model.fc = nn.Linear(model.fc.in_features, num_classes)
+    else:
+        # MobileNetV3 and EfficientNet end their classifier with the Linear layer
+        model.classifier[-1] = nn.Linear(model.classifier[-1].in_features, num_classes)
+    return model
+
+
+def load_state_dict(model_path):
+    """Read weights memory-mapped where torch supports it.
+
+    Pages are only shared and loaded lazily while the tensors stay on the CPU, see load_model.
+    """
+    try:
+        return torch.load(model_path, map_location="cpu", mmap=True)
+    except (TypeError, RuntimeError):
+        # torch < 2.1 has no mmap argument, legacy (non-zip) checkpoints cannot be mapped
+        return torch.load(model_path, map_location="cpu")
+
+
+def load_model(model_path=MODEL_PATH, device=None):
+    """Load the pre-trained spoof detection model."""
+    device = device or get_device()
+    try:
+        # Built on the CPU and moved after loading: assigning the mapped tensors makes them the
+        # parameters themselves, copying into allocated parameters would read every page at once
+        model = build_model(load_model_config(model_path)["backbone"])
+
+        state_dict = load_state_dict(model_path)
+        if any(k.startswith('module.') for k in state_dict.keys()):
+            new_state_dict = OrderedDict()
+            for k, v in state_dict.items():
+                name = k[7:] if k.startswith('module.') else k
+                new_state_dict[name] = v
+            state_dict = new_state_dict
+        try:
+            model.load_state_dict(state_dict, assign=True)
+        except TypeError:
+            # torch < 2.1 can only copy into the existing parameters
+            model.load_state_dict(state_dict)
+        model = model.to(device)
+        model.eval()
+        return model
+    except Exception as e:
+        print(f"Failed to load spoof detection model: {e}")
+        return None
+
+
+def to_rgb_image(image):
+    """Accept an image path, a PIL image or a CapturedFrame and return an RGB PIL image."""
+    if isinstance(image, str):
+        return Image.open(image).convert("RGB")
+    if isinstance(image, Image.Image):
+        return image.convert("RGB")
+    return image.to_pil().convert("RGB")
+
+
+def to_gray_array(image):
+    """Accept an image path, a PIL image or a CapturedFrame and return 8-bit grayscale pixels."""
+    if isinstance(image, str):
+        from capture_store import load_capture
+        return load_capture(image).pixels
+    if isinstance(image, Image.Image):
+        return np.asarray(image.convert("L"))
+    return image.pixels
+
+
+def foreground_bbox(pixels, block=BLOCK_SIZE, margin=CROP_MARGIN):
+    """(top, bottom, left, right) of the finger from the block-variance mask, whole frame if none."""
+    height, width = pixels.shape
+    mask = foreground_blocks(pixels, block)
+    if not mask.any():
+        return 0, height, 0, width
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    return (max(rows[0] * block - margin, 0), min((rows[-1] + 1) * block + margin, height),
+            max(cols[0] * block - margin, 0), min((cols[-1] + 1) * block + margin, width))
+
+
+def crop_to_foreground(pixels, block=BLOCK_SIZE, margin=CROP_MARGIN):
+    """View of the frame cropped to the finger's bounding box (no copy)."""
+    top, bottom, left, right = foreground_bbox(pixels, block, margin)
+    return pixels[top:bottom, left:right]
+
+
+class Preprocessor:
+    """Frame to model input tensor, picklable so DataLoader workers can run it."""
+    def __init__(self, input_size=INPUT_SIZE, crop=CROP_TO_FOREGROUND, small_input_size=SMALL_INPUT_SIZE,
+                 small_crop_fraction=SMALL_CROP_FRACTION):
+        self.input_size = input_size
+        self.crop = crop
+        self.small_input_size = small_input_size
+        self.small_crop_fraction = small_crop_fraction
+        self._transforms = {}
+
+    def transform_for(self, size):
+        if size not in self._transforms:
+            self._transforms[size] = build_transform(size)
+        return self._transforms[size]
+
+    def __call__(self, image):
+        """Return a normalized (3, S, S) tensor, S depending on the crop when small inputs are enabled."""
+        if not self.crop:
+            return self.transform_for(self.input_size)(to_rgb_image(image))
+        pixels = to_gray_array(image)
+        cropped = np.ascontiguousarray(crop_to_foreground(pixels))
+        size = self.input_size
+        if self.small_input_size and cropped.size < self.small_crop_fraction * pixels.size:
+            size = self.small_input_size
+        return self.transform_for(size)(Image.fromarray(cropped, mode="L").convert("RGB"))
+
+
+def normalize_embeddings(features):
+    """L2-normalize each row of a (N, D) feature matrix."""
+    features = np.asarray(features, dtype=np.float32)
+    return features / np.maximum(np.linalg.norm(features, axis=1, keepdims=True), 1e-12)
+
+
+def fuse_scores(scores, method=BURST_FUSION):
+    """Combine the FAKE probabilities of a burst into one score."""
+    scores = np.asarray(scores, dtype=np.float64)
+    if method == "median":
+        return float(np.median(scores))
+    if method == "max":
+        return float(scores.max())
+    return float(scores.mean())
+
+
+def classify(fake_probability, threshold=SPOOF_THRESHOLD, uncertain_margin=UNCERTAIN_MARGIN):
+    """Turn a FAKE probability into LIVE, FAKE or UNCERTAIN."""
+    if abs(fake_probability - threshold) < uncertain_margin:
+        return VERDICT_UNCERTAIN
+    return VERDICT_FAKE if fake_probability >= threshold else VERDICT_LIVE
+
+
+class SpoofResult:
+    """Verdict of one spoof check together with the class probabilities behind it."""
+    def __init__(self, verdict, fake_probability=float('nan'), stage="cnn", frames=1):
+        self.verdict = verdict
+        self.fake_probability = fake_probability
+        self.live_probability = 1.0 - fake_probability
+        self.stage = stage  # "prefilter" when the cascade settled it without the CNN
+        self.frames = frames  # Number of burst frames fused into this result
+        self.embedding = None  # Normalized backbone features of the same pass, when requested
+
+    @property
+    def is_fake(self):
+        return self.verdict == VERDICT_FAKE
+
+    @property
+    def is_uncertain(self):
+        """True when the model was not confident enough and further checks are worthwhile."""
+        return self.verdict == VERDICT_UNCERTAIN
+
+    @property
+    def confidence(self):
+        return max(self.fake_probability, self.live_probability)
+
+    def __str__(self):
+        if self.fake_probability != self.fake_probability:  # NaN, no model output
+            return self.verdict
+        suffix = f", {self.frames} frames" if self.frames > 1 else ""
+        if self.is_uncertain:
+            return f"{self.verdict} (FAKE {self.fake_probability:.0%}{suffix})"
+        return f"{self.verdict} ({self.confidence:.0%}{suffix})"
+
+    def __repr__(self):
+        return f"SpoofResult({self.verdict!r}, fake_probability={self.fake_probability:.4f}, stage={self.stage!r})"
+
+
+class SpoofDetector:
+    """The anti-spoof classifier and its preprocessing, usable without any sensor attached."""
+    def __init__(self, model_path=MODEL_PATH, device=None, threshold=SPOOF_THRESHOLD,
+                 uncertain_margin=UNCERTAIN_MARGIN, prefilter_path=PREFILTER_PATH):
+        self.model_path = model_path
+        self.device = device or get_device()
+        self.status = STATUS_LOADING
+        self.warmup_time = None
+        self.model = load_model(model_path, self.device)
+        self.status = STATUS_WARMING_UP if self.model is not None else STATUS_UNAVAILABLE
+        try:
+            self.config = load_model_config(model_path)
+        except Exception:
+            self.config = dict(DEFAULT_MODEL_CONFIG)
+        self.preprocessor = Preprocessor(self.config["input_size"])
+        self.threshold = threshold
+        self.uncertain_margin = uncertain_margin
+        self.prefilter = None
+        if prefilter_path and os.path.exists(prefilter_path):
+            try:
+                self.prefilter = LivenessPrefilter.load(prefilter_path)
+            except Exception as e:
+                print(f"Failed to load liveness prefilter: {e}")
+        self.stage_counts = {"prefilter": 0, "cnn": 0}
+        self.consecutive_errors = 0  # Watched by the model manager to roll back a bad model
+
+    def preprocess(self, image):
+        """Turn one image into a normalized (3, H, W) tensor on the CPU."""
+        return self.preprocessor(image)
+
+    @property
+    def is_ready(self):
+        return self.status == STATUS_READY
+
+    def warm_up(self, width, height, runs=WARMUP_RUNS):
+        """Run the full preprocessing and forward path on dummy frames of the sensor's native size."""
+        if self.model is None:
+            self.status = STATUS_UNAVAILABLE
+            return False
+        from capture import CapturedFrame
+        start = time.time()
+        self.status = STATUS_WARMING_UP
+        try:
+            # Ridge-like stripes so the foreground crop takes its normal path
+            stripes = (np.sin(np.arange(width) * 2 * np.pi / 9) * 100 + 128).astype(np.uint8)
+            frame = CapturedFrame(np.tile(stripes, (height, 1)), "Warm-up")
+            for _ in range(runs):
+                self.score_batch(self.preprocess(frame).unsqueeze(0))
+            if self.device.type == "cuda":
+                torch.cuda.synchronize(self.device)
+        except Exception as e:
+            print(f"Spoof model warm-up failed: {e}")
+            self.status = STATUS_UNAVAILABLE
+            return False
+        self.warmup_time = time.time() - start
+        self.status = STATUS_READY
+        return True
+
+    def score_batch(self, batch, embeddings=None):
+        """Return the FAKE-class softmax probability for each tensor in a (N, 3, H, W) batch.
+
+        When embeddings is a list, the batch's features at the embedding layer are appended to it.
+        """
+        with torch.inference_mode():
+            hook = None
+            if embeddings is not None:
+                layer = self.model.get_submodule(self.config.get("embedding_layer", EMBEDDING_LAYER))
+                hook = layer.register_forward_hook(
+                    lambda module, inputs, output: embeddings.append(torch.flatten(output, 1).float().cpu()))
+            try:
+                outputs = self.model(batch.to(self.device, non_blocking=True))
+            finally:
+                if hook is not None:
+                    hook.remove()
+            return torch.softmax(outputs, dim=1)[:, FAKE_CLASS].cpu()
+
+    def embed(self, images):
+        """Normalized (N, D) embeddings of images, one forward pass per input size."""
+        groups = {}
+        for i, image in enumerate(images):
+            tensor = self.preprocess(image)
+            groups.setdefault(tuple(tensor.shape), []).append((i, tensor))
+        rows = [None] * len(images)
+        for members in groups.values():
+            features = []
+            self.score_batch(torch.stack([tensor for _, tensor in members]), features)
+            for (i, _), row in zip(members, torch.cat(features).numpy()):
+                rows[i] = row
+        return normalize_embeddings(np.stack(rows))
+
+    def result_for(self, fake_probability, frames=1):
+        """Apply this detector's threshold and uncertain band to a FAKE probability."""
+        return SpoofResult(classify(fake_probability, self.threshold, self.uncertain_margin), fake_probability,
+                           frames=frames)
+
+    def detect_burst(self, images, fusion=BURST_FUSION, embed=False):
+        """Score several frames of the same touch in one batched forward pass and fuse their scores.
+
+        A burst follows a first frame that detect() left UNCERTAIN, so the prefilter already had its say
+        before any extra frame was captured; only the CNN runs here.
+        """
+        if len(images) == 1:
+            return self.detect(images[0], embed)
+        try:
+            if not self.model:
+                return SpoofResult("Model not loaded")
+
+            # Crops can come out at different input sizes, each size is one batch
+            groups = {}
+            for tensor in (self.preprocess(image) for image in images):
+                groups.setdefault(tuple(tensor.shape), []).append(tensor)
+            scores = []
+            features = [] if embed else None
+            for tensors in groups.values():
+                scores.extend(self.score_batch(torch.stack(tensors), features).tolist())
+            self.stage_counts["cnn"] += 1
+            result = self.result_for(fuse_scores(scores, fusion), frames=len(images))
+            if embed:
+                mean = normalize_embeddings(torch.cat(features).numpy()).mean(axis=0, keepdims=True)
+                result.embedding = normalize_embeddings(mean)[0]
+            self.consecutive_errors = 0
+            return result
+        except Exception as e:
+            self.consecutive_errors += 1
+            print(f"Error in burst spoof detection: {e}")
+            return SpoofResult("Error")
+
+    def detect(self, image, embed=False):
+        """Check if the fingerprint (frame, PIL image or path) is LIVE, FAKE or UNCERTAIN.
+
+        With embed, the result also carries the frame's embedding from the same forward pass, unless the
+        prefilter settled the frame without one.
+        """
+        try:
+            # Cheap cascade stage first, only ambiguous frames pay for the CNN (and come with an embedding)
+            if self.prefilter is not None:
+                verdict, fake_probability = self.prefilter.decide(to_gray_array(image))
+                if verdict:
+                    self.stage_counts["prefilter"] += 1
+                    return SpoofResult(verdict, fake_probability, stage="prefilter")
+
+            if not self.model:
+                return SpoofResult("Model not loaded")
+
+            # Load and preprocess image
+            image_tensor = self.preprocess(image).unsqueeze(0)
+
+            # Single forward pass, the softmax gives the confidence for free
+            self.stage_counts["cnn"] += 1
+            features = [] if embed else None
+            result = self.result_for(float(self.score_batch(image_tensor, features)[0]))
+            if embed:
+                result.embedding = normalize_embeddings(features[0].numpy())[0]
+            self.consecutive_errors = 0
+            return result
+        except Exception as e:
+            self.consecutive_errors += 1
+            print(f"Error in spoof detection: {e}")
+            return SpoofResult("Error")
+
+
+def run_spoof_check(sensor, frame, capture_time, update_ui_callback=None):
+    """Spoof-check one touch on a sensor, "Disabled" when its anti-spoof is off.
+
+    The captured frame is checked on its own first. Only an UNCERTAIN verdict pays for a burst: with the
+    sensor's burst mode on, more frames of the same touch are captured and fused with it.
+    """
+    if not sensor.is_anti_spoof_enabled:
+        return "Disabled"
+    if update_ui_callback:
+        update_ui_callback("🔄 Performing spoof detection...")
+    spoof_detection_start = time.time()
+    spoof_status = sensor.spoof_detection_algorithm(frame)
+    if spoof_status.is_uncertain and sensor.is_burst_enabled:
+        if update_ui_callback:
+            update_ui_callback("🔄 Spoof check uncertain, keep your finger on the sensor...")
+        frames = sensor.capture_burst(frame, capture_time)
+        if len(frames) > 1:
+            spoof_status = sensor.spoof_detection_algorithm(frames)
+    spoof_detection_time = time.time() - spoof_detection_start
+    if update_ui_callback:
+        update_ui_callback(f"✅ Spoof detection completed in {spoof_detection_time:.2f} seconds")
+        if spoof_status.is_uncertain:
+            update_ui_callback("⚠️ Spoof check uncertain, additional checks recommended")
+    return spoof_status
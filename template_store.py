@@ -0,0 +1,404 @@
+import os
+import sys
+import time
+import zlib
+import json
+import base64
+import bisect
+import sqlite3
+import argparse
+
+# Host copy of the templates in sensor flash, so a replacement sensor or another station is provisioned with
+# one bulk push instead of re-enrolling every user. Templates are only portable between sensors of one type.
+# JSON packages carry the same templates and names between sites that do not share a store.
+TEMPLATE_STORE_PATH = "/home/live_finger/newtry27jan/templates.db"
+PACKAGE_FORMAT = 1           # Version of the JSON enrollment package written by export_package
+
+
+def template_checksum(template):
+    return f"{zlib.crc32(bytes(template)) & 0xffffffff:08x}"
+
+
+class TemplateStore:
+    """Templates and names per sensor type, plus the checksum last synced to each physical sensor."""
+    def __init__(self, path=TEMPLATE_STORE_PATH):
+        self.path = path
+        db = self.connect()
+        db.close()
+
+    def connect(self):
+        db = sqlite3.connect(self.path)
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS templates (
+                sensor_type TEXT NOT NULL,
+                template_position INTEGER NOT NULL,
+                name TEXT,
+                template BLOB NOT NULL,
+                checksum TEXT NOT NULL,
+                updated REAL NOT NULL,
+                PRIMARY KEY (sensor_type, template_position)
+            )
+        ''')
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS synced (
+                sensor_id TEXT NOT NULL,
+                template_position INTEGER NOT NULL,
+                checksum TEXT NOT NULL,
+                PRIMARY KEY (sensor_id, template_position)
+            )
+        ''')
+        return db
+
+    def entries(self, sensor_type):
+        """{slot: (name, template, checksum)} of one sensor type."""
+        db = self.connect()
+        try:
+            rows = db.execute('SELECT template_position, name, template, checksum FROM templates '
+                              'WHERE sensor_type = ?', (sensor_type,)).fetchall()
+        finally:
+            db.close()
+        return {slot: (name, bytes(template), checksum) for slot, name, template, checksum in rows}
+
+    def synced_checksums(self, sensor_id):
+        """{slot: checksum} of what was last pulled from or pushed to a sensor."""
+        db = self.connect()
+        try:
+            rows = db.execute('SELECT template_position, checksum FROM synced WHERE sensor_id = ?',
+                              (sensor_id,)).fetchall()
+        finally:
+            db.close()
+        return dict(rows)
+
+
+def invalidate_synced(slots, store_path=TEMPLATE_STORE_PATH):
+    """Forget the synced checksums of slots whose flash changed outside a sync, so they are compared again.
+
+    Rows of every physical sensor are dropped, which one holds the slot is not known here; that only costs
+    an extra transfer. Never fails the caller.
+    """
+    if not slots or not os.path.exists(store_path):
+        return
+    try:
+        db = sqlite3.connect(store_path)
+        try:
+            db.executemany('DELETE FROM synced WHERE template_position = ?', [(slot,) for slot in slots])
+            db.commit()
+        finally:
+            db.close()
+    except sqlite3.Error as e:
+        print(f"Failed to invalidate the synced state of {len(slots)} slots: {e}")
+
+
+def deletion_ranges(slots, occupied=None):
+    """Fewest (start, end) ranges covering slots, for sensors that delete a range with one command.
+
+    Empty slots between them are absorbed into a range; an occupied slot that is not being deleted
+    always splits it. Without occupancy only adjacent slots are merged.
+    """
+    slots = sorted(set(slots))
+    kept = sorted(set(occupied) - set(slots)) if occupied is not None else None
+    ranges = []
+    for slot in slots:
+        if ranges and (slot == ranges[-1][1] + 1 or kept is not None and
+                       bisect.bisect_left(kept, slot) == bisect.bisect_right(kept, ranges[-1][1])):
+            ranges[-1][1] = slot
+        else:
+            ranges.append([slot, slot])
+    return [tuple(r) for r in ranges]
+
+
+def read_names(db_path):
+    """{template_position: name} from a sensor database, empty if it has none yet."""
+    try:
+        db = sqlite3.connect(db_path)
+        try:
+            return dict(db.execute('SELECT template_position, name FROM fingerprints').fetchall())
+        finally:
+            db.close()
+    except sqlite3.Error:
+        return {}
+
+
+def claimed_templates(db_path, claim):
+    """(name, template_position) rows for a claimed identity: a fingerprint ID or an enrolled name."""
+    db = sqlite3.connect(db_path)
+    try:
+        cursor = db.cursor()
+        if str(claim).strip().isdigit():
+            cursor.execute('SELECT name, template_position FROM fingerprints WHERE id = ?', (int(claim),))
+        else:
+            cursor.execute('SELECT name, template_position FROM fingerprints WHERE name = ? COLLATE NOCASE',
+                           (str(claim).strip(),))
+        return cursor.fetchall()
+    finally:
+        db.close()
+
+
+def write_names(db_path, names):
+    """Register the names of pushed slots in the sensor database, in one transaction."""
+    db = sqlite3.connect(db_path)
+    try:
+        db.executemany('INSERT OR REPLACE INTO fingerprints (name, template_position) VALUES (?, ?)',
+                       [(name or f"User {slot}", slot) for slot, name in sorted(names.items())])
+        db.commit()
+    finally:
+        db.close()
+
+
+def delete_users(sensor, db_path, ids, update_ui_callback=None):
+    """Delete many users by database ID: range deletes on the sensor and one database commit.
+
+    The sensor needs delete_slots(slots) and drop_host_indexes(slots). Returns the number of users deleted.
+    """
+    start_time = time.time()
+    db = sqlite3.connect(db_path)
+    try:
+        cursor = db.cursor()
+        ids = list(ids)
+        rows = []
+        for i in range(0, len(ids), 500):  # Stay under SQLite's bound parameter limit
+            chunk = ids[i:i + 500]
+            cursor.execute(f'SELECT id, template_position FROM fingerprints WHERE id IN '
+                           f'({",".join("?" * len(chunk))})', chunk)
+            rows.extend(cursor.fetchall())
+        if not rows:
+            if update_ui_callback:
+                update_ui_callback("❌ No fingerprints found for the selected IDs.")
+            return 0
+
+        if update_ui_callback:
+            update_ui_callback(f"🔄 Deleting {len(rows)} fingerprints from sensor...")
+        deleted = sensor.delete_slots([slot for _, slot in rows])
+        cursor.executemany('DELETE FROM fingerprints WHERE id = ?',
+                           [(id,) for id, slot in rows if slot in deleted])
+        db.commit()
+        sensor.drop_host_indexes(sorted(deleted))
+
+        elapsed = time.time() - start_time
+        count = sum(slot in deleted for _, slot in rows)
+        if update_ui_callback:
+            if count:
+                update_ui_callback(f"✅ Deleted {count} fingerprints in {elapsed:.2f} seconds "
+                                   f"({elapsed / count * 1000:.1f} s per 1000 users)")
+            if count < len(rows):
+                update_ui_callback(f"❌ {len(rows) - count} templates could not be deleted from the sensor.")
+        return count
+    except Exception as e:
+        if update_ui_callback:
+            update_ui_callback(f"❌ Failed to delete fingerprints: {e}")
+        return 0
+    finally:
+        db.close()
+
+
+def pull(sensor, store, sensor_id, names, full=False):
+    """Copy new and changed sensor templates into the store.
+
+    Slots whose occupancy and last synced checksum still agree are not transferred again, unless full.
+    Enrollment, deletion and template writes drop the synced checksum of their slots (invalidate_synced),
+    so a re-enrolled slot is always transferred. Returns (pulled, unchanged, failed) slot counts.
+    """
+    sensor_type = sensor.sensor_type
+    occupied = sensor.template_slots()
+    stored = store.entries(sensor_type)
+    synced = store.synced_checksums(sensor_id)
+    todo = sorted(slot for slot in occupied
+                  if full or slot not in stored or synced.get(slot) != stored[slot][2])
+
+    rows, failed = [], 0
+    for slot in todo:
+        template = sensor.read_template(slot)
+        if template is None:
+            failed += 1
+            continue
+        rows.append((sensor_type, slot, names.get(slot), template, template_checksum(template), time.time()))
+
+    db = store.connect()
+    try:
+        db.executemany('INSERT OR REPLACE INTO templates (sensor_type, template_position, name, template, checksum, '
+                       'updated) VALUES (?, ?, ?, ?, ?, ?)', rows)
+        db.executemany('INSERT OR REPLACE INTO synced (sensor_id, template_position, checksum) VALUES (?, ?, ?)',
+                       [(sensor_id, row[1], row[4]) for row in rows])
+        # Names can change without the template changing
+        db.executemany('UPDATE templates SET name = ? WHERE sensor_type = ? AND template_position = ?',
+                       [(name, sensor_type, slot) for slot, name in names.items() if slot in occupied])
+        db.execute(f'DELETE FROM synced WHERE sensor_id = ? AND template_position NOT IN '
+                   f'({",".join("?" * len(occupied))})', (sensor_id, *sorted(occupied)))
+        db.commit()
+    finally:
+        db.close()
+    return len(rows), len(occupied) - len(todo), failed
+
+
+def push(sensor, store, sensor_id, db_path, full=False, verify=True):
+    """Write stored templates that the sensor lacks or holds in a different version, then register their names.
+
+    With verify, every written slot is read back and compared by checksum. With full, the sensor's copy of
+    every slot is read and compared instead of trusting the synced checksums. An occupied slot without a
+    synced checksum was enrolled or changed on the sensor since the last sync: it is only overwritten with
+    full, otherwise it is reported as failed so a newer enrollment is not replaced by an older template.
+    Returns (pushed, unchanged, failed) slot counts.
+    """
+    stored = store.entries(sensor.sensor_type)
+    occupied = sensor.template_slots()
+    synced = store.synced_checksums(sensor_id)
+    todo, conflicts, matching = [], [], []
+    for slot, (_, _, checksum) in sorted(stored.items()):
+        if slot not in occupied:
+            todo.append(slot)
+        elif full or slot not in synced:
+            current = sensor.read_template(slot)
+            if current is not None and template_checksum(current) == checksum:
+                matching.append((sensor_id, slot, checksum))
+            elif full:
+                todo.append(slot)
+            else:
+                conflicts.append(slot)
+                print(f"❌ Template {slot} changed on the sensor since the last sync, pull it or push --full")
+        elif synced[slot] != checksum:
+            todo.append(slot)
+
+    written, failed = [], len(conflicts)
+    for slot in todo:
+        _, template, checksum = stored[slot]
+        ok = sensor.write_template(slot, template)
+        if ok and verify:
+            readback = sensor.read_template(slot)
+            ok = readback is not None and template_checksum(readback) == checksum
+        if ok:
+            written.append((sensor_id, slot, checksum))
+        else:
+            failed += 1
+            print(f"❌ Template {slot} could not be written and verified")
+
+    db = store.connect()
+    try:
+        db.executemany('INSERT OR REPLACE INTO synced (sensor_id, template_position, checksum) VALUES (?, ?, ?)',
+                       written + matching)
+        db.commit()
+    finally:
+        db.close()
+    failed_slots = set(todo) - {slot for _, slot, _ in written} | set(conflicts)
+    write_names(db_path, {slot: name for slot, (name, _, _) in stored.items() if slot not in failed_slots})
+    return len(written), len(stored) - len(todo) - len(conflicts), failed
+
+
+def export_package(sensor, db_path, path):
+    """Write every enrolled template and its name to a JSON package; returns (exported, failed)."""
+    names = read_names(db_path)
+    users, failed = [], 0
+    for slot in sorted(sensor.template_slots()):
+        template = sensor.read_template(slot)
+        if template is None:
+            failed += 1
+            continue
+        users.append({"template_position": slot, "name": names.get(slot),
+                      "template": base64.b64encode(bytes(template)).decode("ascii")})
+    with open(path, "w") as f:
+        json.dump({"format": PACKAGE_FORMAT, "sensor_type": sensor.sensor_type, "exported": time.time(),
+                   "users": users}, f)
+    return len(users), failed
+
+
+def import_package(sensor, db_path, path, overwrite=False):
+    """Enroll the users of a package at their template positions, registering names in one transaction.
+
+    Occupied positions are skipped unless overwrite. Returns (imported, skipped, failed).
+    """
+    with open(path) as f:
+        package = json.load(f)
+    if package.get("format") != PACKAGE_FORMAT:
+        raise ValueError(f"Unsupported package format {package.get('format')}")
+    if package["sensor_type"] != sensor.sensor_type:
+        raise ValueError(f"Package holds {package['sensor_type']} templates, sensor is {sensor.sensor_type}")
+    occupied = sensor.template_slots()
+    names, skipped, failed = {}, 0, 0
+    for user in package["users"]:
+        slot = user["template_position"]
+        if slot in occupied and not overwrite:
+            skipped += 1
+            continue
+        if sensor.write_template(slot, base64.b64decode(user["template"])):
+            names[slot] = user["name"]
+        else:
+            failed += 1
+            print(f"❌ Template {slot} could not be written")
+    write_names(db_path, names)
+    return len(names), skipped, failed
+
+
+def open_sensor(sensor_type, port, **options):
+    """Open a sensor for syncing; returns (sensor, its database path, registered names).
+
+    The sensor classes recreate their name table when they start, so names are read first and put back.
+    Options (archive_writer, capture_log_dir, spoof_detector) are passed on to the sensor class.
+    """
+    if sensor_type == "optical":
+        import OptSensor
+        db_path = OptSensor.DATABASE_PATH
+        names = read_names(db_path)
+        sensor = OptSensor.FingerprintSensor(port or '/dev/ttyUSB1', **options)
+    else:
+        import CapSensor
+        db_path = CapSensor.DATABASE_PATH
+        names = read_names(db_path)
+        sensor = CapSensor.AnotherSensor(port or '/dev/ttyUSB0', **options)
+    write_names(db_path, names)
+    return sensor, db_path, names
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sync, export, import and bulk delete sensor flash templates")
+    parser.add_argument("command", choices=["pull", "push", "export", "import", "delete"])
+    parser.add_argument("--sensor", choices=["capacitive", "optical"], default="capacitive")
+    parser.add_argument("--port", default=None)
+    parser.add_argument("--sensor-id", default=None, help="Name of this physical sensor (default: type and port)")
+    parser.add_argument("--store", default=TEMPLATE_STORE_PATH)
+    parser.add_argument("--full", action="store_true", help="Compare every slot instead of trusting the last sync")
+    parser.add_argument("--no-verify", action="store_true", help="Skip reading back pushed templates")
+    parser.add_argument("--package", help="JSON package to export to or import from")
+    parser.add_argument("--overwrite", action="store_true", help="Import over occupied template positions")
+    parser.add_argument("--ids", type=int, nargs="+", default=[], help="Database IDs to delete")
+    parser.add_argument("--all", action="store_true", help="Delete every registered user")
+    args = parser.parse_args(argv)
+    if args.command in ("export", "import") and not args.package:
+        parser.error(f"{args.command} needs --package")
+    if args.command == "delete" and not (args.ids or args.all):
+        parser.error("delete needs --ids or --all")
+
+    sensor, db_path, names = open_sensor(args.sensor, args.port)
+    sensor_id = args.sensor_id or f"{sensor.sensor_type}:{args.port or 'default'}"
+    store = TemplateStore(args.store)
+    start = time.time()
+    try:
+        if args.command == "pull":
+            done, unchanged, failed = pull(sensor, store, sensor_id, names, args.full)
+        elif args.command == "push":
+            done, unchanged, failed = push(sensor, store, sensor_id, db_path, args.full, not args.no_verify)
+        elif args.command == "export":
+            done, failed = export_package(sensor, db_path, args.package)
+            unchanged = 0
+        elif args.command == "import":
+            done, unchanged, failed = import_package(sensor, db_path, args.package, args.overwrite)
+        else:
+            ids = args.ids
+            if args.all:
+                db = sqlite3.connect(db_path)
+                try:
+                    ids = [id for (id,) in db.execute('SELECT id FROM fingerprints')]
+                finally:
+                    db.close()
+            done = sensor.delete_fingers(ids, print)
+            unchanged, failed = 0, len(ids) - done
+    finally:
+        sensor.cleanup()
+    elapsed = time.time() - start
+    rate = f", {elapsed / done * 1000:.1f} s per 1000 users" if done else ""
+    print(f"✅ {args.command}: {done} users, {unchanged} unchanged, {failed} failed "
+          f"in {elapsed:.1f} seconds{rate}")
+    return 1 if failed else 0
+
+
+# Example usage: python template_store.py pull --sensor capacitive --port /dev/ttyUSB0
+if __name__ == "__main__":
+    sys.exit(main())